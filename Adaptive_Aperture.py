@@ -0,0 +1,145 @@
+import os
+import json
+from math import ceil
+from datetime import datetime
+from collections import OrderedDict
+import numpy as np
+from Agilent_E4980A_Constants import APERTURE_BASE_TIME, APERTURE_CYCLES, MEASURE_TIME_DICT
+from Static_Functions import snap_frequency
+
+# Measuring time and averaging chosen per frequency band instead of one setting for the whole sweep. The noise of a
+#  single reading is measured for each band and measuring time (shortest first) by repeated readings at the band
+#  centre, and the fastest setting whose expected noise (single reading noise / sqrt(averaging)) meets the target
+#  is used. The noise measurements are cached per sample and fixture, so later runs only probe bands they have not
+#  seen.
+
+DEFAULT_APERTURE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.probe_station', 'aperture_cache.json')
+
+# Edges of the frequency bands [Hz] that each get one setting
+APERTURE_BANDS = [20.0, 100.0, 1e3, 1e4, 1e5, 1e6, 2e6]
+# Measuring times by display name, shortest first, with the number each is recorded as in the Aperture column
+APERTURE_CODES = OrderedDict([('Short', 1), ('Medium', 2), ('Long', 3)])
+# Largest averaging the E4980A accepts
+MAX_AVERAGING = 256
+# Readings per measuring time when the noise of a band is measured
+PROBE_READINGS = 6
+# Relative noise (standard deviation over mean of the primary value) asked for by default
+DEFAULT_NOISE_TARGET = 1e-3
+
+
+def reading_time(freq, time, averaging):
+    # Approximate seconds for one point, time is a key of MEASURE_TIME_DICT
+    aperture = MEASURE_TIME_DICT[time]
+    return averaging * (APERTURE_BASE_TIME[aperture] + APERTURE_CYCLES[aperture] / freq)
+
+
+def relative_noise(values):
+    values = np.asarray(values, dtype=float)
+    mean = abs(np.mean(values)) if len(values) else 0.0
+    if len(values) < 2 or not mean > 0:
+        return float('inf')
+
+    return float(np.std(values, ddof=1) / mean)
+
+
+def choose_setting(noises, freq, target):
+    # Fastest (time, averaging) among the measured times whose noise meets target, or the quietest one at the
+    #  largest averaging if none can. noises maps measuring time to the relative noise of a single reading.
+    options = []
+    for time, noise in noises.items():
+        averaging = max(1, int(ceil((noise / target) ** 2))) if np.isfinite(noise) else MAX_AVERAGING + 1
+        if averaging <= MAX_AVERAGING:
+            options.append((reading_time(freq, time, averaging), time, averaging))
+    if options:
+        return min(options)[1:]
+
+    return min(noises, key=noises.get), MAX_AVERAGING
+
+
+def needs_probe(noises, target):
+    # Times are measured shortest first and the probe stops at the first that meets the target without averaging,
+    #  so a band only has to be measured again if none of its times does and some were not measured
+    return (not any(noise <= target for noise in noises.values())
+            and any(time not in noises for time in APERTURE_CODES))
+
+
+def band_index(freqs):
+    # Band of each frequency, frequencies outside APERTURE_BANDS go to the nearest band
+    return np.clip(np.searchsorted(APERTURE_BANDS, freqs, side='right') - 1, 0, len(APERTURE_BANDS) - 2)
+
+
+def band_name(band):
+    return '{:g}-{:g}'.format(APERTURE_BANDS[band], APERTURE_BANDS[band + 1])
+
+
+class AperturePlanner(object):
+    # Chooses and caches the per band settings of adaptive aperture sweeps, see the notes at the top. The cache is
+    #  kept in path (None to neither load nor save it), keyed by sample_key().
+    def __init__(self, path=DEFAULT_APERTURE_CACHE_PATH):
+        self.path = path
+        self.cache = {}
+
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, 'r') as file:
+                self.cache = dict(json.load(file))
+        except (OSError, ValueError, TypeError):
+            self.cache = {}
+
+    def save(self):
+        if self.path is None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w') as file:
+                json.dump(self.cache, file, indent=2)
+        except OSError as error:
+            print('Could not write aperture cache to {}: {}'.format(self.path, error))
+
+    @staticmethod
+    def sample_key(sample, fixture, function, imp_range, osc):
+        # Noise depends on the sample and fixture as much as on what is measured and how hard it is driven
+        return '|'.join(str(part) for part in (fixture, sample, function, imp_range, osc))
+
+    def probe_band(self, lcr, freq, noises, target):
+        # Measure the single reading noise at freq for the times not yet in noises, shortest first, until one meets
+        #  target. lcr has to be set up for triggered acquisition.
+        for time in APERTURE_CODES:
+            if time not in noises:
+                lcr.measurement_aperture(time, 1)
+                noises[time] = relative_noise([lcr.get_triggered_data(freq)[1] for _ in range(PROBE_READINGS)])
+            if noises[time] <= target:
+                break
+
+        return noises
+
+    def band_settings(self, lcr, key, start, stop, target=DEFAULT_NOISE_TARGET):
+        # (time, averaging) by band for a sweep from start to stop, probing the bands the cache can not answer.
+        #  Each band is probed and timed at the centre of the part of it that is swept.
+        low, high = sorted((float(start), float(stop)))
+        entry = self.cache.setdefault(key, {'bands': {}})
+        settings = {}
+        probed = False
+        for band in range(band_index(low), band_index(high) + 1):
+            freq = float(snap_frequency(np.sqrt(max(low, APERTURE_BANDS[band]) * min(high, APERTURE_BANDS[band + 1]))))
+            noises = entry['bands'].get(band_name(band), {})
+            if needs_probe(noises, target):
+                if not probed:
+                    lcr.setup_triggered_acquisition()
+                    probed = True
+                noises = self.probe_band(lcr, freq, dict(noises), target)
+                entry['bands'][band_name(band)] = noises
+            settings[band] = choose_setting(noises, freq, target)
+
+        if probed:
+            lcr.end_triggered_acquisition()
+            entry['updated'] = datetime.now().isoformat(timespec='seconds')
+            self.save()
+
+        return settings
@@ -0,0 +1,93 @@
+import numpy as np
+from Static_Functions import snap_frequency
+
+# Adaptive frequency sweeps: a coarse logarithmic pass, then rounds of extra points in the intervals where the measured
+#  values bend the most (where a straight line between the points would be furthest off), until the point budget is
+#  spent or every interval is within tolerance. Flat decades keep their coarse spacing and the points go to the
+#  dispersion regions.
+# Experimental: on simulated Debye and two-relaxation spectra the refined sweep is about as accurate as a
+#  logarithmic sweep with the same number of points, not yet one with twice as many, so it is not offered as a way
+#  to save points.
+
+# Share of the point budget spent on the coarse pass, and the smallest coarse pass
+COARSE_FRACTION = 0.4
+MIN_COARSE_POINTS = 5
+# Largest estimated interpolation error allowed in an interval, as a fraction of the range of each measured value
+DEFAULT_TOLERANCE = 0.002
+# A round adds at most this share of the points measured so far, so the curvature estimate keeps up with the points
+ROUND_FRACTION = 0.25
+# Intervals narrower than this [decades] are not split any further
+MIN_INTERVAL_DECADES = 1e-3
+
+
+def coarse_points(budget):
+    return min(budget, max(MIN_COARSE_POINTS, int(round(budget * COARSE_FRACTION))))
+
+
+def normalise(values):
+    # Values scaled to 0..1 over the sweep. One-signed values that span more than a decade are compared in log, so a
+    #  dispersion in the small part of a value is not lost next to its large part.
+    values = np.asarray(values, dtype=float)
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return np.zeros_like(values)
+
+    if (finite > 0).all() and finite.max() > 10 * finite.min():
+        values = np.log10(values)
+    elif (finite < 0).all() and finite.min() < 10 * finite.max():
+        values = np.log10(-values)
+
+    low, high = np.nanmin(values), np.nanmax(values)
+    if not high > low:
+        return np.zeros_like(values)
+
+    return (values - low) / (high - low)
+
+
+def interval_losses(freqs, value_columns):
+    # Estimated error of drawing each interval between neighbouring (ascending) frequencies as a straight line,
+    #  h^2 |y''| / 8 with h the interval width and y'' the larger second difference at its ends, in log frequency and
+    #  normalised values, the largest over all values. Intervals next to unreadable points (nan, overloads) count as
+    #  resolved.
+    x = np.log10(np.asarray(freqs, dtype=float))
+    losses = np.zeros(max(len(x) - 1, 0))
+    if len(x) < 3:
+        return losses
+
+    x = (x - x[0]) / (x[-1] - x[0])
+    width = np.diff(x)
+    for values in value_columns:
+        y = normalise(values)
+        slope = np.diff(y) / width
+        curvature = np.empty_like(y)
+        curvature[1:-1] = 2 * np.abs(np.diff(slope)) / (width[1:] + width[:-1])
+        curvature[0] = curvature[1]
+        curvature[-1] = curvature[-2]
+
+        error = width ** 2 * np.maximum(curvature[:-1], curvature[1:]) / 8
+        losses = np.fmax(losses, np.nan_to_num(error, nan=0.0))
+
+    losses[np.diff(np.log10(np.asarray(freqs, dtype=float))) < MIN_INTERVAL_DECADES] = 0.0
+    return losses
+
+
+def refine_frequencies(freqs, value_columns, budget, tolerance=DEFAULT_TOLERANCE):
+    # Frequencies for the next round of an adaptive sweep: the log midpoints of the intervals over tolerance, worst
+    #  first and at most budget (or a ROUND_FRACTION of the points so far) of them, in ascending order. Empty when the
+    #  sweep is done.
+    freqs = np.asarray(freqs, dtype=float)
+    budget = min(budget, max(1, int(len(freqs) * ROUND_FRACTION)))
+    if budget <= 0 or len(freqs) < 3:
+        return []
+
+    order = np.argsort(freqs)
+    freqs = freqs[order]
+    losses = interval_losses(freqs, [np.asarray(values, dtype=float)[order] for values in value_columns])
+
+    worst = np.flatnonzero(losses > tolerance)
+    worst = worst[np.argsort(-losses[worst], kind='stable')][:budget]
+    midpoints = snap_frequency(np.sqrt(freqs[worst] * freqs[worst + 1]))
+    # Midpoints that snap onto an end of their interval would only measure a frequency again
+    midpoints = midpoints[(midpoints > freqs[worst]) & (midpoints < freqs[worst + 1])]
+
+    return sorted(midpoints.tolist())
@@ -1,20 +1,51 @@
 from Agilent_E4980A_Constants import *
 
+import numpy as np
 import visa
 from pyvisa.errors import VisaIOError
 from PyQt5.QtCore import QObject, pyqtSignal
-from time import sleep
+from time import perf_counter
+from contextlib import contextmanager
+from Static_Functions import parse_ieee_block, ieee_block_size, snap_frequency
+from Visa_IO_Policy import VisaIOPolicy, InstrumentIOError
+from Instrument_Discovery import get_discovery
+
+
+def setting_value(value):
+    # Normalize a setting so that e.g. '0.05' from the setup table and 0.05 compare equal in the shadow state
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
 
 
 class AgilentE4980A(QObject):
     # This signal needs to be defined before the __init__ in order to allow it to work
     new_data = pyqtSignal(list)
     
-    def __init__(self, parent=None, gpib_addr=None):
+    def __init__(self, parent=None, gpib_addr=None, rm=None):
         super().__init__(parent)
 
-        self.rm = visa.ResourceManager()
+        # rm can be any object with the ResourceManager interface, e.g. Instrument_Simulators.SimulatedResourceManager
+        self.rm = rm if rm is not None else visa.ResourceManager()
         self.lcr_addr = gpib_addr
+        # Fetched data is sent as IEEE blocks of 64 bit floats when True, ASCII otherwise
+        self.binary_transfer = False
+        # Shadow copy of the settings last written to the LCR, used to skip redundant writes and readback queries
+        self.state = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # Commands collected while a batch is open, None when writes go straight to the bus
+        self.batch_commands = None
+        self.round_trips_saved = 0
+        # Seconds from request to data of the points measured with get_triggered_data: the last one and running
+        #  statistics, so long runs do not keep every value
+        self.last_acquisition_latency = 0.0
+        self.acquisition_count = 0
+        self.acquisition_latency_total = 0.0
+        self.acquisition_latency_max = 0.0
+        # Bounded retries, per command class timeouts and a circuit breaker for every bus transaction
+        self.io_policy = VisaIOPolicy('LCR')
 
         if self.lcr_addr is None:
             try:
@@ -23,24 +54,106 @@ class AgilentE4980A(QObject):
                 print("Could not connect to lcr. GPIB address not found.")
                 self.manual_connect_lcr()
         else:
-            self.lcr = visa.ResourceManager().open_resource(self.lcr_addr)
+            self.lcr = self.open_lcr(self.lcr_addr)
+
+    def open_lcr(self, addr):
+        lcr = self.rm.open_resource(addr)
+        # Raw socket instruments (e.g. the simulator server) need explicit message terminations
+        if addr.upper().endswith('::SOCKET'):
+            lcr.read_termination = '\n'
+            lcr.write_termination = '\n'
+        return lcr
 
     def connect_lcr(self):
-        instruments = self.rm.list_resources()
-
-        for instr in instruments:
-            curr_instr = self.rm.open_resource(instr, open_timeout=0.5)
-            # if the first 29 characters of the returned string match the LCR ID return
-            try:
-                if curr_instr.query("*IDN?")[0:28] == ID_STR:
-                    return curr_instr
-                else:
-                    try:
-                        curr_instr.close()
-                    except AttributeError:
-                        print('Error closing instrument that should be open')
-            except VisaIOError:
-                curr_instr.close()
+        # Look the LCR up by its ID string through the shared (cached, parallel) instrument discovery
+        self.lcr_addr = get_discovery(self.rm).find(ID_STR)
+        if self.lcr_addr is None:
+            print('No instrument with ID "{}" found'.format(ID_STR))
+            return None
+
+        return self.open_lcr(self.lcr_addr)
+
+    def write(self, command):
+        # Raises InstrumentIOError once the I/O policy gives up on the command
+        if self.batch_commands is not None:
+            self.batch_commands.append(command)
+        else:
+            self.io_policy.write(self.lcr, command)
+
+    def io_stats(self):
+        return self.io_policy.stats()
+
+    @contextmanager
+    def batch(self, opc=False):
+        # Collect every write made inside the with block (any method called with write_or_build='write') and send
+        #  them as one semicolon joined SCPI message when the block exits. Queries must not be made inside a batch.
+        #  With opc=True the message ends in *OPC? so the block only returns once the LCR has applied everything.
+        #  Raises InstrumentIOError if the message can not be sent.
+        commands = []
+        self.batch_commands = commands
+        try:
+            yield self
+        except BaseException:
+            # The queued settings are already in the shadow state but were never sent
+            self.invalidate_cache()
+            raise
+        finally:
+            self.batch_commands = None
+
+        if commands:
+            self.send_batch(commands, opc)
+
+    def send_batch(self, commands, opc=False):
+        message = ';'.join(commands)
+        try:
+            if opc:
+                self.io_policy.query(self.lcr, message + ';*OPC?')
+            else:
+                self.io_policy.write(self.lcr, message)
+        except InstrumentIOError:
+            # None of the settings in the message can be trusted to have been applied
+            self.invalidate_cache()
+            raise
+
+        self.round_trips_saved += len(commands) - 1
+
+    def write_setting(self, key, value, command):
+        # Only write the setting if the shadow state does not already hold the same value
+        if key in self.state and self.state[key] == value:
+            self.cache_hits += 1
+            return
+
+        self.cache_misses += 1
+        try:
+            self.write(command)
+        except InstrumentIOError:
+            # The instrument state is unknown after a failed write
+            self.invalidate_cache()
+            raise
+        self.state[key] = value
+
+    def get_setting(self, key):
+        # Returns None if the setting has not been written since the cache was last invalidated
+        if key in self.state:
+            self.cache_hits += 1
+            return self.state[key]
+        else:
+            self.cache_misses += 1
+            return None
+
+    def invalidate_cache(self):
+        self.state = {}
+
+    def cache_stats(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses}
+
+    def reset(self):
+        try:
+            self.write('*RST')
+        except InstrumentIOError as error:
+            print('Error on resetting LCR: {}'.format(error.abbreviation))
+        self.invalidate_cache()
+        self.binary_transfer = False
 
     def impedance_range(self, imp_range, write_or_build='write'):
         if imp_range == 'auto':
@@ -53,10 +166,9 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting impedance range: {}\nRetrying...'.format(error.abbreviation))
-                self.impedance_range(imp_range)
+                self.write_setting('range', imp_range, command)
+            except InstrumentIOError as error:
+                print('Error on setting impedance range: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
@@ -69,10 +181,9 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR function: {}\nRetrying...'.format(error.abbreviation))
-                self.function(function)
+                self.write_setting('function', FUNC_DICT[function], command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR function: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
@@ -85,10 +196,9 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR trigger source: {}\nRetrying...'.format(error.abbreviation))
-                self.trigger_source(source)
+                self.write_setting('trigger_source', TRIG_SOURCE_DICT[source], command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR trigger source: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
@@ -97,22 +207,231 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on initializing LCR trigger: {}\nRetrying...'.format(error.abbreviation))
-                self.trigger_init()
+                self.write(command)
+            except InstrumentIOError as error:
+                print('Error on initializing LCR trigger: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
+    def trigger_immediate(self, write_or_build='write'):
+        command = ':TRIG:IMM'
+
+        if write_or_build.lower() == 'write':
+            try:
+                self.write(command)
+            except InstrumentIOError as error:
+                print('Error on triggering LCR: {}'.format(error.abbreviation))
+        elif write_or_build.lower() == 'build':
+            return command
+
+    def continuous_init(self, state, write_or_build='write'):
+        if state.lower() == 'on':
+            state = 'ON'
+        elif state.lower() == 'off':
+            state = 'OFF'
+
+        command = ':INIT:CONT {}'.format(state)
+
+        if write_or_build.lower() == 'write':
+            try:
+                self.write_setting('continuous_init', state, command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR continuous initiation: {}'.format(error.abbreviation))
+        elif write_or_build.lower() == 'build':
+            return command
+
+    def display_page(self, page, write_or_build='write'):
+        try:
+            command = ':DISP:PAGE {}'.format(DISPLAY_PAGE_DICT[page])
+        except KeyError:
+            print('Invalid display page: {}'.format(page))
+            return
+
+        if write_or_build.lower() == 'write':
+            try:
+                self.write_setting('display_page', DISPLAY_PAGE_DICT[page], command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR display page: {}'.format(error.abbreviation))
+        elif write_or_build.lower() == 'build':
+            return command
+
+    def list_mode(self, mode, write_or_build='write'):
+        try:
+            command = ':LIST:MODE {}'.format(LIST_MODE_DICT[mode])
+        except KeyError:
+            print('Invalid list sweep mode: {}'.format(mode))
+            return
+
+        if write_or_build.lower() == 'write':
+            try:
+                self.write_setting('list_mode', LIST_MODE_DICT[mode], command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR list sweep mode: {}'.format(error.abbreviation))
+        elif write_or_build.lower() == 'build':
+            return command
+
+    def list_frequencies(self, freqs, write_or_build='write'):
+        if len(freqs) > LIST_SWEEP_MAX_POINTS:
+            print('Too many list sweep points supplied ({} > {})'.format(len(freqs), LIST_SWEEP_MAX_POINTS))
+            return
+
+        command = ':LIST:FREQ {}'.format(','.join(str(freq) for freq in freqs))
+
+        if write_or_build.lower() == 'write':
+            try:
+                self.write_setting('list_frequencies', tuple(setting_value(freq) for freq in freqs), command)
+            except InstrumentIOError as error:
+                print('Error on loading LCR list sweep frequencies: {}'.format(error.abbreviation))
+        elif write_or_build.lower() == 'build':
+            return command
+
+    def setup_list_sweep(self, step_delay=0):
+        # Put the LCR into sequential list sweep mode: one trigger measures every point in the list, with the step
+        #  delay applied before each point.
+        with self.batch(opc=True):
+            self.display_page('List Sweep')
+            self.list_mode('Sequential')
+            self.step_delay(step_delay)
+            self.trigger_source('Bus')
+            self.continuous_init('on')
+
+    def end_list_sweep(self):
+        # Return to the single point measurement page with free running triggers for the live readouts
+        with self.batch():
+            self.display_page('Measurement')
+            self.trigger_source('Internal')
+
+    def iter_list_sweep_data(self, freqs, timeout_per_point=2000):
+        # Measure every frequency in freqs with one trigger per list (the list table holds at most
+        #  LIST_SWEEP_MAX_POINTS, so longer sweeps are run as several lists). Yields the rows of each list as it is
+        #  measured, one [freq, val1, val2, status] row per frequency in the same layout as get_data, so callers can
+        #  stop between lists.
+        freqs = snap_frequency(freqs).tolist()
+        for chunk_start in range(0, len(freqs), LIST_SWEEP_MAX_POINTS):
+            chunk = freqs[chunk_start:chunk_start + LIST_SWEEP_MAX_POINTS]
+            self.write_setting('list_frequencies', tuple(setting_value(freq) for freq in chunk),
+                               self.list_frequencies(chunk, write_or_build='build'))
+            yield self.fetch_list_sweep(chunk, timeout_per_point)
+
+    def get_list_sweep_data(self, freqs, timeout_per_point=2000):
+        # The whole sweep of iter_list_sweep_data as one list of rows
+        return [row for chunk in self.iter_list_sweep_data(freqs, timeout_per_point) for row in chunk]
+
+    def fetch_list_sweep(self, freqs, timeout_per_point=2000):
+        # Raises InstrumentIOError if the LCR cannot be triggered or read
+        try:
+            self.write(self.trigger_immediate(write_or_build='build'))
+            # Give the instrument long enough to finish the whole list before the fetch times out
+            rec_data = self.query_values(':FETC?', timeout=timeout_per_point * len(freqs))
+        except InstrumentIOError as error:
+            self.invalidate_cache()
+            print('Error on retrieving list sweep data from LCR: {}'.format(error.abbreviation))
+            raise
+
+        # Each point is returned as data A, data B, status and the comparator result
+        rec_data = rec_data[:len(rec_data) - len(rec_data) % len(freqs)].reshape(len(freqs), -1)[:, :3]
+        data = []
+        for freq, values in zip(freqs, rec_data.tolist()):
+            point = [freq] + values
+            self.new_data.emit(point)
+            data.append(point)
+
+        return data
+
+    def setup_triggered_acquisition(self):
+        # Bus triggering means the LCR only measures when told to, so *TRG returns exactly one fresh point
+        with self.batch(opc=True):
+            self.trigger_source('Bus')
+            self.continuous_init('on')
+
+    def end_triggered_acquisition(self):
+        self.trigger_source('Internal')
+
+    def get_triggered_data(self, freq=None, timeout=10000):
+        # Set the frequency (skipped if unchanged) and trigger with *TRG, which the LCR answers with the measurement
+        #  result as soon as it is complete. Needs setup_triggered_acquisition first.
+        #  Raises InstrumentIOError if the LCR cannot be triggered or read.
+        start = perf_counter()
+        try:
+            if freq is not None:
+                freq = float(snap_frequency(freq))
+                self.write_setting('frequency', freq, self.signal_frequency(freq, 'build'))
+            rec_data = self.query_values('*TRG', timeout=timeout).tolist()[:3]
+        except InstrumentIOError as error:
+            self.invalidate_cache()
+            print('Error on triggered LCR measurement: {}'.format(error.abbreviation))
+            raise
+
+        self.record_acquisition_latency(perf_counter() - start)
+        rec_data.insert(0, self.get_signal_frequency())
+        self.new_data.emit(rec_data)
+        return rec_data
+
+    def record_acquisition_latency(self, latency):
+        self.last_acquisition_latency = latency
+        self.acquisition_count += 1
+        self.acquisition_latency_total += latency
+        self.acquisition_latency_max = max(self.acquisition_latency_max, latency)
+
+    def acquisition_latency_stats(self):
+        if not self.acquisition_count:
+            return {'count': 0, 'mean': 0.0, 'max': 0.0}
+        return {'count': self.acquisition_count,
+                'mean': self.acquisition_latency_total / self.acquisition_count,
+                'max': self.acquisition_latency_max}
+
+    def data_format(self, data_format, write_or_build='write'):
+        try:
+            command = ':FORM:DATA {}'.format(DATA_FORMAT_DICT[data_format])
+        except KeyError:
+            print('Invalid data format: {}'.format(data_format))
+            return
+
+        if write_or_build.lower() == 'write':
+            try:
+                self.write_setting('data_format', DATA_FORMAT_DICT[data_format], command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR data format: {}'.format(error.abbreviation))
+        elif write_or_build.lower() == 'build':
+            return command
+
+    def set_binary_transfer(self, enable: bool):
+        # Big endian (:FORM:BORD NORM) is the instrument default and is what parse_ieee_block expects
+        if enable:
+            self.write_setting('byte_order', 'NORM', ':FORM:BORD NORM')
+            self.data_format('Binary')
+        else:
+            self.data_format('ASCII')
+        self.binary_transfer = enable
+
+    def query_values(self, command, timeout=None):
+        # Send a data query and return the response as a numpy array of floats. Binary responses are decoded
+        #  straight from the IEEE block, so there is no per-field float conversion. Garbled or truncated responses
+        #  are retried by the I/O policy along with bus errors.
+        if self.binary_transfer:
+            def transaction(cmd):
+                self.lcr.write(cmd)
+                raw = self.lcr.read_raw()
+                # With a termination character set (socket connections) a newline byte inside the block ends the
+                #  read early, so keep reading until the whole block has arrived
+                while len(raw) < ieee_block_size(raw):
+                    raw += self.lcr.read_raw()
+                return parse_ieee_block(raw)
+        else:
+            def transaction(cmd):
+                return np.array(self.lcr.query(cmd).rstrip().split(','), dtype=float)
+
+        return self.io_policy.call(self.lcr, transaction, command, 'fetch', timeout=timeout,
+                                   retry_on=(VisaIOError, ValueError))
+
     def trigger_delay(self, delay, write_or_build='write'):
         command = ':TRIG:TDEL {}'.format(delay)
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR trigger delay: {}\nRetrying...'.format(error.abbreviation))
-                self.trigger_delay(delay)
+                self.write_setting('trigger_delay', setting_value(delay), command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR trigger delay: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
@@ -121,10 +440,9 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR step delay: {}\nRetrying...'.format(error.abbreviation))
-                self.function(delay)
+                self.write_setting('step_delay', setting_value(delay), command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR step delay: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
@@ -137,33 +455,40 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR measurement aperature: {}\nRetrying...'.format(error.abbreviation))
-                self.function(time, avg)
+                self.write_setting('aperture', (MEASURE_TIME_DICT[time], setting_value(avg)), command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR measurement aperature: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
     def signal_frequency(self, freq, write_or_build='write'):
+        # The frequency is rounded to the LCR resolution here, so the shadow state holds the frequency the LCR really
+        #  uses and get_signal_frequency does not need to ask for it
+        freq = float(snap_frequency(float(freq)))
         command = ':FREQ {}'.format(freq)
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR signal frequency: {}\nRetrying...'.format(error.abbreviation))
-                self.signal_frequency(freq)
+                self.write_setting('frequency', freq, command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR signal frequency: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
     def get_signal_frequency(self):
+        # Answer from the shadow state when the frequency was set through this driver
+        freq = self.get_setting('frequency')
+        if freq is not None:
+            return float(freq)
+
         try:
-            freq = self.lcr.query(':FREQ?')
-        except VisaIOError as error:
-            print('Error on getting LCR signal frequency: {}\nRetrying...'.format(error.abbreviation))
-            self.get_signal_frequency()
+            freq = float(self.io_policy.query(self.lcr, ':FREQ?'))
+        except InstrumentIOError as error:
+            print('Error on getting LCR signal frequency: {}'.format(error.abbreviation))
+            raise
 
-        return float(freq)
+        self.state['frequency'] = freq
+        return freq
 
     def signal_level(self, signal_type: str, level, write_or_build='write'):
         if signal_type.lower() == 'voltage':
@@ -176,10 +501,9 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR signal type/level: {}\nRetrying...'.format(error.abbreviation))
-                self.signal_level(signal_type, level)
+                self.write_setting('level', (signal_type.lower(), setting_value(level)), command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR signal type/level: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
     
@@ -193,10 +517,9 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR bias state: {}\nRetrying...'.format(error.abbreviation))
-                self.dc_bias_state(state)
+                self.write_setting('bias_state', state, command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR bias state: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
@@ -211,29 +534,23 @@ class AgilentE4980A(QObject):
 
         if write_or_build.lower() == 'write':
             try:
-                self.lcr.write(command)
-            except VisaIOError as error:
-                print('Error on setting LCR bias level: {}\nRetrying...'.format(error.abbreviation))
-                self.dc_bias_level(bias_type, level)
+                self.write_setting('bias', (bias_type.lower(), setting_value(level)), command)
+            except InstrumentIOError as error:
+                print('Error on setting LCR bias level: {}'.format(error.abbreviation))
         elif write_or_build.lower() == 'build':
             return command
 
     def get_data(self):
+        # Raises InstrumentIOError if the LCR does not return data within the I/O policy limits
         try:
-            rec_data = self.lcr.query(':FETC?')
-            rec_data = rec_data.rstrip().split(',')
-            rec_data = [float(x) for x in rec_data]
-        except VisaIOError as error:
+            rec_data = self.query_values(':FETC?').tolist()
+        except InstrumentIOError as error:
+            self.invalidate_cache()
             if error.abbreviation == "VI_ERROR_TMO":
-                print('LCR did not return data in time ({}).\tRetrying...'.format(error.abbreviation))
+                print('LCR did not return data in time ({}).'.format(error.abbreviation))
             else:
-                print('Error on retrieving data from LCR: {}\nRetrying...'.format(error.abbreviation))
-            sleep(0.1)
-            return self.get_data()
-        except ValueError as error:
-            print("Unable to read data from LCR - Float conversion error ({}) Retrying...".format(error))
-            sleep(0.1)
-            return self.get_data()
+                print('Error on retrieving data from LCR: {}'.format(error.abbreviation))
+            raise
         else:
             freq = self.get_signal_frequency()
             rec_data.insert(0, freq)
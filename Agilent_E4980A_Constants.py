@@ -76,4 +76,31 @@ TRIG_SOURCE_DICT = {'Internal': 'INT',
 
 MEASURE_TIME_DICT = {'Long': 'LONG',
                      'Medium': 'MED',
-                     'Short': 'SHOR'}
\ No newline at end of file
+                     'Short': 'SHOR'}
+
+# Approximate measurement time per reading: a fixed part and a number of signal periods, by aperture
+APERTURE_BASE_TIME = {'SHOR': 0.0056, 'MED': 0.088, 'LONG': 0.22}
+APERTURE_CYCLES = {'SHOR': 2, 'MED': 4, 'LONG': 8}
+
+DATA_FORMAT_DICT = {'ASCII': 'ASC',
+                    'Binary': 'REAL'}
+
+DISPLAY_PAGE_DICT = {'Measurement': 'MEAS',
+                     'List Sweep': 'LIST'}
+
+LIST_MODE_DICT = {'Sequential': 'SEQ',
+                  'Step': 'STEP'}
+
+# Hardware limits of the list sweep table and the test signal frequency
+LIST_SWEEP_MAX_POINTS = 201
+MIN_FREQUENCY = 20
+MAX_FREQUENCY = 2000000
+
+# Test signal frequency resolution: (frequencies below [Hz], resolution [Hz]). The LCR rounds any frequency it is
+#  sent to this resolution.
+FREQUENCY_RESOLUTION = [(100, 0.01),
+                        (1000, 0.1),
+                        (10000, 1),
+                        (100000, 10),
+                        (1000000, 100),
+                        (float('inf'), 1000)]
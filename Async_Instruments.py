@@ -0,0 +1,64 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# asyncio front ends for the instrument drivers, so one thread can keep several instruments busy at once. The drivers
+#  block on VISA or serial I/O, so each call runs on an executor. Every instrument gets its own single thread
+#  executor: the commands to one instrument stay in order (its bus session has one transaction in flight at a time)
+#  while different instruments work concurrently. An instrument should only be driven through its async front end
+#  while the front end is in use, a direct call from another thread would not be serialized with it.
+
+
+class AsyncInstrument(object):
+    # Awaitable version of driver: each name in methods becomes a coroutine function that runs the blocking driver
+    #  method on the instrument's executor and returns its result. Everything else is used from driver directly.
+    methods = ()
+
+    def __init__(self, driver, name=None):
+        self.driver = driver
+        self.name = name if name is not None else type(driver).__name__
+        # The thread is only started by the first call
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+
+        for method_name in self.methods:
+            setattr(self, method_name, self.wrap(getattr(driver, method_name)))
+
+    def wrap(self, method):
+        @functools.wraps(method)
+        async def call(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                    functools.partial(method, *args, **kwargs))
+
+        return call
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+class AsyncAgilentE4980A(AsyncInstrument):
+    methods = ('reset', 'function', 'impedance_range', 'measurement_aperture', 'signal_frequency',
+               'get_signal_frequency', 'signal_level', 'dc_bias_state', 'dc_bias_level', 'set_binary_transfer',
+               'get_data', 'setup_triggered_acquisition', 'get_triggered_data', 'end_triggered_acquisition',
+               'setup_list_sweep', 'get_list_sweep_data', 'end_list_sweep')
+
+
+class AsyncSunEC1xChamber(AsyncInstrument):
+    methods = ('get_temp', 'get_user_temp', 'set_setpoint', 'set_ramprate')
+
+
+class AsyncHotplateRobot(AsyncInstrument):
+    methods = ('get_temp', 'set_setpoint', 'update_position', 'query_param')
+
+
+class InstrumentLoop(object):
+    # Event loop for driving AsyncInstruments from synchronous code such as the measurement workers. run() blocks the
+    #  calling thread until the coroutine is done, the instruments it awaits work concurrently meanwhile. The loop is
+    #  reused between calls, it may be run from any thread but only from one at a time.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        self.loop.close()
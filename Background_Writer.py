@@ -0,0 +1,83 @@
+import threading
+from queue import Queue, Full
+from time import perf_counter
+
+
+class BackgroundWriter(object):
+    # Runs file writes on a dedicated thread so slow disks or network shares do not stall the instruments. Writes are
+    #  queued as (function, arguments) and run in order. The queue is bounded: when it is full submit() blocks until
+    #  the writer catches up, and the time spent blocked is counted in the stats.
+    def __init__(self, name='Background writer', max_queue=4096):
+        self.name = name
+        self.queue = Queue(maxsize=max_queue)
+        self.errors = []
+        self.counters = {'submitted': 0,
+                         'written': 0,
+                         'failed': 0,
+                         'max_depth': 0,
+                         'blocked_time': 0.0,
+                         'total_latency': 0.0,
+                         'max_latency': 0.0}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        if not self.thread.is_alive():
+            raise RuntimeError('{} is closed'.format(self.name))
+
+        item = (perf_counter(), func, args, kwargs)
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            # Backpressure, wait for the writer thread to make room
+            start = perf_counter()
+            self.queue.put(item)
+            with self.lock:
+                self.counters['blocked_time'] += perf_counter() - start
+
+        with self.lock:
+            self.counters['submitted'] += 1
+            self.counters['max_depth'] = max(self.counters['max_depth'], self.queue.qsize())
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+
+            submitted, func, args, kwargs = item
+            try:
+                func(*args, **kwargs)
+            except Exception as error:
+                # Keep writing the rest, the error is reported through errors and the stats
+                print('{}: {} failed: {}'.format(self.name, getattr(func, '__name__', func), error))
+                with self.lock:
+                    self.counters['failed'] += 1
+                    self.errors.append(error)
+            else:
+                latency = perf_counter() - submitted
+                with self.lock:
+                    self.counters['written'] += 1
+                    self.counters['total_latency'] += latency
+                    self.counters['max_latency'] = max(self.counters['max_latency'], latency)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        # Block until everything submitted so far has been written
+        self.queue.join()
+
+    def close(self):
+        # Write everything still queued, then stop the thread
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+        stats['depth'] = self.queue.qsize()
+        stats['mean_latency'] = stats['total_latency'] / stats['written'] if stats['written'] else 0.0
+        return stats
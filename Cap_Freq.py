@@ -4,22 +4,37 @@ from PyQt5 import uic
 from PyQt5.QtGui import QKeySequence
 from PyQt5.QtWidgets import (QWidget, QComboBox, QLineEdit, QLabel, QGroupBox, QTableWidget,
                              QTableWidgetItem, QTabWidget, QMessageBox, QToolButton, QApplication,
-                             QFileDialog, QProgressBar, QPushButton, QShortcut)
+                             QFileDialog, QProgressBar, QPushButton, QShortcut, QCheckBox)
 from PyQt5.QtCore import QTimer, QThread, pyqtSignal, QObject
 import os
-from io import StringIO
 from time import sleep
 import pandas as pd
 from datetime import datetime, timedelta
 import numpy as np
 from Live_Data_Plotter import LivePlotWidget
 from Agilent_E4980A import AgilentE4980A
+from Visa_IO_Policy import InstrumentIOError
+from Instrument_Tracing import tracer
+from Sweep_Buffer import SweepBuffer
+import Data_Storage
+from Background_Writer import BackgroundWriter
+from Measurement_Journal import MeasurementJournal, JournalState, journal_path
+from Measurement_Catalog import MeasurementCatalog, DEFAULT_CATALOG_PATH
+import sqlite3
+from Impedance_Conversion import function_to_impedance
+from Measurement_Plan import MeasurementPlan, PlanError, plan_value_text, yaml
+from Run_Time_Predictor import RunTimePredictor, format_duration
+from Adaptive_Sampling import refine_frequencies, DEFAULT_TOLERANCE
+from Adaptive_Aperture import AperturePlanner, APERTURE_CODES, DEFAULT_NOISE_TARGET, band_index
 # Can be used to emulate the LCR without connection data will be garbage (random numbers)
 # from fake_E4980 import AgilentE4980A
 import Agilent_E4980A_Constants as Const
 from File_Print_Headers import *
 import Static_Functions as Static
 
+# Functions that are live plotted as Z' against -Z'' instead of against frequency
+NYQUIST_FUNCTIONS = ['Z-Thd', 'Z-Thr']
+
 
 class CapFreqWidget(QTabWidget):
     # This signal needs to be defined before the __init__ in order to allow it to work
@@ -39,14 +54,45 @@ class CapFreqWidget(QTabWidget):
         self.bias_type = 'voltage'
         self.num_pts = 50
         self.pre_meas_delay = 0.0
+        # Measure each sweep as hardware list sweeps (one trigger per list) instead of point by point
+        self.use_list_sweep = True
+        # Adaptive sweeps stop adding points once no interval is off by more than this share of the value range
+        self.adaptive_tolerance = DEFAULT_TOLERANCE
+        # Choose the measuring time and averaging per frequency band to meet noise_target instead of using one setting
+        self.adaptive_aperture = False
+        self.noise_target = DEFAULT_NOISE_TARGET
+        # Noise of each band per sample and fixture, measured once and cached for later runs
+        self.aperture_planner = AperturePlanner()
+        # Fetch data from the LCR as binary blocks rather than ASCII
+        self.use_binary_transfer = True
         self.enable_live_plots = False
         self.enable_live_vals = True
+        # Record instrument I/O and measurement phase spans, written next to the data file as <name>_trace.json/.csv
+        self.enable_tracing = False
 
         self.num_measurements = 1
-        self.tests_df = pd.DataFrame()
+        # Typed MeasurementPlan of the table, built and checked when a measurement set is started
+        self.plan = None
+        self.plan_has_temp = False
         self.data_dict = {}
         self.header_dict = {}
-        self.save_file_path = os.path.join(os.getenv('USERPROFILE'), 'Desktop')
+        # Output format, one of Data_Storage.STORAGE_FORMATS
+        self.storage_format = 'Text (.dat)'
+        self.data_storage = None
+        self.data_row = None
+        self.journal = None
+        # Finished .dat blocks are added to the measurement catalog, None to turn it off
+        self.catalog_path = DEFAULT_CATALOG_PATH
+        self.catalog = None
+        # Predicts the duration of a set and its ETA while running, calibrated from the timings of earlier runs
+        self.run_predictor = RunTimePredictor()
+        # Controls that make up the plan of a measurement set, restored when an interrupted set is resumed
+        self.plan_controls = ['combo_function', 'combo_meas_time', 'ln_data_averaging', 'ln_num_pts', 'combo_spacing',
+                              'ln_pre_meas_delay', 'combo_range', 'combo_signal_type', 'combo_bias_type', 'ln_notes',
+                              'combo_storage_format', 'check_adaptive_aperture', 'ln_noise_target', 'ln_fixture']
+        # File writes run on this thread during a measurement, see io_writer.stats() for queue depth and latency
+        self.io_writer = None
+        self.save_file_path = os.path.join(os.path.expanduser('~'), 'Desktop')
 
         # Pull in measuring thread and initialize worker object
         self.measuring_thread = measuring_thread
@@ -66,6 +112,9 @@ class CapFreqWidget(QTabWidget):
         self.gbox_meas_set_params = self.findChild(QGroupBox, 'gbox_meas_set_params')
         self.combo_function = self.findChild(QComboBox, 'combo_function')
         self.combo_meas_time = self.findChild(QComboBox, 'combo_meas_time')
+        self.check_adaptive_aperture = self.findChild(QCheckBox, 'check_adaptive_aperture')
+        self.ln_noise_target = self.findChild(QLineEdit, 'ln_noise_target')
+        self.ln_noise_target.setText(str(self.noise_target))
         self.combo_range = self.findChild(QComboBox, 'combo_range')
         self.ln_data_averaging = self.findChild(QLineEdit, 'ln_data_averaging')
         self.ln_data_averaging.setText(str(self.data_averaging))
@@ -73,11 +122,14 @@ class CapFreqWidget(QTabWidget):
         self.combo_bias_type = self.findChild(QComboBox, 'combo_bias_type')
         self.ln_num_pts = self.findChild(QLineEdit, 'ln_num_pts')
         self.ln_num_pts.setText(str(self.num_pts))
-        self.ln_pre_meas_delay = self.findChild(QLineEdit, 'ln_step_delay')
+        self.combo_spacing = self.findChild(QComboBox, 'combo_spacing')
+        self.ln_pre_meas_delay = self.findChild(QLineEdit, 'ln_pre_meas_delay')
         self.ln_pre_meas_delay.setText(str(self.pre_meas_delay))
         self.ln_notes = self.findChild(QLineEdit, 'ln_notes')
+        self.ln_fixture = self.findChild(QLineEdit, 'ln_fixture')
         self.ln_save_file = self.findChild(QLineEdit, 'ln_save_file')
         self.btn_save_file = self.findChild(QToolButton, 'btn_save_file')
+        self.combo_storage_format = self.findChild(QComboBox, 'combo_storage_format')
 
         # Define controls for the per measurement settings
         self.gbox_meas_setup = self.findChild(QGroupBox, 'gbox_meas_setup')
@@ -85,6 +137,8 @@ class CapFreqWidget(QTabWidget):
         self.ln_num_meas.setText(str(self.num_measurements))
         self.btn_copy_table = self.findChild(QPushButton, 'btn_copy_table')
         self.btn_paste_table = self.findChild(QPushButton, 'btn_paste_table')
+        self.btn_load_plan = self.findChild(QPushButton, 'btn_load_plan')
+        self.btn_save_plan = self.findChild(QPushButton, 'btn_save_plan')
         self.table_meas_setup = self.findChild(QTableWidget, 'table_meas_setup')
         self.meas_setup_hheaders = ['Frequency Start [Hz]',
                                     'Frequency Stop [Hz]',
@@ -103,6 +157,7 @@ class CapFreqWidget(QTabWidget):
         self.lbl_curr_meas_bias = self.findChild(QLabel, 'lbl_curr_meas_bias')
         self.progress_bar_meas = self.findChild(QProgressBar, 'progress_bar_meas')
         self.lbl_meas_progress = self.findChild(QLabel, 'lbl_meas_progress')
+        self.lbl_eta = self.findChild(QLabel, 'lbl_eta')
         self.lbl_meas_status = self.findChild(QLabel, 'lbl_meas_status')
 
         # Define value readouts
@@ -117,9 +172,9 @@ class CapFreqWidget(QTabWidget):
 
         self.init_measure_worker()
 
-        # Gets data and emits a signal to update live value readouts
-        self.lcr.get_data()
         self.live_readout_timer = QTimer()
+        # Counts the ETA down between progress updates, which are far apart during thermal waits
+        self.eta_timer = QTimer()
         self.btn_run_start_stop = self.findChild(QPushButton, 'btn_run_start_stop')
         self.btn_setup_start_stop = self.findChild(QPushButton, 'btn_setup_start_stop')
 
@@ -138,6 +193,8 @@ class CapFreqWidget(QTabWidget):
         self.combo_function.currentTextChanged.connect(self.change_function)
         self.combo_meas_time.currentTextChanged.connect(self.change_meas_aperture)
         self.ln_data_averaging.editingFinished.connect(self.change_meas_aperture)
+        self.check_adaptive_aperture.toggled.connect(self.change_meas_aperture)
+        self.ln_noise_target.editingFinished.connect(self.change_meas_aperture)
         self.ln_num_pts.editingFinished.connect(self.change_num_pts)
         self.ln_pre_meas_delay.editingFinished.connect(self.change_pre_meas_delay)
         self.combo_range.currentTextChanged.connect(self.change_impedance_range)
@@ -145,17 +202,25 @@ class CapFreqWidget(QTabWidget):
         self.combo_bias_type.currentTextChanged.connect(self.change_bias_type)
         self.ln_save_file.editingFinished.connect(self.set_save_file_path_by_line)
         self.btn_save_file.clicked.connect(self.set_save_file_path_by_dialog)
+        self.combo_storage_format.currentTextChanged.connect(self.change_storage_format)
         self.ln_num_meas.editingFinished.connect(self.change_num_measurements)
         self.btn_copy_table.clicked.connect(self.copy_table)
         self.btn_paste_table.clicked.connect(self.paste_table)
+        self.btn_load_plan.clicked.connect(self.load_plan)
+        self.btn_save_plan.clicked.connect(self.save_plan)
         self.btn_run_start_stop.clicked.connect(self.on_start_stop_clicked)
         self.btn_setup_start_stop.clicked.connect(self.on_start_stop_clicked)
 
         # Timers
         self.live_readout_timer.timeout.connect(self.get_new_data)
+        self.eta_timer.timeout.connect(self.update_eta)
         self.lcr.new_data.connect(self.update_live_readout)
-        # Gets data and emits a signal to update live value readouts
-        self.lcr.get_data()
+        # Gets data and emits a signal to update live value readouts, the live readout timer keeps trying if the LCR
+        #  does not answer
+        try:
+            self.lcr.get_data()
+        except InstrumentIOError as error:
+            self.update_meas_status('LCR is not responding ({}).'.format(error.abbreviation))
 
         # Cross thread communication
         self.measuring_worker.measurement_finished.connect(self.measuring_thread.quit)
@@ -178,8 +243,10 @@ class CapFreqWidget(QTabWidget):
         self.combo_range.addItems(Const.VALID_IMP_RANGES)
         self.combo_function.addItems(list(Const.FUNC_DICT.keys()))
         self.combo_meas_time.addItems(list(Const.MEASURE_TIME_DICT.keys()))
+        self.combo_spacing.addItems(list(Static.FREQ_SPACINGS.keys()))
         self.combo_signal_type.addItems(['Voltage', 'Current'])
         self.combo_bias_type.addItems(['Voltage', 'Current'])
+        self.combo_storage_format.addItems(Data_Storage.available_formats())
 
         # Set up timers
         self.live_readout_timer.start(500)
@@ -203,7 +270,11 @@ class CapFreqWidget(QTabWidget):
         # Helper function to get new data on timer timeout. Was failing when called directly, could be something about
         #  having a return value?
         if self.enable_live_vals:
-            self.lcr.get_data()
+            try:
+                self.lcr.get_data()
+            except InstrumentIOError:
+                # Already reported by the driver, try again on the next timeout
+                pass
 
     def change_function(self):
         self.lcr_function = self.combo_function.currentText()
@@ -217,6 +288,15 @@ class CapFreqWidget(QTabWidget):
             self.data_averaging = 1
             self.ln_data_averaging.setText(str(self.data_averaging))
 
+        self.adaptive_aperture = self.check_adaptive_aperture.isChecked()
+        try:
+            self.noise_target = float(self.ln_noise_target.text())
+            if not self.noise_target > 0:
+                raise ValueError
+        except ValueError:
+            self.noise_target = DEFAULT_NOISE_TARGET
+            self.ln_noise_target.setText(str(self.noise_target))
+
     def change_num_pts(self):
         try:
             self.num_pts = int(self.ln_num_pts.text())
@@ -240,6 +320,12 @@ class CapFreqWidget(QTabWidget):
     def change_bias_type(self):
         self.bias_type = self.combo_bias_type.currentText()
 
+    def change_storage_format(self):
+        self.storage_format = self.combo_storage_format.currentText()
+
+    def data_file_path(self):
+        return Data_Storage.storage_path(self.storage_format, self.save_file_path)
+
     def set_save_file_path_by_dialog(self):
         file_name = QFileDialog.getSaveFileName(self,
                                                 'Select a file to save data...',
@@ -327,6 +413,52 @@ class CapFreqWidget(QTabWidget):
             for (icol, col_val) in enumerate(tmpcols):
                 self.table_meas_setup.item(irow, icol).setText(str(col_val))
 
+    def set_table(self, table):
+        self.ln_num_meas.setText(str(len(table)))
+        self.change_num_measurements()
+        for irow, row in enumerate(table):
+            for icol, value in enumerate(row):
+                self.table_meas_setup.item(irow, icol).setText(value)
+
+    def plan_file_filter(self):
+        return 'Plan Files (*.csv *.yaml *.yml);;All Types (*.*)' if yaml is not None else \
+            'Plan Files (*.csv);;All Types (*.*)'
+
+    def load_plan(self):
+        file_name = QFileDialog.getOpenFileName(self, 'Load a measurement plan...',
+                                                os.path.dirname(os.path.abspath(self.save_file_path)),
+                                                self.plan_file_filter())
+        if file_name[0] == '':
+            return
+
+        try:
+            plan = MeasurementPlan.load(file_name[0], self.num_pts, self.combo_signal_type.currentText(),
+                                        self.combo_bias_type.currentText(), self.plan_has_temp,
+                                        Static.FREQ_SPACINGS[self.combo_spacing.currentText()])
+        except (OSError, PlanError) as error:
+            QMessageBox.warning(self, 'Could not load plan', str(error), QMessageBox.Ok, QMessageBox.Ok)
+            return
+
+        self.set_table(plan.table())
+
+    def save_plan(self):
+        try:
+            self.generate_test_matrix(reorder=False)
+        except PlanError as error:
+            QMessageBox.warning(self, 'Invalid measurement plan', str(error), QMessageBox.Ok, QMessageBox.Ok)
+            return
+
+        file_name = QFileDialog.getSaveFileName(self, 'Save the measurement plan...',
+                                                os.path.dirname(os.path.abspath(self.save_file_path)),
+                                                self.plan_file_filter())
+        if file_name[0] == '':
+            return
+
+        try:
+            self.plan.save(file_name[0])
+        except (OSError, PlanError) as error:
+            QMessageBox.warning(self, 'Could not save plan', str(error), QMessageBox.Ok, QMessageBox.Ok)
+
     def generate_header(self, index, row):
         header_vars = self.get_header_vars(index, row)
 
@@ -337,7 +469,7 @@ class CapFreqWidget(QTabWidget):
                                         start_freq=header_vars['start'],
                                         stop_freq=header_vars['stop'],
                                         range=self.range,
-                                        num_pts=self.num_pts,
+                                        num_pts=row.num_points,
                                         data_averaging=self.data_averaging,
                                         step_delay=header_vars['step_delay'],
                                         osc_type=header_vars['osc_type'],
@@ -345,6 +477,9 @@ class CapFreqWidget(QTabWidget):
                                         bias_type=header_vars['bias_type'],
                                         bias=header_vars['bias'],
                                         pre_meas_delay=self.pre_meas_delay,
+                                        predicted_total=header_vars['predicted_total'],
+                                        predicted_elapsed=header_vars['predicted_elapsed'],
+                                        actual_elapsed=header_vars['actual_elapsed'],
                                         notes='Notes:\t{}'.format(header_vars['notes']))
 
         return header
@@ -356,10 +491,10 @@ class CapFreqWidget(QTabWidget):
         header_vars['date_now'] = str(now).split(' ')[0]
         header_vars['time_now'] = str(now.strftime('%H:%M:%S'))
 
-        header_vars['start'] = row[self.meas_setup_hheaders[0]]
-        header_vars['stop'] = row[self.meas_setup_hheaders[1]]
+        header_vars['start'] = row.text('start')
+        header_vars['stop'] = row.text('stop')
 
-        header_vars['osc'] = row[self.meas_setup_hheaders[2]]
+        header_vars['osc'] = row.text('osc')
         if self.combo_signal_type.currentText() == 'Voltage':
             header_vars['osc_type'] = 'V'
         elif self.combo_signal_type.currentText() == 'Current':
@@ -367,7 +502,7 @@ class CapFreqWidget(QTabWidget):
         else:
             header_vars['osc_type'] = 'UNKNOWN'
 
-        header_vars['bias'] = row[self.meas_setup_hheaders[3]]
+        header_vars['bias'] = row.text('bias')
         if self.combo_bias_type.currentText() == 'Voltage':
             header_vars['bias_type'] = 'V'
         elif self.combo_bias_type.currentText() == 'Current':
@@ -375,28 +510,58 @@ class CapFreqWidget(QTabWidget):
         else:
             header_vars['bias_type'] = 'UNKNOWN'
 
-        header_vars['step_delay'] = row[self.meas_setup_hheaders[4]]
+        header_vars['step_delay'] = row.text('delay')
         header_vars['notes'] = self.ln_notes.text()
 
+        # Where the run should be at the start of this measurement against where it is
+        header_vars['predicted_total'] = round(self.run_predictor.total(), 1)
+        header_vars['predicted_elapsed'] = round(self.run_predictor.predicted_elapsed(index), 1)
+        header_vars['actual_elapsed'] = round(self.run_predictor.elapsed_time(), 1)
+
         return header_vars
 
-    def generate_test_matrix(self):
-        self.tests_df = pd.DataFrame(data=None, index=self.meas_setup_vheaders, columns=self.meas_setup_hheaders)
-
-        for irow in range(0, self.table_meas_setup.rowCount()):
-            for icol in range(0, self.table_meas_setup.columnCount()):
-                self.tests_df.iloc[irow, icol] = self.table_meas_setup.item(irow, icol).text()
+    def generate_test_matrix(self, reorder=True):
+        # Build the typed plan from the measurement table, raises PlanError listing every invalid entry. Subclasses
+        #  that run the rows in another order only do so with reorder, saved plans keep the table order.
+        table = [[self.table_meas_setup.item(irow, icol).text()
+                  for icol in range(0, self.table_meas_setup.columnCount())]
+                 for irow in range(0, self.table_meas_setup.rowCount())]
+
+        self.plan = MeasurementPlan.from_table(table, self.num_pts, self.combo_signal_type.currentText(),
+                                               self.combo_bias_type.currentText(), self.plan_has_temp,
+                                               Static.FREQ_SPACINGS[self.combo_spacing.currentText()])
+
+    def prediction_settings(self):
+        # Everything besides the plan that decides how long a set takes, see RunTimePredictor.predict
+        return {'aperture': Const.MEASURE_TIME_DICT.get(self.combo_meas_time.currentText(), 'MED'),
+                'averaging': self.data_averaging,
+                'pre_meas_delay': self.pre_meas_delay,
+                'list_sweep': self.use_list_sweep,
+                'adaptive_aperture': self.adaptive_aperture}
+
+    def aperture_key(self, row):
+        # Adaptive measuring times are cached per sample, fixture and the settings that change the noise of a reading
+        return AperturePlanner.sample_key(self.ln_notes.text(), self.ln_fixture.text(), self.lcr_function, self.range,
+                                          '{} {}'.format(row.text('osc'), self.combo_signal_type.currentText()))
+
+    def predict_run_time(self):
+        return self.run_predictor.predict(self.plan, **self.prediction_settings())
 
     def enable_controls(self, enable: bool):
         self.gbox_meas_setup.setEnabled(enable)
         self.gbox_meas_set_params.setEnabled(enable)
 
     def setup_lcr(self):
-        self.lcr.function(self.lcr_function)
-        self.lcr.impedance_range(self.range)
-        self.lcr.measurement_aperture(self.measuring_time, self.data_averaging)
-        self.lcr.signal_level(self.signal_type, self.table_meas_setup.item(0, 2).text())
-        self.lcr.dc_bias_level(self.bias_type, self.table_meas_setup.item(0, 3).text())
+        # Settings may have been changed from the front panel since the last run, so start from a clean shadow state
+        self.lcr.invalidate_cache()
+        # Send the whole configuration as one bus transaction
+        with self.lcr.batch(opc=True):
+            self.lcr.set_binary_transfer(self.use_binary_transfer)
+            self.lcr.function(self.lcr_function)
+            self.lcr.impedance_range(self.range)
+            self.lcr.measurement_aperture(self.measuring_time, self.data_averaging)
+            self.lcr.signal_level(self.signal_type, self.table_meas_setup.item(0, 2).text())
+            self.lcr.dc_bias_level(self.bias_type, self.table_meas_setup.item(0, 3).text())
 
     def on_start_stop_clicked(self):
         # Get the sender
@@ -437,13 +602,30 @@ class CapFreqWidget(QTabWidget):
 
     def start_measurement(self):
         self.set_save_file_path_by_line()
-        self.check_file_path()
+        # Only resume when the user accepts it for this start
+        self.measuring_worker.resume_state = None
+        if not self.check_resume():
+            self.check_file_path()
+
+        # Check the whole plan before anything is sent to the instruments
+        try:
+            self.generate_test_matrix()
+        except PlanError as error:
+            QMessageBox.warning(self, 'Invalid measurement plan', str(error), QMessageBox.Ok, QMessageBox.Ok)
+            self.cancel_start()
+            return
+        self.predict_run_time()
+        if not self.confirm_plan():
+            self.cancel_start()
+            return
 
         self.setCurrentWidget(self.tab_run_meas)
         # Set up the progress bar for this measurement
         self.progress_bar_meas.setMinimum(0)
-        self.progress_bar_meas.setMaximum(self.num_measurements * self.num_pts)
+        self.progress_bar_meas.setMaximum(self.plan.num_points())
         self.progress_bar_meas.reset()
+        self.lbl_eta.setText('Predicted: {}'.format(format_duration(self.run_predictor.total())))
+        self.eta_timer.start(1000)
         # Keep the user from changing values in the controls
         self.enable_controls(False)
         # Set live vals to update to last read value only
@@ -456,18 +638,33 @@ class CapFreqWidget(QTabWidget):
         # Emit signal to start the worker measuring
         self.measuring_thread.start()
 
+    def confirm_plan(self):
+        # Last look at the plan before the run starts, override to ask the user about it
+        return True
+
+    def cancel_start(self):
+        # Back to the state before the start button was clicked, nothing has been sent to the instruments yet
+        self.btn_setup_start_stop.setChecked(False)
+        self.btn_run_start_stop.setChecked(False)
+        self.btn_setup_start_stop.setText('Run Measurement Set')
+        self.btn_run_start_stop.setText('Run Measurement Set')
+        self.enable_live_vals = True
+        # A resume the user accepted for this start must not carry over to the next one
+        self.measuring_worker.resume_state = None
+
     def dep_cancelled_by_user(self):
         cancel = QMessageBox.information(self, 'Measurement canceled',
                                          'Measurement cancelled by user.',
                                          QMessageBox.Ok, QMessageBox.Ok)
         if cancel == QMessageBox.Ok:
+            self.measuring_worker.resume_state = None
             self.btn_setup_start_stop.setChecked(False)
             self.btn_run_start_stop.setChecked(False)
             self.halt_measurement()
             return
 
     def check_file_path(self):
-        if os.path.isfile(self.save_file_path):
+        if os.path.exists(self.data_file_path()):
             overwrite = QMessageBox.warning(self, 'File already exists',
                                             'This data file already exists. Would you like to overwrite?',
                                             QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel,
@@ -478,7 +675,7 @@ class CapFreqWidget(QTabWidget):
             elif overwrite == QMessageBox.Cancel:
                 self.dep_cancelled_by_user()
                 return
-        elif self.save_file_path == os.path.join(os.getenv('USERPROFILE'), 'Desktop') or self.save_file_path == '':
+        elif self.save_file_path == os.path.join(os.path.expanduser('~'), 'Desktop') or self.save_file_path == '':
             no_file_selected = QMessageBox.warning(self, 'No File Selected',
                                                    'No file has been selected for writing data, '
                                                    'please pick a file to save to.',
@@ -492,8 +689,62 @@ class CapFreqWidget(QTabWidget):
                 return
             # Fixme: maybe add more file save path checking i.e. blank or default location.
 
+    def check_resume(self):
+        # Offer to resume when the journal of an interrupted measurement set is next to the data file
+        path = journal_path(self.data_file_path())
+        if not os.path.isfile(path):
+            return False
+
+        state = JournalState(path)
+        if not state.resumable():
+            return False
+
+        resume = QMessageBox.question(self, 'Resume measurement set',
+                                      'An interrupted measurement set was found for this file ({} of {} measurements '
+                                      'finished). Would you like to resume it?'.format(len(state.finished_rows()),
+                                                                                      len(state.plan['table'])),
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if resume == QMessageBox.Yes:
+            self.restore_plan(state.plan)
+            self.measuring_worker.resume_state = state
+            return True
+
+        return False
+
+    def measurement_plan(self, columns):
+        controls = {}
+        for name in self.plan_controls:
+            control = getattr(self, name)
+            if isinstance(control, QComboBox):
+                controls[name] = control.currentText()
+            elif isinstance(control, QCheckBox):
+                controls[name] = control.isChecked()
+            else:
+                controls[name] = control.text()
+
+        table = [[self.table_meas_setup.item(irow, icol).text()
+                  for icol in range(0, self.table_meas_setup.columnCount())]
+                 for irow in range(0, self.table_meas_setup.rowCount())]
+
+        return {'controls': controls, 'table': table, 'columns': list(columns)}
+
+    def restore_plan(self, plan):
+        for name, value in plan['controls'].items():
+            control = getattr(self, name)
+            if isinstance(control, QComboBox):
+                control.setCurrentText(value)
+            elif isinstance(control, QCheckBox):
+                control.setChecked(value)
+            else:
+                control.setText(value)
+                control.editingFinished.emit()
+
+        self.set_table(plan['table'])
+
     # When the worker says it is done, save data and reset widget state to interactive
     def end_measurement(self):
+        self.eta_timer.stop()
+        self.lbl_eta.setText(self.run_predictor.summary())
         # Enable the user to change controls
         self.enable_controls(True)
         # Set live vals to update periodically
@@ -513,28 +764,98 @@ class CapFreqWidget(QTabWidget):
 
     def return_to_defaults(self):
         # print('Returning lcr to defaults')
-        self.lcr.dc_bias_level('voltage', 0)
-        self.lcr.signal_level('voltage', 0.05)
-        self.lcr.signal_frequency(1000)
-
-    def save_data(self):
-        with open(self.save_file_path, 'w') as file:
-            for key in self.header_dict:
-                ram_csv = StringIO()
-                file.write(self.header_dict[key])
-                self.data_dict[key].to_csv(ram_csv,
-                                           sep='\t', index_label='idx')
-                file.write(ram_csv.getvalue())
-                file.write('\n*************End Data*************\n\n')
-                ram_csv.close()
+        try:
+            with self.lcr.batch():
+                self.lcr.dc_bias_level('voltage', 0)
+                self.lcr.signal_level('voltage', 0.05)
+                self.lcr.signal_frequency(1000)
+        except InstrumentIOError as error:
+            print('Error on returning LCR to defaults: {}'.format(error.abbreviation))
+
+    def open_data_file(self, columns, resume_state=None):
+        self.io_writer = BackgroundWriter('Data writer')
+        self.data_storage = Data_Storage.open_storage(self.storage_format, self.save_file_path)
+        self.journal = MeasurementJournal(journal_path(self.data_file_path()), append=resume_state is not None)
+        self.catalog = None
+        if self.catalog_path is not None and isinstance(self.data_storage, Data_Storage.DatStorage):
+            try:
+                self.catalog = MeasurementCatalog(self.catalog_path)
+            except (OSError, sqlite3.Error) as error:
+                print('Could not open the measurement catalog: {}'.format(error))
+
+        if resume_state is None:
+            self.io_writer.submit(self.journal.plan, self.measurement_plan(columns))
+            return
+
+        # Rebuild the data file from the journal, the measurement that was interrupted is left open to continue
+        for row, state in resume_state.rows.items():
+            if not state['finished'] and not state['points']:
+                continue
+            self.header_dict[row] = state['header']
+            self.io_writer.submit(self.data_storage.begin_measurement, row, state['header'], list(columns))
+            for values in state['points']:
+                self.io_writer.submit(self.data_storage.write_row, values)
+            if state['finished']:
+                self.io_writer.submit(self.data_storage.end_measurement)
+
+    def start_data_block(self, index, header, columns):
+        # Header and column names go to the file before the first point of the measurement
+        self.header_dict[index] = header
+        self.data_row = index
+        self.io_writer.submit(self.journal.row_started, index, header)
+        self.io_writer.submit(self.data_storage.begin_measurement, index, header, list(columns))
+
+    def resume_data_block(self, index):
+        # The block was reopened from the journal in open_data_file
+        self.data_row = index
+
+    def save_data_row(self, data):
+        # The journal is written first, the writer thread keeps the order
+        data = list(data)
+        self.io_writer.submit(self.journal.point, self.data_row, data)
+        self.io_writer.submit(self.data_storage.write_row, data)
+
+    def save_equilibration(self, index, state):
+        self.io_writer.submit(self.journal.equilibrated, index, state)
+
+    def save_data(self, complete=True):
+        # Finish the current measurement block, earlier blocks are already on disk. A measurement that was stopped
+        #  part way is not marked finished in the journal, so a resume measures the rest of it.
+        self.io_writer.submit(self.data_storage.end_measurement)
+        if complete:
+            self.io_writer.submit(self.journal.row_finished, self.data_row)
+        if self.catalog is not None:
+            self.io_writer.submit(self.update_catalog, self.data_storage.path)
+
+    def update_catalog(self, path):
+        # Runs on the writer thread once the block is on disk
+        try:
+            self.catalog.index_file(path)
+        except (OSError, ValueError, sqlite3.Error) as error:
+            print('Could not add {} to the measurement catalog: {}'.format(path, error))
+
+    def close_data_file(self, finished=False):
+        # Everything still queued is written before the file is closed. The journal is kept unless the whole set
+        #  finished, so an interrupted set can be resumed.
+        if self.data_storage is not None:
+            self.io_writer.submit(self.data_storage.close)
+            self.io_writer.submit(self.journal.close, finished)
+            self.io_writer.close()
+            self.data_storage = None
+            self.journal = None
+
+    def trace_file_path(self, extension):
+        return os.path.splitext(self.save_file_path)[0] + '_trace' + extension
 
     def plot_new_points(self, data: list):
-        if self.enable_live_plots:
+        if not self.enable_live_plots:
+            return
+
+        with tracer.span('live plot', 'gui'):
             # Handle data that is fed to the plot for special cases.
-            if self.lcr_function == 'Z-Thd':
-                zreal = data[1] * np.cos(np.deg2rad(data[2]))
-                zimag = data[1] * np.sin(np.deg2rad(data[2]))
-                self.live_plot.add_data([zreal, -1 * zimag])
+            if self.lcr_function in NYQUIST_FUNCTIONS:
+                z = function_to_impedance(Const.FUNC_DICT[self.lcr_function], data[1], data[2], data[0])
+                self.live_plot.add_data([float(z.real), -1 * float(z.imag)])
             else:
                 self.live_plot.add_data([data[0], data[1], data[2]])
 
@@ -543,7 +864,7 @@ class CapFreqWidget(QTabWidget):
         val_params = Const.PARAMETERS_BY_FUNC[Const.FUNC_DICT[self.lcr_function]]
 
         # Handle special cases for the live plot
-        if self.lcr_function == 'Z-Thd':
+        if self.lcr_function in NYQUIST_FUNCTIONS:
             self.live_plot.canvas.set_dual_y(False, ["Z' (Ohm)", "-Z'' (Ohm)"])
         else:
             self.live_plot.canvas.set_dual_y(True, ['Frequency [Hz]', val_params[0], val_params[1]])
@@ -554,10 +875,23 @@ class CapFreqWidget(QTabWidget):
 
     def update_measurement_progress(self, indices: list):
         # NOTE: indices[0] will be the measurement number (one indexed), and
-        # indices[1] will be the step number (Zero indexed)
-        self.progress_bar_meas.setValue(((indices[0] - 1) * self.num_pts) + (indices[1] + 1))
-        self.lbl_meas_progress.setText('Measurement {}/{},\nStep {}/{}'.format(indices[0], self.num_measurements,
-                                                                               indices[1] + 1, self.num_pts))
+        # indices[1] will be the step number (Zero indexed). The plan may run the measurements in a different order
+        #  than they are numbered, progress is shown in run order.
+        key = 'M{}'.format(indices[0])
+        row = self.plan.row(key)
+        self.progress_bar_meas.setValue(row.first_point + (indices[1] + 1))
+        self.lbl_meas_progress.setText('Measurement {}/{},\nStep {}/{}'.format(self.plan.position(key),
+                                                                               self.num_measurements,
+                                                                               indices[1] + 1, row.num_points))
+        self.update_eta()
+
+    def update_eta(self):
+        eta = self.run_predictor.eta()
+        if eta is None:
+            return
+
+        finish = datetime.now() + timedelta(seconds=eta)
+        self.lbl_eta.setText('Remaining: {}\nETA: {}'.format(format_duration(eta), finish.strftime('%a %H:%M')))
 
     def update_meas_status(self, update_str: str):
         self.lbl_meas_status.setText(update_str)
@@ -573,6 +907,13 @@ class CapFreqMeasureWorkerObject(QObject):
         self.parent = parent
         self.stop = False
         self.data_df = pd.DataFrame()
+        self.data_buffer = SweepBuffer([])
+        # (measuring time, averaging) by frequency band of the row being measured, with adaptive_aperture
+        self.band_settings = {}
+        # Aperture and Averaging columns of the points being measured, with adaptive_aperture
+        self.point_setting = []
+        # JournalState of an interrupted set to continue on the next measure()
+        self.resume_state = None
         self.parent.stop_measurement_worker.connect(self.stop_early)
         # ProbeStationControlMainWindow.active_measurement_changed.connect(self.return_instr_to_main_thread)
 
@@ -587,37 +928,157 @@ class CapFreqMeasureWorkerObject(QObject):
         self.stop = True
 
     def set_current_meas_labels(self):
-        self.parent.lbl_curr_meas_start.setText(str(self.step_start))
-        self.parent.lbl_curr_meas_stop.setText(str(self.step_stop))
-        self.parent.lbl_curr_meas_osc.setText(str(self.step_osc))
-        self.parent.lbl_curr_meas_bias.setText(str(self.step_bias))
+        self.parent.lbl_curr_meas_start.setText(plan_value_text(self.step_start))
+        self.parent.lbl_curr_meas_stop.setText(plan_value_text(self.step_stop))
+        self.parent.lbl_curr_meas_osc.setText(plan_value_text(self.step_osc))
+        self.parent.lbl_curr_meas_bias.setText(plan_value_text(self.step_bias))
 
     def set_test_params(self, row):
         # Set up current test specific values
-        self.step_start = row[self.parent.meas_setup_hheaders[0]]
-        self.step_stop = row[self.parent.meas_setup_hheaders[1]]
-        self.step_osc = row[self.parent.meas_setup_hheaders[2]]
-        self.step_bias = row[self.parent.meas_setup_hheaders[3]]
-        self.step_delay = float(row[self.parent.meas_setup_hheaders[4]])
+        self.step_start = row.start
+        self.step_stop = row.stop
+        self.step_osc = row.osc
+        self.step_bias = row.bias
+        self.step_delay = row.delay
 
     def get_out_columns(self):
         columns = Const.PARAMETERS_BY_FUNC[Const.FUNC_DICT[self.parent.combo_function.currentText()]]
         if columns[0] != 'Frequency [Hz]':
             columns.insert(0, 'Frequency [Hz]')
+        # The setting of each point is recorded when it changes over the sweep
+        if self.parent.adaptive_aperture:
+            columns = columns + ['Aperture', 'Averaging']
 
         return columns
 
-    def read_new_data(self):
-        # Read the measurement result
-        data = self.parent.lcr.get_data()
-        data = pd.Series(data, index=self.data_df.columns)
+    def read_new_data(self, data=None):
+        # Read the measurement result, unless it was already read as part of a list sweep
+        if data is None:
+            data = self.parent.lcr.get_data()
+        if self.point_setting:
+            data = list(data) + self.point_setting
 
-        # Store the data to the data_df
-        self.data_df = self.data_df.append(data, ignore_index=True)
+        # Store the data to the sweep buffer, it becomes data_df when the sweep is finished
+        self.data_buffer.append(data)
+        self.parent.save_data_row(data)
 
     def blocking_func(self):
         pass
 
+    def rests_at_defaults(self, row):
+        # Whether the LCR goes back to its defaults before row, so the sample is not held at the oscillator level and
+        #  bias of the previous row while the next one is set up. A row with the settings of the previous row goes
+        #  straight on without cycling them.
+        return bool(row.changes)
+
+    def list_sweep_allowed(self, freq_steps):
+        # List sweeps can only be used when every point is inside the LCR frequency range
+        return (self.parent.use_list_sweep
+                and min(freq_steps) >= Const.MIN_FREQUENCY
+                and max(freq_steps) <= Const.MAX_FREQUENCY)
+
+    def measure_point_sweep(self, index, freq_steps, start_step=0):
+        self.parent.lcr.setup_triggered_acquisition()
+
+        for step_idx in range(0, len(freq_steps)):
+            # The LCR only answers the trigger once the point is measured, so only wait when the user asked for an
+            #  extra settling delay at the new frequency
+            if self.parent.pre_meas_delay > 0:
+                self.parent.lcr.signal_frequency(freq_steps[step_idx])
+                sleep(self.parent.pre_meas_delay)
+
+            # Trigger the measurement, read data and store it to the dataframe
+            self.read_new_data(self.parent.lcr.get_triggered_data(freq_steps[step_idx]))
+
+            # Emit signal to update progress bar
+            self.freq_step_finished.emit([int(index.split('M')[-1]), start_step + step_idx])
+            self.meas_status_update.emit('Measurement in progress... (last point: {:.0f} ms)'
+                                         .format(self.parent.lcr.last_acquisition_latency * 1000))
+            if self.stop:
+                break
+
+        self.parent.lcr.end_triggered_acquisition()
+
+    def measure_list_sweep(self, index, freq_steps, start_step=0):
+        # The user delay becomes the LCR step delay, so the instrument handles settling between points
+        self.parent.lcr.setup_list_sweep(self.parent.pre_meas_delay)
+
+        # Run the sweep one list at a time so a stop request is picked up between lists
+        step_idx = start_step
+        for chunk_data in self.parent.lcr.iter_list_sweep_data(freq_steps):
+            for data in chunk_data:
+                self.read_new_data(data)
+                self.freq_step_finished.emit([int(index.split('M')[-1]), step_idx])
+                step_idx += 1
+            if self.stop:
+                break
+
+        self.parent.lcr.end_list_sweep()
+
+    def measure_points(self, index, freq_steps, start_step=0):
+        if self.list_sweep_allowed(freq_steps):
+            self.measure_list_sweep(index, freq_steps, start_step)
+        else:
+            self.measure_point_sweep(index, freq_steps, start_step)
+
+    def measure_sweep(self, index, freq_steps, start_step=0):
+        if not self.parent.adaptive_aperture:
+            self.measure_points(index, freq_steps, start_step)
+            return
+
+        # Each run of consecutive points in one band is measured with the setting chosen for that band
+        bands = band_index(freq_steps)
+        edges = [0] + (np.flatnonzero(np.diff(bands)) + 1).tolist() + [len(freq_steps)]
+        for run_start, run_stop in zip(edges[:-1], edges[1:]):
+            time, averaging = self.band_settings[bands[run_start]]
+            self.parent.lcr.measurement_aperture(time, averaging)
+            self.point_setting = [APERTURE_CODES[time], averaging]
+            self.measure_points(index, freq_steps[run_start:run_stop], start_step + run_start)
+            if self.stop:
+                break
+
+    def choose_apertures(self, row):
+        # Measuring time and averaging of each band of the row, probing the noise of the bands that are not cached.
+        #  The probe readings are not data, so the LCR signals (live plot and readout) are blocked meanwhile.
+        self.meas_status_update.emit('Measuring noise to choose measuring times...')
+        signals_blocked = self.parent.lcr.blockSignals(True)
+        try:
+            self.band_settings = self.parent.aperture_planner.band_settings(self.parent.lcr,
+                                                                            self.parent.aperture_key(row),
+                                                                            min(row.freq_steps), max(row.freq_steps),
+                                                                            self.parent.noise_target)
+        finally:
+            self.parent.lcr.blockSignals(signals_blocked)
+        self.meas_status_update.emit('Measurement in progress...')
+
+    def measure_adaptive_sweep(self, index, row, start_step=0):
+        # The coarse pass of the row, then rounds of extra points where the spectrum bends the most until the row's
+        #  point budget is spent or every interval is within adaptive_tolerance. Points already in the buffer (from a
+        #  resumed journal) count as measured, so an interrupted sweep picks up where it was.
+        columns = self.data_buffer.columns
+        measured = set(self.data_buffer.column(columns[0]).tolist())
+        freq_steps = [freq for freq in row.freq_steps if freq not in measured]
+        step = start_step
+        while not self.stop:
+            if freq_steps:
+                self.measure_sweep(index, freq_steps, step)
+                step = len(self.data_buffer)
+            # Readings the LCR flagged (overloads and the like) are left out of the curvature estimate
+            valid = self.data_buffer.column('Data Status') == 0
+            freq_steps = refine_frequencies(self.data_buffer.column(columns[0]),
+                                            [np.where(valid, self.data_buffer.column(column), np.nan)
+                                             for column in columns[1:3]],
+                                            row.num_points - step, self.parent.adaptive_tolerance)
+            if not freq_steps:
+                break
+
+    def equilibration_state(self):
+        # Journaled after blocking_func, override to let a resumed set skip an equilibration that was already done
+        return None
+
+    def restore_equilibration_state(self, state):
+        pass
+
     def condition_equilibration_delay(self):
         count = 0
         while count < self.step_delay:
@@ -633,74 +1094,140 @@ class CapFreqMeasureWorkerObject(QObject):
     def measurement_cleanup(self):
         self.meas_status_update.emit('Measurement finished.')
 
+    def write_trace(self):
+        try:
+            tracer.write_chrome_trace(self.parent.trace_file_path('.json'))
+            tracer.write_csv(self.parent.trace_file_path('.csv'))
+        except OSError as error:
+            print('Could not write trace: {}'.format(error))
+
     def measure(self):
         self.meas_status_update.emit("Starting measurement.")
-        # Write configured parameters to lcr
-        self.parent.setup_lcr()
+        if self.parent.enable_tracing:
+            tracer.enable()
 
-        # Generate the matrix of tests to run
-        self.parent.generate_test_matrix()
+        # Write configured parameters to lcr, nothing is measured with an instrument that is not set up
+        try:
+            self.parent.setup_lcr()
+        except InstrumentIOError as error:
+            if tracer.enabled:
+                tracer.disable()
+            self.meas_status_update.emit('Measurement not started, LCR is not responding ({}).'
+                                         .format(error.abbreviation))
+            self.measurement_finished.emit()
+            return
 
         # Set up the data column headers
         columns = self.get_out_columns()
+        self.point_setting = []
 
-        # For each measurement in the test matrix
-        for index, row in self.parent.tests_df.iterrows():
-            # Create an empty data frame to hold results, Column Headers determined by measurement type
-            self.data_df = pd.DataFrame(data=None, columns=columns)
-
-            # Set test params for this measurement
-            self.set_test_params(row)
-
-            # Set the information labels to match this row
-            self.set_current_meas_labels()
-
-            # Wait for whatever blocking function is needed (just delay here, override for temp)
-            #  Return instrument to defaults while waiting so no one kills their samples
-            self.parent.return_to_defaults()
-            self.blocking_func()
-
-            # Set lcr according to step parameters
-            self.parent.lcr.signal_level(self.parent.combo_signal_type.currentText(), self.step_osc)
-            self.parent.lcr.dc_bias_level(self.parent.combo_bias_type.currentText(), self.step_bias)
-
-            # Generate frequency points for measurement
-            freq_steps = Static.generate_log_steps(int(self.step_start),
-                                                   int(self.step_stop),
-                                                   int(self.parent.num_pts))
-
-            # Delay to allow sample to equilibrate at measurement parameters
-            self.condition_equilibration_delay()
+        # Continue an interrupted set from its journal if the widget asked for it
+        resume_state = self.resume_state
+        self.resume_state = None
+        finished = False
+        self.parent.open_data_file(columns, resume_state)
+        if resume_state is not None:
+            self.restore_equilibration_state(resume_state.equilibrated)
 
-            # Start a new data line in each plot
-            self.parent.live_plot.canvas.start_new_line()
+        # Time every stage against the prediction, the plan may have changed since it was last predicted
+        predictor = self.parent.run_predictor
+        self.parent.predict_run_time()
+        predictor.begin()
 
-            self.meas_status_update.emit('Measurement in progress...')
-
-            for step_idx in range(0, len(freq_steps)):
-                # Set the lcr to the correct frequency
-                self.parent.lcr.signal_frequency(freq_steps[step_idx])
-
-                # Wait for measurement to stabilize (50ms to allow signal to stabilize + user set delay)
-                sleep(self.parent.pre_meas_delay + 0.05)
-
-                # Trigger the measurement to start
-                self.parent.lcr.trigger_init()
-
-                # Read data and store it to the dataframe
-                self.read_new_data()
-
-                # Emit signal to update progress bar
-                self.freq_step_finished.emit([int(index.split('M')[-1]), step_idx])
+        try:
+            # For each measurement in the plan, checked and compiled by generate_test_matrix before the run
+            for row in self.parent.plan:
+                index = row.key
+                resumed_points = []
+                if resume_state is not None:
+                    if index in resume_state.finished_rows():
+                        self.parent.data_dict[index] = resume_state.dataframe(index)
+                        predictor.skip(index)
+                        self.freq_step_finished.emit([int(index.split('M')[-1]), row.num_points - 1])
+                        continue
+                    resumed_points = resume_state.points(index)
+
+                predictor.start_row(index)
+                # Create an empty buffer to hold results, Column Headers determined by measurement type
+                self.data_buffer = SweepBuffer(columns, capacity=row.num_points)
+                for data in resumed_points:
+                    self.data_buffer.append(data)
+
+                # Set test params for this measurement
+                self.set_test_params(row)
+
+                # Set the information labels to match this row
+                self.set_current_meas_labels()
+
+                # Wait for whatever blocking function is needed (just delay here, override for temp)
+                #  Return instrument to defaults while waiting so no one kills their samples
+                if self.rests_at_defaults(row):
+                    self.parent.return_to_defaults()
+                with tracer.span('equilibration', row=index), predictor.stage(index, 'thermal'):
+                    self.blocking_func()
+                equilibration_state = self.equilibration_state()
+                if equilibration_state is not None:
+                    self.parent.save_equilibration(index, equilibration_state)
+
+                # Set lcr according to step parameters
+                with self.parent.lcr.batch(opc=True):
+                    self.parent.lcr.signal_level(self.parent.combo_signal_type.currentText(), self.step_osc)
+                    self.parent.lcr.dc_bias_level(self.parent.combo_bias_type.currentText(), self.step_bias)
+
+                freq_steps = row.freq_steps
+
+                if resumed_points:
+                    self.parent.resume_data_block(index)
+                else:
+                    self.parent.start_data_block(index, self.parent.generate_header(index, row), columns)
+
+                # Delay to allow sample to equilibrate at measurement parameters
+                with tracer.span('settle delay', row=index), predictor.stage(index, 'settle'):
+                    self.condition_equilibration_delay()
+
+                # Start a new data line in each plot
+                self.parent.live_plot.canvas.start_new_line()
+
+                self.meas_status_update.emit('Measurement in progress...')
+
+                # Points already in the journal are not measured again
+                start_step = len(resumed_points)
+                with tracer.span('sweep', row=index, points=row.num_points - start_step), \
+                        predictor.stage(index, 'sweep'):
+                    if self.parent.adaptive_aperture and start_step < row.num_points:
+                        self.choose_apertures(row)
+                    if start_step >= row.num_points:
+                        pass
+                    elif self.parent.plan.spacing == 'adaptive':
+                        self.measure_adaptive_sweep(index, row, start_step)
+                    else:
+                        self.measure_sweep(index, freq_steps[start_step:], start_step)
+
+                # Store the measurement data by measurement number, adaptive points are measured out of order
+                self.data_df = self.data_buffer.to_dataframe()
+                if self.parent.plan.spacing == 'adaptive':
+                    self.data_df = self.data_df.sort_values(columns[0], ignore_index=True)
+                self.parent.data_dict[index] = self.data_df
+                # A sweep that was not stopped is complete, an adaptive one may have needed fewer points than allowed
+                complete = not self.stop or len(self.data_buffer) >= row.num_points
+                with tracer.span('save', row=index):
+                    self.parent.save_data(complete)
+                # Resumed points were measured in an earlier run, so the row only calibrates when measured whole
+                predictor.end_row(index, complete and not self.stop and not resumed_points)
                 if self.stop:
                     break
-
-            # Store the measurement data in a field of the tests_df
-            self.parent.header_dict[index] = self.parent.generate_header(index, row)
-            self.parent.data_dict[index] = self.data_df
-            self.parent.save_data()
-            if self.stop:
-                break
+            else:
+                finished = True
+        except InstrumentIOError as error:
+            self.meas_status_update.emit('Measurement stopped, LCR is not responding ({}).'
+                                         .format(error.abbreviation))
+        finally:
+            self.parent.close_data_file(finished)
+            predictor.finish(self.parent.data_file_path())
+
+        if tracer.enabled:
+            tracer.disable()
+            self.write_trace()
 
         self.stop = False
         self.measurement_cleanup()
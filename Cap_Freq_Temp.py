@@ -8,10 +8,14 @@ from Agilent_E4980A import AgilentE4980A
 from File_Print_Headers import *
 from statistics import stdev, mean, StatisticsError
 from Static_Functions import to_sigfigs
+import asyncio
 from time import sleep, time
 from datetime import timedelta
 from pyvisa.errors import VisaIOError
-from PyQt5.QtWidgets import QLineEdit, QLabel, QGroupBox, QRadioButton, QApplication, QCheckBox
+from PyQt5.QtWidgets import QLineEdit, QLabel, QGroupBox, QRadioButton, QApplication, QCheckBox, QComboBox, QMessageBox
+from Measurement_Plan import PLAN_ORDERS, parse_pinned_keys, thermal_time
+from Run_Time_Predictor import format_duration
+from Async_Instruments import AsyncAgilentE4980A, AsyncSunEC1xChamber, InstrumentLoop
 
 
 class CapFreqTempWidget(CapFreqWidget):
@@ -31,6 +35,7 @@ class CapFreqTempWidget(CapFreqWidget):
                                     'DC Bias [V]',
                                     'Equilibration Delay [s]',
                                     'Temperature Set Point [°C]']
+        self.plan_has_temp = True
 
         self.gbox_thermal_settings = self.findChild(QGroupBox, 'gbox_thermal_settings')
         self.ln_ramp = self.findChild(QLineEdit, 'ln_ramp')
@@ -48,6 +53,14 @@ class CapFreqTempWidget(CapFreqWidget):
         self.ln_z_stdev_tol.setText('500')
         self.check_return_to_rt = self.findChild(QCheckBox, 'check_return_to_rt')
         self.check_always_stab = self.findChild(QCheckBox, 'check_always_stab')
+        self.combo_plan_order = self.findChild(QComboBox, 'combo_plan_order')
+        self.combo_plan_order.addItems(list(PLAN_ORDERS.keys()))
+        self.ln_pinned_rows = self.findChild(QLineEdit, 'ln_pinned_rows')
+        # Estimated seconds of ramping and dwelling saved by reordering the plan, see generate_test_matrix
+        self.plan_time_saved = 0.0
+        # Chamber temperature when the plan was built, None if it could not be read, see plan_start_temp_reading
+        self.plan_start_temp = None
+        self.plan_start_temp_read = False
 
         self.radio_chamber_tc = self.findChild(QRadioButton, 'radio_chamber_tc')
         self.radio_user_tc = self.findChild(QRadioButton, 'radio_user_tc')
@@ -55,6 +68,10 @@ class CapFreqTempWidget(CapFreqWidget):
         self.lbl_curr_temp = self.findChild(QLabel, 'lbl_curr_temp')
         self.lbl_curr_meas_temp = self.findChild(QLabel, 'lbl_curr_meas_temp')
 
+        self.plan_controls += ['ln_ramp', 'ln_dwell', 'ln_stab_int', 'ln_temp_tol', 'ln_stdev_tol', 'ln_z_stdev_tol',
+                               'check_z_stability', 'check_always_stab', 'check_return_to_rt', 'combo_plan_order',
+                               'ln_pinned_rows']
+
         self.init_setup_table()
         self.change_dwell()
         self.change_ramp()
@@ -109,6 +126,54 @@ class CapFreqTempWidget(CapFreqWidget):
             except VisaIOError:
                 print('Error on getting temperature from sun chamber')
 
+    def generate_test_matrix(self, reorder=True):
+        # Optionally run the plan grouped by set point, starting from the chamber temperature
+        super().generate_test_matrix(reorder)
+        self.plan_time_saved = 0.0
+        self.plan_start_temp_read = False
+        order = PLAN_ORDERS[self.combo_plan_order.currentText()]
+        if order is None or not reorder:
+            return
+
+        start_temp = self.plan_start_temp_reading()
+        entered = list(self.plan.rows)
+        self.plan.reorder(order, parse_pinned_keys(self.ln_pinned_rows.text()), start_temp)
+
+        always_stab = self.check_always_stab.isChecked()
+        self.plan_time_saved = (thermal_time(entered, self.ramp, self.dwell, start_temp, always_stab)
+                                - thermal_time(self.plan.rows, self.ramp, self.dwell, start_temp, always_stab))
+
+    def plan_start_temp_reading(self):
+        # The chamber is only read when the order or the prediction of a plan needs it, once per plan built
+        if not self.plan_start_temp_read:
+            start_temp = self.sun.get_temp()
+            self.plan_start_temp = None if start_temp == -9999.0 else start_temp
+            self.plan_start_temp_read = True
+
+        return self.plan_start_temp
+
+    def prediction_settings(self):
+        settings = super().prediction_settings()
+        settings.update({'ramp': self.ramp,
+                         'dwell': self.dwell,
+                         'start_temp': self.plan_start_temp_reading(),
+                         'always_stab': self.check_always_stab.isChecked()})
+
+        return settings
+
+    def confirm_plan(self):
+        if self.plan_time_saved <= 0:
+            return True
+
+        saved = timedelta(seconds=int(self.plan_time_saved))
+        answer = QMessageBox.information(self, 'Measurement order',
+                                         'The measurements will run in the order {} to reduce temperature changes.\n'
+                                         'Estimated time saved: {}\nPredicted duration: {}'
+                                         .format(', '.join(self.plan.keys()), saved,
+                                                 format_duration(self.run_predictor.total())),
+                                         QMessageBox.Ok | QMessageBox.Cancel, QMessageBox.Ok)
+        return answer == QMessageBox.Ok
+
     def get_header_vars(self, index, row):
         header_vars = super().get_header_vars(index, row)
 
@@ -167,13 +232,38 @@ class CapFreqTempMeasureWorkerObject(CapFreqMeasureWorkerObject):
         self.chamber_stdev = 0
         self.z_stdev = 0
         self.prev_step_temp = None
+        # The stability check polls the chamber while the LCR measures, each on its own executor, with the loop
+        #  running them on the worker thread. They only exist during a measurement, see measure.
+        self.async_lcr = None
+        self.async_sun = None
+        self.instrument_loop = None
+
+    def measure(self):
+        # Executor threads and the event loop are released when the measurement ends, however it ends
+        self.async_lcr = AsyncAgilentE4980A(self.parent.lcr)
+        self.async_sun = AsyncSunEC1xChamber(self.parent.sun)
+        self.instrument_loop = InstrumentLoop()
+        try:
+            super().measure()
+        finally:
+            self.instrument_loop.close()
+            self.async_lcr.close()
+            self.async_sun.close()
+            self.async_lcr = None
+            self.async_sun = None
+            self.instrument_loop = None
 
     def set_test_params(self, row):
         super().set_test_params(row)
         self.prev_step_temp = self.step_temp
-        self.step_temp = float(row[self.parent.meas_setup_hheaders[5]])
+        self.step_temp = row.temp
         # print("Setting test temperature to {}".format(self.step_temp))
 
+    def rests_at_defaults(self, row):
+        # The chamber wait and the stability check run at the defaults, the check measures the impedance there
+        return (super().rests_at_defaults(row) or self.step_temp != self.prev_step_temp
+                or self.parent.check_always_stab.isChecked())
+
     def set_current_meas_labels(self):
         super().set_current_meas_labels()
         self.parent.lbl_curr_meas_temp.setText(str(self.step_temp))
@@ -192,6 +282,51 @@ class CapFreqTempMeasureWorkerObject(CapFreqMeasureWorkerObject):
         self.step_temp = None
         self.prev_step_temp = None
 
+    def equilibration_state(self):
+        # Temperature step reached and checked, a resumed set starts from here without waiting for it again
+        if self.stop:
+            return None
+
+        return {'temp': self.step_temp,
+                'user_avg': self.user_avg,
+                'user_stdev': self.user_stdev,
+                'chamber_avg': self.chamber_avg,
+                'chamber_stdev': self.chamber_stdev,
+                'z_stdev': self.z_stdev}
+
+    def restore_equilibration_state(self, state):
+        # The chamber may have been off or lost its set point since the journal was written (e.g. a power loss), so
+        #  the check is only skipped while it is still at the journaled temperature
+        if state is None:
+            return
+
+        chamber_temp = self.parent.sun.get_temp()
+        temp_tol = float(self.parent.ln_temp_tol.text())
+        if abs(chamber_temp - state['temp']) > temp_tol:
+            self.meas_status_update.emit('Chamber at {} instead of {}, repeating the temperature stability check.'
+                                         .format(chamber_temp, state['temp']))
+            return
+
+        self.step_temp = state['temp']
+        self.user_avg = state['user_avg']
+        self.user_stdev = state['user_stdev']
+        self.chamber_avg = state['chamber_avg']
+        self.chamber_stdev = state['chamber_stdev']
+        self.z_stdev = state['z_stdev']
+        # The chamber may have lost its set point with the rest of the setup
+        self.parent.sun.set_setpoint(self.step_temp)
+
+    async def poll_stability(self):
+        # One stability sample, (user temp, chamber temp, LCR data). The chamber is read while the LCR measures, its
+        #  two queries stay in order with the pause between them.
+        async def read_chamber():
+            user_temp = await self.async_sun.get_user_temp()
+            await asyncio.sleep(0.05)
+            return user_temp, await self.async_sun.get_temp()
+
+        (user_temp, chamber_temp), data = await asyncio.gather(read_chamber(), self.async_lcr.get_data())
+        return user_temp, chamber_temp, data
+
     def blocking_func(self):
         user_T = []
         chamber_T = []
@@ -230,10 +365,10 @@ class CapFreqTempMeasureWorkerObject(CapFreqMeasureWorkerObject):
             start_time = time()
             for i in range(0, int(self.parent.dwell * 60)):
                 if count % self.parent.stab_int == 0:
-                    user_T.append(self.parent.sun.get_user_temp())
-                    sleep(0.05)
-                    chamber_T.append(self.parent.sun.get_temp())
-                    z.append(self.parent.lcr.get_data()[1])
+                    user_temp, chamber_temp, data = self.instrument_loop.run(self.poll_stability())
+                    user_T.append(user_temp)
+                    chamber_T.append(chamber_temp)
+                    z.append(data[1])
                     if self.parent.radio_chamber_tc.isChecked():
                         self.parent.lbl_curr_temp.setText(str(chamber_T[-1]))
                     elif self.parent.radio_user_tc.isChecked():
@@ -243,7 +378,8 @@ class CapFreqTempMeasureWorkerObject(CapFreqMeasureWorkerObject):
                 self.meas_status_update.emit("Checking stability at {temp}. Time Remaining: {time}"
                                              .format(temp=self.step_temp,
                                                      time=time_left))
-                sleep(0.93)
+                # One sample per second however long the polls took
+                sleep(max(start_time + i + 1 - time(), 0.0))
                 if self.stop:
                     break
             if self.stop:
@@ -0,0 +1,215 @@
+import os
+import re
+import sys
+import json
+import mmap
+from io import BytesIO
+from time import perf_counter
+import pandas as pd
+from File_Print_Headers import HEADER_ATTR_NAMES
+
+HEADER_END = '************End Header************'
+DATA_END = '*************End Data*************'
+UNIT_LABEL = re.compile(r'^(Oscillator|DC Bias) \[(.*)\]$')
+UNIT_ATTRS = {'Oscillator': ('osc', 'osc_type'), 'DC Bias': ('bias', 'bias_type')}
+# Bump when the layout of the cached index changes
+INDEX_VERSION = 1
+
+
+def typed_value(text):
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+
+    return text
+
+
+def parse_header(header):
+    # Typed attributes from a CAP_FREQ_HEADER (plus CAP_FREQ_TEMP_HEADER) text block. Thermal values marked with '*'
+    #  were carried over from the previous measurement, which is stored as thermal_stats_reused.
+    attrs = {}
+    for line in header.splitlines():
+        if ':\t' not in line or line.startswith('*'):
+            continue
+
+        label, value = line.split(':\t', 1)
+        if value.endswith('*'):
+            value = value[:-1]
+            attrs['thermal_stats_reused'] = True
+
+        unit_match = UNIT_LABEL.match(label)
+        if unit_match:
+            value_name, unit_name = UNIT_ATTRS[unit_match.group(1)]
+            attrs[value_name] = typed_value(value)
+            attrs[unit_name] = unit_match.group(2)
+        elif label == 'Notes':
+            attrs['notes'] = value
+        else:
+            attrs[HEADER_ATTR_NAMES.get(label, label)] = typed_value(value)
+
+    if 'user_avg' in attrs:
+        attrs.setdefault('thermal_stats_reused', False)
+    # The full text is kept as well, so a file converted back to .dat is unchanged
+    attrs['header'] = header
+
+    return attrs
+
+
+def decode_text(raw):
+    # Files written on Windows use the ANSI code page for the degree signs in the thermal header
+    try:
+        text = raw.decode('utf-8')
+    except UnicodeDecodeError:
+        text = raw.decode('cp1252', errors='replace')
+
+    return text.replace('\r\n', '\n')
+
+
+def index_path(path):
+    return path + '.index.json'
+
+
+class DatFileReader(object):
+    # Random access to the measurement blocks of a .dat file. The file is memory-mapped and scanned once for the
+    #  byte offsets of every block, and that index (with the parsed headers) is cached next to the file. Measurements
+    #  are only parsed when they are loaded. A file that has grown since the index was made (e.g. a measurement still
+    #  in progress) is only scanned from the end of its last complete block.
+    def __init__(self, path, use_cache=True):
+        self.path = path
+        self.use_cache = use_cache
+        self.blocks = []
+        self.file = open(path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+
+        if not (use_cache and self.load_index()):
+            self.blocks = []
+            self.scan(0)
+            if use_cache:
+                self.save_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, key):
+        return self.load(key)
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.file.close()
+
+    def skip_newlines(self, pos):
+        while pos < self.size and self.mm[pos:pos + 1] in (b'\r', b'\n'):
+            pos += 1
+
+        return pos
+
+    def scan(self, pos):
+        header_end = HEADER_END.encode()
+        data_end = DATA_END.encode()
+        while True:
+            pos = self.skip_newlines(pos)
+            header_pos = self.mm.find(header_end, pos)
+            if header_pos < 0:
+                break
+
+            table_start = self.skip_newlines(header_pos + len(header_end))
+            end_pos = self.mm.find(data_end, table_start)
+            complete = end_pos >= 0
+            # A block still being written may end part way through a row
+            table_end = end_pos if complete else max(table_start, self.mm.rfind(b'\n', table_start) + 1)
+
+            header = decode_text(self.mm[pos:header_pos + len(header_end)]) + '\n\n'
+            attrs = parse_header(header)
+            self.blocks.append({'key': str(attrs.get('meas_num', 'M{}'.format(len(self.blocks) + 1))),
+                                'header_start': pos,
+                                'table_start': table_start,
+                                'table_end': table_end,
+                                'complete': complete,
+                                'attrs': attrs})
+            if not complete:
+                break
+            pos = end_pos + len(data_end)
+
+    def load_index(self):
+        try:
+            with open(index_path(self.path), 'r') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if index.get('version') != INDEX_VERSION or index.get('size', -1) > self.size:
+            return False
+        if index['size'] == self.size and index['mtime'] == os.path.getmtime(self.path):
+            self.blocks = index['blocks']
+            return True
+
+        # The file changed, only complete blocks that still end where they did are kept and the rest of the file is
+        #  scanned again
+        data_end = DATA_END.encode()
+        self.blocks = [block for block in index['blocks'] if block['complete']]
+        for block in self.blocks:
+            if self.mm[block['table_end']:block['table_end'] + len(data_end)] != data_end:
+                return False
+        self.scan(self.blocks[-1]['table_end'] + len(data_end) if self.blocks else 0)
+        self.save_index()
+
+        return True
+
+    def save_index(self):
+        try:
+            with open(index_path(self.path), 'w') as file:
+                json.dump({'version': INDEX_VERSION,
+                           'size': self.size,
+                           'mtime': os.path.getmtime(self.path),
+                           'blocks': self.blocks}, file)
+        except OSError as error:
+            print('Could not write index for {}: {}'.format(self.path, error))
+
+    def keys(self):
+        return [block['key'] for block in self.blocks]
+
+    def block(self, key):
+        # key is a measurement number like 'M3' or a position in the file
+        if isinstance(key, int):
+            return self.blocks[key]
+        for block in self.blocks:
+            if block['key'] == key:
+                return block
+
+        raise KeyError(key)
+
+    def header(self, key):
+        return self.block(key)['attrs']['header']
+
+    def attrs(self, key):
+        return self.block(key)['attrs']
+
+    def load(self, key):
+        # DataFrame of one measurement, indexed by idx like the file
+        block = self.block(key)
+        table = self.mm[block['table_start']:block['table_end']]
+        if not table:
+            return pd.DataFrame()
+        return pd.read_csv(BytesIO(table), sep='\t', index_col='idx')
+
+    def load_array(self, key):
+        return self.load(key).to_numpy()
+
+
+if __name__ == "__main__":
+    start = perf_counter()
+    with DatFileReader(sys.argv[1]) as reader:
+        print('{} measurements indexed in {:.1f} ms'.format(len(reader), (perf_counter() - start) * 1000))
+        for block in reader.blocks:
+            print('{}\t{}\t{}'.format(block['key'], block['attrs'].get('meas_type', ''),
+                                      '' if block['complete'] else 'incomplete'))
@@ -0,0 +1,69 @@
+import os
+import math
+
+# Written after the rows of every measurement block, the same as the original save_data output
+BLOCK_END = '\n*************End Data*************\n\n'
+
+
+def format_value(value):
+    # Match the pandas to_csv output: repr of floats, empty for missing values
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    value = float(value)
+    if math.isnan(value):
+        return ''
+    return repr(value)
+
+
+class DatFileWriter(object):
+    # Append-only writer for the .dat format: each measurement block is a text header, a tab separated table with an
+    #  'idx' index column, and the End Data line. Rows are written as they arrive and completed blocks are never
+    #  rewritten. The file is fsynced at the end of every block so a crash can only lose the block in progress.
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open(path, 'a' if append else 'w')
+        self.row_index = 0
+        self.in_block = False
+        self.blocks_written = 0
+
+    def begin_block(self, header, columns):
+        if self.in_block:
+            self.end_block()
+
+        self.file.write(header)
+        self.file.write('\t'.join(['idx'] + list(columns)) + '\n')
+        self.file.flush()
+        self.row_index = 0
+        self.in_block = True
+
+    def write_row(self, values):
+        self.file.write('\t'.join([str(self.row_index)] + [format_value(value) for value in values]) + '\n')
+        self.file.flush()
+        self.row_index += 1
+
+    def end_block(self):
+        if not self.in_block:
+            return
+
+        self.file.write(BLOCK_END)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.in_block = False
+        self.blocks_written += 1
+
+    def write_block(self, header, data_df):
+        # Write a complete block from a DataFrame in one go
+        self.begin_block(header, data_df.columns)
+        for values in data_df.itertuples(index=False):
+            self.write_row(values)
+        self.end_block()
+
+    def close(self):
+        # An unfinished block is closed off so the file stays readable
+        if self.file.closed:
+            return
+
+        self.end_block()
+        self.file.close()
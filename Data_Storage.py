@@ -0,0 +1,214 @@
+import os
+import sys
+import glob
+import json
+import zipfile
+import argparse
+from abc import ABC, abstractmethod
+import numpy as np
+from Dat_File_Writer import DatFileWriter
+from Dat_File_Reader import DatFileReader, parse_header
+from Impedance_Conversion import measurement_function, convertible, convert_dataframe
+
+# The binary formats are optional, the text .dat format and NPZ are always available
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+class DatStorage(object):
+    # The original text format, rows are streamed to the file as they arrive
+    extension = '.dat'
+
+    def __init__(self, path):
+        self.path = path
+        self.writer = DatFileWriter(path)
+
+    def begin_measurement(self, key, header, columns):
+        self.writer.begin_block(header, columns)
+
+    def write_row(self, values):
+        self.writer.write_row(values)
+
+    def end_measurement(self):
+        self.writer.end_block()
+
+    def close(self):
+        self.writer.close()
+
+
+class ColumnarStorage(ABC):
+    # Base for the binary formats: rows of the current measurement are collected and written as one array per
+    #  column when the measurement ends, with the header fields as typed attributes
+    extension = None
+
+    def __init__(self, path):
+        self.path = path
+        self.key = None
+        self.columns = []
+        self.rows = []
+        self.attrs = {}
+
+    def begin_measurement(self, key, header, columns):
+        self.end_measurement()
+        self.key = str(key)
+        self.columns = list(columns)
+        self.rows = []
+        self.attrs = parse_header(header)
+
+    def write_row(self, values):
+        self.rows.append([float(value) for value in values])
+
+    def end_measurement(self):
+        if self.key is None:
+            return
+
+        data = np.array(self.rows, dtype=float).reshape(-1, len(self.columns))
+        arrays = {column: data[:, icol] for icol, column in enumerate(self.columns)}
+        self.write_measurement(self.key, self.columns, arrays, self.attrs)
+        self.key = None
+        self.rows = []
+
+    @abstractmethod
+    def write_measurement(self, key, columns, arrays, attrs):
+        pass
+
+    def close(self):
+        # An unfinished measurement is still written
+        self.end_measurement()
+
+
+class HDF5Storage(ColumnarStorage):
+    # One group per measurement with a chunked, compressed dataset per column
+    extension = '.h5'
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.file = h5py.File(path, 'w')
+
+    def write_measurement(self, key, columns, arrays, attrs):
+        group = self.file.create_group(key)
+        for column in columns:
+            data = arrays[column]
+            if len(data):
+                group.create_dataset(column.replace('/', '_'), data=data, chunks=True, compression='gzip',
+                                     shuffle=True)
+            else:
+                group.create_dataset(column.replace('/', '_'), data=data)
+        group.attrs['columns'] = columns
+        for name, value in attrs.items():
+            group.attrs[name] = value
+        self.file.flush()
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+
+class ParquetStorage(ColumnarStorage):
+    # A directory with one Parquet file per measurement, the header fields are in the schema metadata
+    extension = '.parquet'
+
+    def __init__(self, path):
+        super().__init__(path)
+        os.makedirs(path, exist_ok=True)
+
+    def write_measurement(self, key, columns, arrays, attrs):
+        table = pa.table({column: arrays[column] for column in columns})
+        table = table.replace_schema_metadata({'probe_station': json.dumps(attrs)})
+        pq.write_table(table, os.path.join(self.path, key + '.parquet'), compression='zstd')
+
+
+class NPZStorage(ColumnarStorage):
+    # Compressed NumPy archive (np.load reads it) with '<key>/<column>' arrays and the header fields as JSON in
+    #  '<key>/__attrs__'. An .npz file is a zip of .npy files, so each measurement is appended to it as new members
+    #  and the measurements before it are not written again.
+    extension = '.npz'
+
+    def __init__(self, path):
+        super().__init__(path)
+        # Start a new archive, like the other formats do
+        zipfile.ZipFile(path, 'w').close()
+
+    def write_measurement(self, key, columns, arrays, attrs):
+        members = [(column, arrays[column]) for column in columns]
+        members += [('__columns__', np.array(columns)), ('__attrs__', np.array(json.dumps(attrs)))]
+        with zipfile.ZipFile(self.path, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, array in members:
+                with archive.open('{}/{}.npy'.format(key, name), 'w', force_zip64=True) as file:
+                    np.lib.format.write_array(file, np.asanyarray(array), allow_pickle=False)
+
+
+STORAGE_FORMATS = {'Text (.dat)': DatStorage,
+                   'HDF5 (.h5)': HDF5Storage,
+                   'Parquet': ParquetStorage,
+                   'NumPy (.npz)': NPZStorage}
+
+
+def available_formats():
+    unavailable = []
+    if h5py is None:
+        unavailable.append('HDF5 (.h5)')
+    if pq is None:
+        unavailable.append('Parquet')
+
+    return [name for name in STORAGE_FORMATS if name not in unavailable]
+
+
+def storage_path(storage_format, path):
+    return os.path.splitext(path)[0] + STORAGE_FORMATS[storage_format].extension
+
+
+def open_storage(storage_format, path):
+    return STORAGE_FORMATS[storage_format](storage_path(storage_format, path))
+
+
+def convert_dat_file(path, storage_format, derived=False, area=None, thickness=None):
+    # Store every block of an existing .dat file in storage_format, next to the original. With derived, every
+    #  impedance representation (see Impedance_Conversion) is stored as extra columns, permittivity and modulus only
+    #  if the sample area [m^2] and thickness [m] are given.
+    storage = open_storage(storage_format, path)
+    try:
+        with DatFileReader(path) as reader:
+            for iblock, key in enumerate(reader.keys()):
+                data_df = reader.load(iblock)
+                function = measurement_function(reader.attrs(iblock), data_df.columns)
+                if derived and convertible(function) and not data_df.empty:
+                    data_df = convert_dataframe(data_df, function, area, thickness)
+                storage.begin_measurement(key, reader.header(iblock), data_df.columns)
+                for values in data_df.itertuples(index=False):
+                    storage.write_row(values)
+    finally:
+        storage.close()
+
+    return storage.path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert Cap-Freq .dat files to a binary storage format')
+    parser.add_argument('files', nargs='+', help='.dat files or glob patterns')
+    parser.add_argument('--format', choices=['hdf5', 'parquet', 'npz'], default='hdf5')
+    parser.add_argument('--derived', action='store_true', help='Also store Z, Y, permittivity, modulus and tan delta')
+    parser.add_argument('--area', type=float, help='Electrode area [m^2], for permittivity and modulus')
+    parser.add_argument('--thickness', type=float, help='Sample thickness [m], for permittivity and modulus')
+    args = parser.parse_args()
+
+    storage_format = {'hdf5': 'HDF5 (.h5)', 'parquet': 'Parquet', 'npz': 'NumPy (.npz)'}[args.format]
+    if storage_format not in available_formats():
+        sys.exit('{} support is not installed'.format(storage_format))
+
+    for pattern in args.files:
+        for dat_path in sorted(glob.glob(pattern)):
+            try:
+                print('{} -> {}'.format(dat_path, convert_dat_file(dat_path, storage_format, args.derived,
+                                                              args.area, args.thickness)))
+            except (OSError, ValueError) as error:
+                print('Could not convert {}: {}'.format(dat_path, error))
@@ -13,6 +13,9 @@ CAP_FREQ_HEADER = ('**********************************'
                    '\nOscillator [{osc_type}]:\t{osc}'
                    '\nDC Bias [{bias_type}]:\t{bias}'
                    '\nPre Measurement Delay (ms):\t{pre_meas_delay}'
+                   '\nPredicted Set Duration [s]:\t{predicted_total}'
+                   '\nPredicted Elapsed [s]:\t{predicted_elapsed}'
+                   '\nActual Elapsed [s]:\t{actual_elapsed}'
                    '\n***********Sample Notes***********'
                    '\n{notes}'
                    '\n************End Header************\n\n')
@@ -30,3 +33,29 @@ CAP_FREQ_TEMP_HEADER = ('\n*************Thermal*************'
                         '\nChamber Probe Std. Deviation [°C]:\t{chamber_stdev}'
                         '\nImpedance Value Standard Deviation [Ohm]:\t{z_stdev}'
                         '\n***********Sample Notes***********')
+
+# Attribute names for the header fields when a measurement is stored in a binary format (see Data_Storage). The
+#  Oscillator and DC Bias lines carry their unit in the label and are stored as osc/osc_type and bias/bias_type.
+HEADER_ATTR_NAMES = {'Measurement Type': 'meas_type',
+                     'Measurement Date': 'meas_date',
+                     'Measurement Time': 'meas_time',
+                     'Measurement Number': 'meas_num',
+                     'Start Frequency [Hz]': 'start_freq',
+                     'Stop Frequency [Hz]': 'stop_freq',
+                     'Impedance Range': 'range',
+                     'Number of Points': 'num_pts',
+                     'Data Averaging Per Point': 'data_averaging',
+                     'Per Step Delay': 'step_delay',
+                     'Pre Measurement Delay (ms)': 'pre_meas_delay',
+                     'Predicted Set Duration [s]': 'predicted_total',
+                     'Predicted Elapsed [s]': 'predicted_elapsed',
+                     'Actual Elapsed [s]': 'actual_elapsed',
+                     'Ramp Rate': 'ramp',
+                     'Dwell Before Measurement': 'dwell',
+                     'Stabilization Measurement Interval': 'stab_int',
+                     'User Probe Average T [°C]': 'user_avg',
+                     'User Probe Std. Deviation [°C]': 'user_stdev',
+                     'Chamber Probe Average T [°C]': 'chamber_avg',
+                     'Chamber Probe Std. Deviation [°C]': 'chamber_stdev',
+                     'Impedance Value Standard Deviation [Ohm]': 'z_stdev',
+                     'Notes': 'notes'}
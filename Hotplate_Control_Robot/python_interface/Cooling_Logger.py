@@ -21,4 +21,6 @@ if __name__ == "__main__":
         if count > save_count:
             count = 0
             tempcal.write_data()
+
+    tempcal.close()
         
\ No newline at end of file
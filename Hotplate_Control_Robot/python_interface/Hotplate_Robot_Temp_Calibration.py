@@ -1,7 +1,14 @@
+import os
+import sys
 from datetime import date, datetime
 from time import sleep
-import pandas as pd
+
+# The log buffer, writer and instrument tracer are shared with the main program in the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
 from Robot_Class import HotplateRobot
+from Sweep_Buffer import SweepBuffer
+from Background_Writer import BackgroundWriter
 
 class TempCal():
     def __init__(self, logfile: str, port='COM4', baud=115200, timeout=0.5):
@@ -10,10 +17,13 @@ class TempCal():
         self.robot = HotplateRobot(port, baud, timeout=timeout)
         self.last_move = None
         print("Building dataframe...")
-        self.df = pd.DataFrame(columns=['timestamp', 'last_move', 'position', 'temp',])
+        self.log = SweepBuffer(['timestamp', 'last_move', 'position', 'temp'], capacity=1024,
+                               dtypes={'timestamp': 'M8[us]', 'last_move': 'M8[us]', 'position': 'i8'})
         print("Setting logfile location...")
         self.logfile = logfile
         print("Logging to: {}".format(self.logfile))
+        # The log is rewritten on its own thread so the robot loop does not wait on the disk
+        self.io_writer = BackgroundWriter('Temperature log writer', max_queue=4)
 
         
     def get_row(self):
@@ -21,11 +31,16 @@ class TempCal():
                     last_move=self.last_move,
                     position=int(self.robot.query_param('p')),
                     temp=float(self.robot.query_param('t')))
-        self.df = self.df.append(row, ignore_index=True)
+        self.log.append(row)
         return row
     
     def write_data(self):
-        self.df.to_csv(self.logfile, sep=',', header=True, index=False)
+        # The DataFrame is a copy of the log, so the robot loop can keep appending while it is written
+        self.io_writer.submit(self.log.to_dataframe().to_csv, self.logfile, sep=',', header=True, index=False)
+
+    def close(self):
+        self.write_data()
+        self.io_writer.close()
     
     def move_to_next(self):
         new_position = int(self.robot.query_param('p')) - 5
@@ -59,6 +74,7 @@ if __name__ == "__main__":
                 complete = True
                 print("Measurement complete. Returning to hotplate off.")
                 tempcal.robot.update_position(180)
+                tempcal.close()
             else:
                 tempcal.move_to_next()
                 count=0
@@ -1,4 +1,11 @@
 import serial
+from time import perf_counter
+
+# The instrument tracer lives in the repository root, I/O is only traced when that is importable
+try:
+    from Instrument_Tracing import tracer
+except ImportError:
+    tracer = None
 
 
 class HotplateRobot(object):
@@ -27,7 +34,11 @@ class HotplateRobot(object):
         elif position < 0:
             position = 0
         update = start_char + "p," + str(position) + end_char
+        start = perf_counter()
         self.robot.write(update.encode('utf-8'))
+        if tracer is not None:
+            tracer.record('Hotplate write', 'io', start, perf_counter() - start, command=update.strip(), retries=0,
+                          result_size=0)
 
     def set_setpoint(self, stpt: float):
         pos = int(4.08339e-5*(stpt**2) - (2.8737e-1 * stpt) + 1.54425e2)
@@ -36,8 +47,13 @@ class HotplateRobot(object):
 
     def query_param(self, query: str, start_char='?', end_char='\r'):
         query = start_char + query + end_char
+        start = perf_counter()
         self.robot.write(query.encode('utf-8'))
-        return self.read_response()
+        response = self.read_response()
+        if tracer is not None:
+            tracer.record('Hotplate query', 'io', start, perf_counter() - start, command=query.strip(), retries=0,
+                          result_size=len(response))
+        return response
 
     def get_temp(self):
         temperature = self.query_param('t')
@@ -0,0 +1,201 @@
+import sys
+import argparse
+from collections import OrderedDict
+import numpy as np
+from Agilent_E4980A_Constants import PARAMETERS_BY_FUNC, FUNC_DICT
+
+# Conversions between the value pairs the E4980A returns for each measurement function and the complex impedance of
+#  the sample, and from that to the other usual representations. Everything works on numpy arrays of any shape, so a
+#  single point, a sweep or a whole file of sweeps is converted in one call. Points that can not be converted (zero
+#  readings, overloads) come out as nan or inf without warnings.
+
+VACUUM_PERMITTIVITY = 8.8541878128e-12
+
+
+# For the parallel (Cp, Lp) and series (Cs, Ls) functions, the conductance or resistance from the second value and
+#  the susceptance or reactance from the first. sign is +1 for Cp and Ls, -1 for Lp and Cs, the sign of D and Q.
+PARALLEL_CONDUCTANCE = {'D': lambda value, susceptance, sign: sign * value * susceptance,
+                        'Q': lambda value, susceptance, sign: sign * susceptance / value,
+                        'G': lambda value, susceptance, sign: value,
+                        'RP': lambda value, susceptance, sign: 1 / value}
+SERIES_RESISTANCE = {'D': lambda value, reactance, sign: sign * value * reactance,
+                     'Q': lambda value, reactance, sign: sign * reactance / value,
+                     'RS': lambda value, reactance, sign: value}
+
+# Functions whose two values do not determine the impedance. Rdc is the DC resistance of the sample, not a part of
+#  its AC impedance, so Lp-Rdc and Ls-Rdc are not converted rather than converted with Rdc taken for the real part.
+AMBIGUOUS_FUNCTIONS = ['LPRD', 'LSRD']
+
+
+@np.errstate(divide='ignore', invalid='ignore')
+def function_to_impedance(function, a, b, freqs):
+    # Complex impedance from the two values of an E4980A function (a key of PARAMETERS_BY_FUNC), the inverse of
+    #  impedance_to_function. The Vdc-Idc function gives the DC resistance V/I. Raises ValueError for unknown
+    #  functions and the ones in AMBIGUOUS_FUNCTIONS.
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    omega = 2 * np.pi * np.asarray(freqs, dtype=float)
+
+    if function in AMBIGUOUS_FUNCTIONS:
+        raise ValueError('Measurement function {} does not determine a unique impedance'.format(function))
+    if function == 'RX':
+        return a + 1j * b
+    if function == 'ZTD':
+        return a * np.exp(1j * np.deg2rad(b))
+    if function == 'ZTR':
+        return a * np.exp(1j * b)
+    if function == 'GB':
+        return 1 / (a + 1j * b)
+    if function == 'YTD':
+        return 1 / (a * np.exp(1j * np.deg2rad(b)))
+    if function == 'YTR':
+        return 1 / (a * np.exp(1j * b))
+    if function == 'VDID':
+        return a / b + 0j
+
+    kind, second = function[:2], function[2:]
+    if kind == 'CP':
+        susceptance = omega * a
+        return 1 / (PARALLEL_CONDUCTANCE[second](b, susceptance, 1) + 1j * susceptance)
+    if kind == 'LP':
+        susceptance = -1 / (omega * a)
+        return 1 / (PARALLEL_CONDUCTANCE[second](b, susceptance, -1) + 1j * susceptance)
+    if kind == 'CS':
+        reactance = -1 / (omega * a)
+        return SERIES_RESISTANCE[second](b, reactance, -1) + 1j * reactance
+    if kind == 'LS':
+        reactance = omega * a
+        return SERIES_RESISTANCE[second](b, reactance, 1) + 1j * reactance
+
+    raise ValueError('Unknown measurement function {}'.format(function))
+
+
+@np.errstate(divide='ignore', invalid='ignore')
+def impedance_to_function(function, z, freqs, bias=0.0):
+    # Express complex impedance z as the two values the E4980A returns for a measurement function
+    z = np.asarray(z, dtype=complex)
+    omega = 2 * np.pi * np.asarray(freqs, dtype=float)
+    y = 1 / z
+    r, x = z.real, z.imag
+    g, b = y.real, y.imag
+
+    # Only the requested pair is computed
+    values = {'CPD': lambda: (b / omega, g / b),
+              'CPQ': lambda: (b / omega, b / g),
+              'CPG': lambda: (b / omega, g),
+              'CPRP': lambda: (b / omega, 1 / g),
+              'CSD': lambda: (-1 / (omega * x), -r / x),
+              'CSQ': lambda: (-1 / (omega * x), -x / r),
+              'CSRS': lambda: (-1 / (omega * x), r),
+              'LPD': lambda: (-1 / (omega * b), -g / b),
+              'LPQ': lambda: (-1 / (omega * b), -b / g),
+              'LPG': lambda: (-1 / (omega * b), g),
+              'LPRP': lambda: (-1 / (omega * b), 1 / g),
+              # No AC impedance gives Rdc, the Rdc functions use the real part of Z instead (see AMBIGUOUS_FUNCTIONS)
+              'LPRD': lambda: (-1 / (omega * b), r),
+              'LSD': lambda: (x / omega, r / x),
+              'LSQ': lambda: (x / omega, x / r),
+              'LSRS': lambda: (x / omega, r),
+              'LSRD': lambda: (x / omega, r),
+              'RX': lambda: (r, x),
+              'ZTD': lambda: (np.abs(z), np.angle(z, deg=True)),
+              'ZTR': lambda: (np.abs(z), np.angle(z)),
+              'GB': lambda: (g, b),
+              'YTD': lambda: (np.abs(y), np.angle(y, deg=True)),
+              'YTR': lambda: (np.abs(y), np.angle(y)),
+              'VDID': lambda: (np.full_like(r, bias), bias / r)}
+
+    return values[function]()
+
+
+def geometric_capacitance(area, thickness):
+    # Empty cell capacitance [F] of a parallel plate sample, area in m^2 and thickness in m
+    return VACUUM_PERMITTIVITY * area / thickness
+
+
+@np.errstate(divide='ignore', invalid='ignore')
+def impedance_representations(z, freqs, area=None, thickness=None):
+    # The usual representations of complex impedance z as named arrays. Permittivity, modulus and conductivity need
+    #  the sample geometry and are only included when area and thickness are given.
+    z = np.asarray(z, dtype=complex)
+    omega = 2 * np.pi * np.asarray(freqs, dtype=float)
+    y = 1 / z
+
+    values = OrderedDict()
+    values["Z' [Ohm]"] = z.real
+    values["Z'' [Ohm]"] = z.imag
+    values['|Z| [Ohm]'] = np.abs(z)
+    values['Phase [deg]'] = np.angle(z, deg=True)
+    values["Y' [S]"] = y.real
+    values["Y'' [S]"] = y.imag
+    values['Cp [F]'] = y.imag / omega
+    values['tan delta'] = y.real / y.imag
+
+    if area is not None and thickness is not None:
+        # eps* = Y / (jw C0) = eps' - j eps'',  M* = 1 / eps* = jw C0 Z
+        c0 = geometric_capacitance(area, thickness)
+        values["Permittivity eps'"] = y.imag / (omega * c0)
+        values["Permittivity eps''"] = y.real / (omega * c0)
+        values["Modulus M'"] = -omega * c0 * z.imag
+        values["Modulus M''"] = omega * c0 * z.real
+        values['Conductivity [S/m]'] = y.real * thickness / area
+
+    return values
+
+
+def measurement_function(attrs, columns=()):
+    # E4980A function of a stored measurement: the Measurement Type of its header (e.g. 'Cp-D'), or failing that the
+    #  one whose parameter names match the columns (besides the per point settings of adaptive apertures). None if
+    #  neither tells.
+    if attrs.get('meas_type') in FUNC_DICT:
+        return FUNC_DICT[attrs['meas_type']]
+
+    columns = [column for column in columns if column not in ('Frequency [Hz]', 'Data Status', 'Aperture', 'Averaging')]
+    for function, parameters in PARAMETERS_BY_FUNC.items():
+        if [parameter for parameter in parameters if parameter not in ('Frequency [Hz]', 'Data Status')] == columns:
+            return function
+
+    return None
+
+
+def convertible(function):
+    return function is not None and function not in AMBIGUOUS_FUNCTIONS
+
+
+def convert_dataframe(data_df, function, area=None, thickness=None):
+    # Copy of a measurement table (frequency followed by the two function values, as in the data files) with every
+    #  representation appended as columns
+    freqs = data_df.iloc[:, 0].to_numpy(dtype=float)
+    z = function_to_impedance(function, data_df.iloc[:, 1].to_numpy(dtype=float),
+                              data_df.iloc[:, 2].to_numpy(dtype=float), freqs)
+
+    converted_df = data_df.copy()
+    for name, values in impedance_representations(z, freqs, area, thickness).items():
+        converted_df[name] = values
+
+    return converted_df
+
+
+if __name__ == "__main__":
+    from Dat_File_Reader import DatFileReader
+
+    parser = argparse.ArgumentParser(description='Write every impedance representation of the measurements in .dat '
+                                                 'files to CSV files')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--area', type=float, help='Electrode area [m^2]')
+    parser.add_argument('--thickness', type=float, help='Sample thickness [m]')
+    args = parser.parse_args()
+
+    for dat_path in args.files:
+        with DatFileReader(dat_path) as reader:
+            for key in reader.keys():
+                data_df = reader.load(key)
+                function = measurement_function(reader.attrs(key), data_df.columns)
+                if not convertible(function) or data_df.empty:
+                    print('{} {}: unknown or unconvertible measurement function, or no data'.format(dat_path, key),
+                          file=sys.stderr)
+                    continue
+                converted_df = convert_dataframe(data_df, function, args.area, args.thickness)
+                csv_path = '{}_{}.csv'.format(dat_path.rsplit('.', 1)[0], key)
+                converted_df.to_csv(csv_path)
+                print('{} {} -> {}'.format(dat_path, key, csv_path))
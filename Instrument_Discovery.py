@@ -0,0 +1,126 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pyvisa.errors import VisaIOError
+
+
+# Resource -> IDN string cache shared between app starts. Resources that did not answer *IDN? are stored as None
+#  (the Sun chamber never answers it).
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.probe_station', 'idn_cache.json')
+
+
+class InstrumentDiscovery(object):
+    # Finds instruments on the bus by their *IDN? response. Resources are probed in parallel with short timeouts and
+    #  the results kept in an on-disk cache, so a normal start only has to confirm the cached entries.
+    def __init__(self, rm, cache_path=DEFAULT_CACHE_PATH, open_timeout=500, query_timeout=500, max_workers=8):
+        self.rm = rm
+        self.cache_path = cache_path
+        self.open_timeout = open_timeout
+        self.query_timeout = query_timeout
+        self.max_workers = max_workers
+        self.idns = {}
+        self.scanned = False
+        self.from_cache = False
+
+        self.load_cache()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path, 'r') as file:
+                self.idns = json.load(file)
+        except (OSError, ValueError):
+            self.idns = {}
+
+    def save_cache(self):
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(self.cache_path, 'w') as file:
+                json.dump(self.idns, file, indent=2)
+        except OSError as error:
+            print('Could not write instrument cache to {}: {}'.format(self.cache_path, error))
+
+    def probe(self, resource):
+        # Returns the IDN string of resource, None if it is present but did not answer, or False if it could not
+        #  be opened at all
+        try:
+            instr = self.rm.open_resource(resource, open_timeout=self.open_timeout)
+        except VisaIOError:
+            return False
+
+        try:
+            instr.timeout = self.query_timeout
+            return instr.query('*IDN?').strip()
+        except VisaIOError:
+            return None
+        finally:
+            try:
+                instr.close()
+            except (VisaIOError, AttributeError):
+                print('Error closing instrument that should be open')
+
+    def probe_all(self, resources):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = list(pool.map(self.probe, resources))
+
+        return dict(zip(resources, results))
+
+    def verify_cache(self):
+        # One quick query per cached instrument. Returns True if every cached IDN still answers the same way.
+        if not self.idns:
+            return False
+
+        results = self.probe_all(list(self.idns.keys()))
+        return all(results[resource] == idn for resource, idn in self.idns.items())
+
+    def scan(self, force=False):
+        # Full parallel scan of every resource the resource manager can see
+        if self.scanned and not force:
+            return self.idns
+
+        results = self.probe_all(list(self.rm.list_resources()))
+        self.idns = {resource: idn for resource, idn in results.items() if idn is not False}
+        self.scanned = True
+        self.from_cache = False
+        self.save_cache()
+
+        return self.idns
+
+    def instruments(self):
+        # Cached results if they still check out, a fresh scan otherwise
+        if not self.scanned:
+            if self.verify_cache():
+                self.from_cache = True
+                self.scanned = True
+            else:
+                self.scan()
+
+        return self.idns
+
+    def find(self, id_prefix):
+        # Address of the first instrument whose IDN starts with id_prefix. Passing None finds the first instrument
+        #  that did not answer *IDN?.
+        for attempt in range(0, 2):
+            for resource, idn in self.instruments().items():
+                if id_prefix is None and idn is None:
+                    return resource
+                elif id_prefix is not None and idn is not None and idn.startswith(id_prefix):
+                    return resource
+            # The instrument may have been added or moved since the cache was made
+            if attempt == 0 and self.from_cache:
+                self.scan(force=True)
+            else:
+                break
+
+        return None
+
+
+# Discovery services by resource manager
+discovery_services = {}
+
+
+def get_discovery(rm):
+    # Every caller using the same resource manager shares one discovery service, and so a single scan of its bus
+    if rm not in discovery_services:
+        discovery_services[rm] = InstrumentDiscovery(rm)
+
+    return discovery_services[rm]
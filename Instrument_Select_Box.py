@@ -1,5 +1,5 @@
 import visa
-from pyvisa.errors import VisaIOError
+from Instrument_Discovery import get_discovery
 from PyQt5.QtWidgets import QDialog, QComboBox, QPushButton, QFormLayout, QLabel
 
 
@@ -9,17 +9,17 @@ class InstrumentSelectBox (QDialog):
         super().__init__()
 
         self.rm = rm
-        # Get a list of resources, open comms, and poll them for their ID string
-        self.instruments = rm.list_resources()
+        # Get the resources and their ID strings from the shared instrument discovery
+        idns = get_discovery(self.rm).instruments()
+        self.instruments = list(idns.keys())
         self.instr_ids = []
 
         for instr in self.instruments:
-            current_instr = self.rm.open_resource(instr)
-            try:
-                self.instr_ids.append(current_instr.query("*IDN?"))
-            except VisaIOError:
+            if idns[instr] is None:
                 print('Error getting instrument ID string from {}'.format(instr))
-            current_instr.close()
+                self.instr_ids.append('No response to *IDN?')
+            else:
+                self.instr_ids.append(idns[instr])
 
         self.instr_combo_box = QComboBox()
         self.instr_combo_box.addItems(self.instruments)
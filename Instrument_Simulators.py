@@ -0,0 +1,349 @@
+import sys
+import socketserver
+import threading
+from time import sleep, monotonic
+import numpy as np
+from pyvisa import constants
+from pyvisa.errors import VisaIOError
+from Agilent_E4980A_Constants import ID_STR, APERTURE_BASE_TIME, APERTURE_CYCLES
+from Impedance_Conversion import impedance_to_function
+
+# SCPI level simulators for the E4980A LCR meter and the Sun EC1x chamber. They parse the same command strings the
+#  drivers send, so they can be used either in process through SimulatedResourceManager (pass it to the drivers as
+#  rm=...) or over TCP with a pyvisa-py backend by running this file and connecting to the printed SOCKET addresses.
+
+
+# Relative noise on a single reading, by aperture (reduced by sqrt(averaging))
+APERTURE_NOISE = {'SHOR': 1e-3, 'MED': 3e-4, 'LONG': 1e-4}
+
+
+class DebyeSample(object):
+    # Series resistance in front of a leaky capacitor with a single Debye relaxation:
+    #  Z = Rs + 1 / (1/Rp + jwC(w)),  C(w) = c_inf + delta_c / (1 + jw tau)
+    def __init__(self, rs=10.0, rp=1e7, c_inf=100e-12, delta_c=400e-12, tau=1e-4):
+        self.rs = rs
+        self.rp = rp
+        self.c_inf = c_inf
+        self.delta_c = delta_c
+        self.tau = tau
+
+    def impedance(self, freqs):
+        omega = 2 * np.pi * np.asarray(freqs, dtype=float)
+        cap = self.c_inf + self.delta_c / (1 + 1j * omega * self.tau)
+        return self.rs + 1 / (1 / self.rp + 1j * omega * cap)
+
+
+class SimulatedE4980A(object):
+    def __init__(self, sample=None, command_latency=0.002, time_scale=1.0, noise=True, seed=None):
+        # command_latency [s] is charged once per message, time_scale scales every simulated delay (0 = no sleeping)
+        self.sample = sample if sample is not None else DebyeSample()
+        self.command_latency = command_latency
+        self.time_scale = time_scale
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.errors = []
+        self.reset()
+
+    def reset(self):
+        self.function = 'CPD'
+        self.frequency = 1000.0
+        self.level = ('VOLT', 1.0)
+        self.bias_state = 'OFF'
+        self.bias = ('VOLT', 0.0)
+        self.aperture = ('MED', 1)
+        self.trigger_source = 'INT'
+        self.continuous = True
+        self.trigger_delay = 0.0
+        self.step_delay = 0.0
+        self.data_format = 'ASC'
+        self.byte_order = 'NORM'
+        self.display_page = 'MEAS'
+        self.list_mode = 'SEQ'
+        self.list_freqs = []
+        self.last_result = None
+
+    def wait(self, seconds):
+        if self.time_scale > 0 and seconds > 0:
+            sleep(seconds * self.time_scale)
+
+    def measurement_time(self, freqs):
+        aperture, avg = self.aperture
+        freqs = np.asarray(freqs, dtype=float)
+        return float(np.sum(avg * (APERTURE_BASE_TIME[aperture] + APERTURE_CYCLES[aperture] / freqs)))
+
+    def measure(self, freqs):
+        # Returns one row of (A, B, status) per frequency, after the time the real instrument would take
+        freqs = np.atleast_1d(np.asarray(freqs, dtype=float))
+        self.wait(self.trigger_delay + self.step_delay * len(freqs) + self.measurement_time(freqs))
+
+        z = self.sample.impedance(freqs)
+        if self.noise:
+            aperture, avg = self.aperture
+            scale = APERTURE_NOISE[aperture] / np.sqrt(avg)
+            z = z * (1 + scale * (self.rng.standard_normal(len(freqs)) + 1j * self.rng.standard_normal(len(freqs))))
+        val_a, val_b = impedance_to_function(self.function, z, freqs, self.bias[1])
+
+        return np.column_stack([val_a, val_b, np.zeros(len(freqs))])
+
+    def trigger(self):
+        if self.display_page == 'LIST' and self.list_freqs:
+            result = self.measure(self.list_freqs)
+            # List sweep results also carry the comparator result for each point
+            self.last_result = np.column_stack([result, np.zeros(len(result))])
+        else:
+            self.last_result = self.measure(self.frequency)
+
+    def format_result(self):
+        values = self.last_result.ravel()
+        if self.data_format == 'REAL':
+            data = values.astype('>f8' if self.byte_order == 'NORM' else '<f8').tobytes()
+            length = str(len(data))
+            return '#{}{}'.format(len(length), length).encode('ascii') + data
+        else:
+            return ','.join('{:+.5E}'.format(value) for value in values)
+
+    def handle(self, message):
+        # Execute one message (one or more ';' separated commands) and return the response bytes, or None if no
+        #  command in it was a query
+        with self.lock:
+            self.wait(self.command_latency)
+            responses = []
+            for command in message.strip().split(';'):
+                command = command.strip()
+                if command:
+                    response = self.execute(command)
+                    if response is not None:
+                        responses.append(response if isinstance(response, bytes) else response.encode('ascii'))
+
+        if not responses:
+            return None
+        return b';'.join(responses) + b'\n'
+
+    def execute(self, command):
+        header, _, arg = command.partition(' ')
+        header = header.upper().lstrip(':')
+        arg = arg.strip()
+
+        if header == '*IDN?':
+            return ID_STR + 'SIM00001,A.02.20'
+        elif header == '*RST':
+            self.reset()
+        elif header == '*CLS':
+            self.errors = []
+        elif header == '*OPC?':
+            return '1'
+        elif header == '*TRG':
+            self.trigger()
+            return self.format_result()
+        elif header == 'TRIG:IMM':
+            self.trigger()
+        elif header == 'INIT':
+            if self.trigger_source == 'INT':
+                self.trigger()
+        elif header == 'FETC?':
+            # A free running instrument always has a fresh reading, otherwise return the last triggered one
+            if self.trigger_source == 'INT' or self.last_result is None:
+                self.trigger()
+            return self.format_result()
+        elif header == 'FUNC:IMP':
+            self.function = arg.upper()
+        elif header == 'FUNC:IMP?':
+            return self.function
+        elif header in ('FUNC:IMP:RANG', 'FUNC:IMP:RANG:AUTO'):
+            pass
+        elif header == 'FREQ':
+            self.frequency = float(arg)
+        elif header == 'FREQ?':
+            return '{:+.5E}'.format(self.frequency)
+        elif header in ('VOLT', 'CURR'):
+            self.level = (header, float(arg))
+        elif header in ('BIAS:VOLT', 'BIAS:CURR'):
+            self.bias = (header.split(':')[1], float(arg))
+        elif header == 'BIAS:STAT':
+            self.bias_state = arg.upper()
+        elif header == 'APER':
+            aperture, _, avg = arg.partition(',')
+            self.aperture = (aperture.strip().upper(), int(avg) if avg.strip() else 1)
+        elif header == 'TRIG:SOUR':
+            self.trigger_source = arg.upper()
+        elif header == 'TRIG:TDEL':
+            self.trigger_delay = float(arg)
+        elif header == 'TRIG:DEL':
+            self.step_delay = float(arg)
+        elif header == 'INIT:CONT':
+            self.continuous = arg.upper() in ('ON', '1')
+        elif header == 'FORM:DATA':
+            self.data_format = arg.upper()
+        elif header == 'FORM:BORD':
+            self.byte_order = arg.upper()
+        elif header == 'DISP:PAGE':
+            self.display_page = arg.upper()
+        elif header == 'LIST:MODE':
+            self.list_mode = arg.upper()
+        elif header == 'LIST:FREQ':
+            self.list_freqs = [float(freq) for freq in arg.split(',')]
+        elif header == 'SYST:ERR?':
+            return self.errors.pop(0) if self.errors else '+0,"No error"'
+        else:
+            self.errors.append('-113,"Undefined header; {}"'.format(command))
+
+        return None
+
+
+class SimulatedSunEC1x(object):
+    # First order thermal model: the controller ramps its internal setpoint towards the target at the ramp rate,
+    #  the chamber air follows that setpoint with time constant chamber_tau and the user probe (sample) follows the
+    #  chamber with user_tau. speedup makes simulated time run faster than the wall clock.
+    def __init__(self, start_temp=25.0, ramp_rate=5.0, chamber_tau=30.0, user_tau=90.0, user_offset=-0.5,
+                 noise=0.02, command_latency=0.005, time_scale=1.0, speedup=1.0, seed=None):
+        self.target = start_temp
+        self.ramped_setpoint = start_temp
+        self.chamber_temp = start_temp
+        self.user_temp = start_temp + user_offset
+        self.ramp_rate = ramp_rate
+        self.chamber_tau = chamber_tau
+        self.user_tau = user_tau
+        self.user_offset = user_offset
+        self.noise = noise
+        self.command_latency = command_latency
+        self.time_scale = time_scale
+        self.speedup = speedup
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.last_update = monotonic()
+
+    def update(self):
+        now = monotonic()
+        remaining = (now - self.last_update) * self.speedup
+        self.last_update = now
+
+        # Integrate in steps of at most a second so the ramp and lags stay accurate at high speedups
+        while remaining > 0:
+            dt = min(1.0, remaining)
+            remaining -= dt
+
+            max_step = self.ramp_rate / 60 * dt
+            delta = self.target - self.ramped_setpoint
+            self.ramped_setpoint += max(-max_step, min(max_step, delta))
+            self.chamber_temp += (self.ramped_setpoint - self.chamber_temp) * (1 - np.exp(-dt / self.chamber_tau))
+            self.user_temp += ((self.chamber_temp + self.user_offset - self.user_temp)
+                               * (1 - np.exp(-dt / self.user_tau)))
+
+    def reading(self, temp):
+        return '{:.2f}'.format(temp + self.noise * self.rng.standard_normal())
+
+    def handle(self, message):
+        with self.lock:
+            if self.time_scale > 0:
+                sleep(self.command_latency * self.time_scale)
+            self.update()
+
+            command = message.strip()
+            if command.lower() == 'temp?':
+                return (self.reading(self.chamber_temp) + '\n').encode('ascii')
+            elif command.lower() == 'uchan?':
+                return (self.reading(self.user_temp) + '\n').encode('ascii')
+            elif command.lower().startswith('set='):
+                self.target = float(command[4:])
+            elif command.lower().startswith('rate='):
+                self.ramp_rate = float(command[5:])
+            # Anything else (including *IDN?) gets no reply, like the real controller
+
+        return None
+
+
+class SimulatedResource(object):
+    # Minimal stand-in for a pyvisa message based resource backed by one of the simulators
+    def __init__(self, resource_name, engine):
+        self.resource_name = resource_name
+        self.engine = engine
+        self.timeout = 2000
+        self.read_termination = None
+        self.write_termination = None
+        self.pending = b''
+
+    def write(self, message):
+        response = self.engine.handle(message)
+        if response is not None:
+            self.pending += response
+
+    def read_raw(self, size=None):
+        if not self.pending:
+            # Nothing to read: behave like a VISA timeout
+            if self.engine.time_scale > 0:
+                sleep(self.timeout / 1000 * self.engine.time_scale)
+            raise VisaIOError(constants.StatusCode.error_timeout)
+        data, self.pending = self.pending, b''
+        return data
+
+    def read(self):
+        return self.read_raw().decode('ascii').rstrip('\r\n')
+
+    def query(self, message):
+        self.write(message)
+        return self.read()
+
+    def close(self):
+        self.pending = b''
+
+
+class SimulatedResourceManager(object):
+    # Drop-in for visa.ResourceManager, serving the given {resource name: simulator} instruments
+    def __init__(self, instruments=None):
+        if instruments is None:
+            instruments = {'GPIB0::18::INSTR': SimulatedE4980A(),
+                           'GPIB0::6::INSTR': SimulatedSunEC1x()}
+        self.instruments = instruments
+
+    def list_resources(self, query='?*::INSTR'):
+        return tuple(self.instruments.keys())
+
+    def open_resource(self, resource_name, **kwargs):
+        if resource_name not in self.instruments:
+            raise VisaIOError(constants.StatusCode.error_resource_not_found)
+        return SimulatedResource(resource_name, self.instruments[resource_name])
+
+
+class SCPISocketHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            response = self.server.engine.handle(line.decode('ascii', 'replace'))
+            if response is not None:
+                self.wfile.write(response)
+                self.wfile.flush()
+
+
+class SimulatorServer(socketserver.ThreadingTCPServer):
+    # Serves a simulator as a raw socket instrument, open it with pyvisa-py as TCPIP0::<host>::<port>::SOCKET
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, engine, host='127.0.0.1', port=5025):
+        super().__init__((host, port), SCPISocketHandler)
+        self.engine = engine
+
+    def resource_name(self):
+        host, port = self.server_address
+        return 'TCPIP0::{}::{}::SOCKET'.format(host, port)
+
+
+if __name__ == "__main__":
+    # Usage: python Instrument_Simulators.py [lcr_port] [sun_port] [thermal_speedup]
+    lcr_port = int(sys.argv[1]) if len(sys.argv) > 1 else 5025
+    sun_port = int(sys.argv[2]) if len(sys.argv) > 2 else 5026
+    speedup = float(sys.argv[3]) if len(sys.argv) > 3 else 1.0
+
+    servers = [SimulatorServer(SimulatedE4980A(), port=lcr_port),
+               SimulatorServer(SimulatedSunEC1x(speedup=speedup), port=sun_port)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print('Simulated E4980A LCR:\t{}'.format(servers[0].resource_name()))
+    print('Simulated Sun EC1x:\t{}'.format(servers[1].resource_name()))
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        for server in servers:
+            server.shutdown()
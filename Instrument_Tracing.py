@@ -0,0 +1,100 @@
+import csv
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Tracer(object):
+    # Opt-in recorder of timed spans (instrument I/O, measurement phases, GUI updates). Spans are only kept while
+    #  enabled, and can be written as Chrome trace JSON (open in chrome://tracing or ui.perfetto.dev) or as CSV.
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.thread_names = {}
+        self.lock = threading.Lock()
+        self.origin = perf_counter()
+
+    def enable(self):
+        self.clear()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.events = []
+            self.thread_names = {}
+            self.origin = perf_counter()
+
+    def record(self, name, category, start, duration, **args):
+        # start is a perf_counter() value, duration is in seconds
+        if not self.enabled:
+            return
+
+        thread = threading.current_thread()
+        with self.lock:
+            self.thread_names[thread.ident] = thread.name
+            self.events.append({'name': name,
+                                'cat': category,
+                                'start': start - self.origin,
+                                'duration': duration,
+                                'tid': thread.ident,
+                                'thread': thread.name,
+                                'args': args})
+
+    @contextmanager
+    def span(self, name, category='measurement', **args):
+        # The yielded dict can be filled in with more arguments before the span closes
+        if not self.enabled:
+            yield args
+            return
+
+        start = perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, category, start, perf_counter() - start, **args)
+
+    def write_chrome_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}}
+                 for tid, name in thread_names.items()]
+        trace += [{'name': event['name'],
+                   'cat': event['cat'],
+                   'ph': 'X',
+                   'ts': event['start'] * 1e6,
+                   'dur': event['duration'] * 1e6,
+                   'pid': os.getpid(),
+                   'tid': event['tid'],
+                   'args': event['args']} for event in events]
+
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+
+    def write_csv(self, path):
+        with self.lock:
+            events = list(self.events)
+
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['start_s', 'duration_s', 'category', 'name', 'thread', 'args'])
+            for event in events:
+                writer.writerow([event['start'], event['duration'], event['cat'], event['name'], event['thread'],
+                                 json.dumps(event['args'])])
+
+
+# Shared by the drivers, the I/O policy and the measurement workers
+tracer = Tracer()
+
+
+def result_size(result):
+    try:
+        return len(result)
+    except TypeError:
+        return 0
@@ -1,6 +1,8 @@
 from PyQt5.QtWidgets import QFrame, QVBoxLayout
-from PyQt5.QtCore import QObject, QSize
+from PyQt5.QtCore import QObject, QSize, QTimer
 from copy import copy
+from math import ceil
+from time import monotonic
 import numpy as np
 from matplotlib import colors
 from matplotlib.figure import Figure
@@ -66,6 +68,9 @@ class LivePlotCanvas(FigCanvas):
         self.line_color = line_color
         self.head_color = head_color
         self.line_width = 2
+        # Redrawing takes longer than measuring a point, so new points are drawn at most every draw_interval ms
+        self.draw_interval = int(draw_interval)
+        self.last_draw = 0.0
 
         # Create figure and first set of axes
         self.figure = Figure(figsize=(5, 5))
@@ -92,6 +97,11 @@ class LivePlotCanvas(FigCanvas):
         FigCanvas.__init__(self, self.figure)
         self.draw()
 
+        # Draws the points that came in too soon after the last frame once the interval is over
+        self.draw_timer = QTimer(self)
+        self.draw_timer.setSingleShot(True)
+        self.draw_timer.timeout.connect(self._draw_frame)
+
     def init_axes(self):
         # Set axes to match the colors of their main lines if we have dual y otherwise primary will stay black
         self.axes.tick_params(axis='y', labelcolor=self.line_color[0])
@@ -106,7 +116,15 @@ class LivePlotCanvas(FigCanvas):
         if self.dual_y:
             self.y2.append(point[2])
 
-        self._draw_frame()
+        self.request_frame()
+
+    def request_frame(self):
+        # Draw now if the interval since the last frame is over, otherwise once it is
+        wait = self.draw_interval - 1000 * (monotonic() - self.last_draw)
+        if wait <= 0:
+            self._draw_frame()
+        elif not self.draw_timer.isActive():
+            self.draw_timer.start(int(ceil(wait)))
 
     def set_dual_y(self, enable: bool, axes_labels: list):
         self.dual_y = enable
@@ -135,6 +153,8 @@ class LivePlotCanvas(FigCanvas):
         self.line_color = line_color
 
     def start_new_line(self):
+        # A pending frame would draw the new line before it has points, the next point draws the old one
+        self.draw_timer.stop()
         self.old_lines.append({'x': copy(self.x), 'y': copy(self.y1)})
 
         self.old_line_alphas = list(np.linspace(30, 100, len(self.old_lines), False))
@@ -149,6 +169,7 @@ class LivePlotCanvas(FigCanvas):
         self.y2.clear()
 
     def clear_data(self):
+        self.draw_timer.stop()
         self.old_lines.clear()
         self.x.clear()
         self.y1.clear()
@@ -168,6 +189,8 @@ class LivePlotCanvas(FigCanvas):
             self.axes2.set_ylabel(axes_labels[2], fontsize=14, weight='bold')
 
     def _draw_frame(self):
+        self.draw_timer.stop()
+        self.last_draw = monotonic()
         # Clear both sets of axes
         self.axes.clear()
         self.axes2.clear()
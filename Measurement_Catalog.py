@@ -0,0 +1,235 @@
+import os
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+from Dat_File_Reader import DatFileReader
+
+# One catalog for every data file written on this machine, next to the instrument cache
+DEFAULT_CATALOG_PATH = os.path.join(os.path.expanduser('~'), '.probe_station', 'catalog.sqlite')
+
+# Header attributes stored as columns, with their SQL types
+CATALOG_FIELDS = [('meas_num', 'TEXT'),
+                  ('meas_type', 'TEXT'),
+                  ('meas_date', 'TEXT'),
+                  ('meas_time', 'TEXT'),
+                  ('start_freq', 'REAL'),
+                  ('stop_freq', 'REAL'),
+                  ('range', 'TEXT'),
+                  ('num_pts', 'INTEGER'),
+                  ('data_averaging', 'INTEGER'),
+                  ('step_delay', 'REAL'),
+                  ('osc', 'REAL'),
+                  ('osc_type', 'TEXT'),
+                  ('bias', 'REAL'),
+                  ('bias_type', 'TEXT'),
+                  ('pre_meas_delay', 'REAL'),
+                  ('ramp', 'REAL'),
+                  ('dwell', 'REAL'),
+                  ('stab_int', 'REAL'),
+                  ('user_avg', 'REAL'),
+                  ('user_stdev', 'REAL'),
+                  ('chamber_avg', 'REAL'),
+                  ('chamber_stdev', 'REAL'),
+                  ('z_stdev', 'REAL'),
+                  ('thermal_stats_reused', 'INTEGER'),
+                  ('notes', 'TEXT')]
+
+SCHEMA = ['CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime REAL, '
+          'indexed_at TEXT)',
+          'CREATE TABLE IF NOT EXISTS measurements (id INTEGER PRIMARY KEY, '
+          'file_id INTEGER REFERENCES files(id) ON DELETE CASCADE, block INTEGER, {}, header_offset INTEGER, '
+          'table_offset INTEGER, table_end INTEGER, complete INTEGER, UNIQUE(file_id, block))'
+          .format(', '.join('{} {}'.format(name, sql_type) for name, sql_type in CATALOG_FIELDS)),
+          'CREATE INDEX IF NOT EXISTS measurements_chamber_avg ON measurements(chamber_avg)',
+          'CREATE INDEX IF NOT EXISTS measurements_bias ON measurements(bias)',
+          'CREATE INDEX IF NOT EXISTS measurements_notes ON measurements(notes)']
+
+
+class MeasurementCatalog(object):
+    # SQLite index of the measurement blocks in .dat files: the header fields of every block with its file and byte
+    #  offsets, so matching measurements can be found without opening unrelated files. Each call opens its own
+    #  connection, so the catalog can be updated from the data writer thread.
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute('PRAGMA foreign_keys = ON')
+        return connection
+
+    def index_file(self, path, force=False):
+        # Index one .dat file, unless it has not changed since it was last indexed. Blocks that were complete when the
+        #  file was last indexed and still end where they did are kept, only the ones after them are (re)inserted, so
+        #  a file that grows by a block per save costs one block per save. Returns the number of blocks.
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        connection = self.connect()
+        try:
+            with connection:
+                known = connection.execute('SELECT id, size, mtime FROM files WHERE path = ?', (path,)).fetchone()
+                if known is not None and not force and known['size'] == stat.st_size \
+                        and known['mtime'] == stat.st_mtime:
+                    return connection.execute('SELECT COUNT(*) FROM measurements WHERE file_id = ?',
+                                              (known['id'],)).fetchone()[0]
+
+                with DatFileReader(path) as reader:
+                    blocks = reader.blocks
+
+                if known is None:
+                    file_id = connection.execute('INSERT INTO files (path, size, mtime, indexed_at) '
+                                                 'VALUES (?, ?, ?, ?)',
+                                                 (path, stat.st_size, stat.st_mtime,
+                                                  datetime.now().isoformat())).lastrowid
+                    kept = 0
+                else:
+                    file_id = known['id']
+                    connection.execute('UPDATE files SET size = ?, mtime = ?, indexed_at = ? WHERE id = ?',
+                                       (stat.st_size, stat.st_mtime, datetime.now().isoformat(), file_id))
+                    kept = 0 if force else self.unchanged_blocks(connection, file_id, blocks)
+                    connection.execute('DELETE FROM measurements WHERE file_id = ? AND block >= ?', (file_id, kept))
+
+                names = [name for name, sql_type in CATALOG_FIELDS]
+                insert = ('INSERT INTO measurements (file_id, block, {}, header_offset, table_offset, table_end, '
+                          'complete) VALUES ({})'.format(', '.join(names), ', '.join(['?'] * (len(names) + 6))))
+                for iblock in range(kept, len(blocks)):
+                    block = blocks[iblock]
+                    attrs = block['attrs']
+                    values = [attrs.get(name) for name in names]
+                    # Header values that could not be read as numbers are stored as they are
+                    connection.execute(insert, [file_id, iblock] + values + [block['header_start'],
+                                                                             block['table_start'],
+                                                                             block['table_end'],
+                                                                             int(block['complete'])])
+        finally:
+            connection.close()
+
+        return len(blocks)
+
+    @staticmethod
+    def unchanged_blocks(connection, file_id, blocks):
+        # Number of leading blocks of the file whose catalog rows are complete and still at the same offsets
+        rows = connection.execute('SELECT block, header_offset, table_end, complete FROM measurements '
+                                  'WHERE file_id = ? ORDER BY block', (file_id,)).fetchall()
+        kept = 0
+        for row, block in zip(rows, blocks):
+            if not (row['block'] == kept and row['complete'] and block['complete']
+                    and row['header_offset'] == block['header_start'] and row['table_end'] == block['table_end']):
+                break
+            kept += 1
+
+        return kept
+
+    def index_tree(self, root, force=False):
+        # Bulk index every .dat file under root (or root itself if it is a file)
+        paths = [root] if os.path.isfile(root) else [os.path.join(folder, name)
+                                                      for folder, subfolders, names in os.walk(root)
+                                                      for name in names if name.lower().endswith('.dat')]
+        count = 0
+        for path in sorted(paths):
+            try:
+                count += self.index_file(path, force)
+            except (OSError, ValueError, sqlite3.Error) as error:
+                print('Could not index {}: {}'.format(path, error))
+
+        return count
+
+    def remove_missing(self):
+        # Drop files that are no longer on disk
+        connection = self.connect()
+        try:
+            with connection:
+                for row in connection.execute('SELECT id, path FROM files').fetchall():
+                    if not os.path.exists(row['path']):
+                        connection.execute('DELETE FROM files WHERE id = ?', (row['id'],))
+        finally:
+            connection.close()
+
+    def query(self, where='1', params=()):
+        # Matching measurements as dicts, with the file path. where is an SQL condition on the measurements columns.
+        connection = self.connect()
+        try:
+            rows = connection.execute('SELECT files.path, measurements.* FROM measurements '
+                                      'JOIN files ON files.id = measurements.file_id WHERE {} '
+                                      'ORDER BY files.path, measurements.block'.format(where), params).fetchall()
+        finally:
+            connection.close()
+
+        return [dict(row) for row in rows]
+
+    def find(self, notes=None, meas_type=None, min_temp=None, max_temp=None, bias=None, osc=None, path=None,
+             tolerance=1e-9):
+        # Common searches: notes and path are substrings, temperatures are the chamber average
+        conditions = []
+        params = []
+        if notes is not None:
+            conditions.append('notes LIKE ?')
+            params.append('%{}%'.format(notes))
+        if path is not None:
+            conditions.append('files.path LIKE ?')
+            params.append('%{}%'.format(path))
+        if meas_type is not None:
+            conditions.append('meas_type = ?')
+            params.append(meas_type)
+        if min_temp is not None:
+            conditions.append('chamber_avg >= ?')
+            params.append(min_temp)
+        if max_temp is not None:
+            conditions.append('chamber_avg <= ?')
+            params.append(max_temp)
+        if bias is not None:
+            conditions.append('ABS(bias - ?) <= ?')
+            params += [bias, tolerance]
+        if osc is not None:
+            conditions.append('ABS(osc - ?) <= ?')
+            params += [osc, tolerance]
+
+        return self.query(' AND '.join(conditions) if conditions else '1', params)
+
+
+def load_measurement(result):
+    # DataFrame of a measurement returned by query() or find()
+    with DatFileReader(result['path']) as reader:
+        return reader.load(result['block'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Catalog of Cap-Freq measurement files')
+    parser.add_argument('--catalog', default=DEFAULT_CATALOG_PATH)
+    commands = parser.add_subparsers(dest='command')
+    index_parser = commands.add_parser('index', help='Add .dat files or folders to the catalog')
+    index_parser.add_argument('paths', nargs='+')
+    index_parser.add_argument('--force', action='store_true', help='Reindex files that have not changed')
+    find_parser = commands.add_parser('find', help='List matching measurements')
+    find_parser.add_argument('--notes')
+    find_parser.add_argument('--type', dest='meas_type')
+    find_parser.add_argument('--min-temp', type=float)
+    find_parser.add_argument('--max-temp', type=float)
+    find_parser.add_argument('--bias', type=float)
+    find_parser.add_argument('--osc', type=float)
+    find_parser.add_argument('--path')
+    find_parser.add_argument('--where', help='SQL condition, used instead of the other filters')
+    args = parser.parse_args()
+
+    catalog = MeasurementCatalog(args.catalog)
+    if args.command == 'index':
+        catalog.remove_missing()
+        for root in args.paths:
+            print('{}: {} measurements'.format(root, catalog.index_tree(root, args.force)))
+    elif args.command == 'find':
+        if args.where:
+            results = catalog.query(args.where)
+        else:
+            results = catalog.find(args.notes, args.meas_type, args.min_temp, args.max_temp, args.bias, args.osc,
+                                   args.path)
+        for result in results:
+            print('{path}\t{meas_num}\t{meas_type}\t{chamber_avg}\t{bias}\t{notes}\t@{table_offset}'.format(**result))
+        print('{} measurements'.format(len(results)))
+    else:
+        parser.print_help()
+        sys.exit(1)
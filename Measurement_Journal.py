@@ -0,0 +1,94 @@
+import os
+import json
+from collections import OrderedDict
+import pandas as pd
+
+
+def journal_path(data_path):
+    return data_path + '.journal'
+
+
+class MeasurementJournal(object):
+    # Write-ahead journal of a measurement set, one JSON record per line: the plan, the header and every point of
+    #  each measurement, the end of each measurement and each verified equilibration. Points are flushed as they are
+    #  written, everything else is also fsynced, so a crash can lose at most the last few points.
+    def __init__(self, path, append=False):
+        self.path = path
+        self.file = open(path, 'a' if append else 'w')
+
+    def record(self, kind, sync=False, **fields):
+        fields['type'] = kind
+        self.file.write(json.dumps(fields) + '\n')
+        self.file.flush()
+        if sync:
+            os.fsync(self.file.fileno())
+
+    def plan(self, plan):
+        self.record('plan', sync=True, plan=plan)
+
+    def row_started(self, row, header):
+        self.record('row_started', sync=True, row=row, header=header)
+
+    def point(self, row, values):
+        self.record('point', row=row, values=[float(value) for value in values])
+
+    def row_finished(self, row):
+        self.record('row_finished', sync=True, row=row)
+
+    def equilibrated(self, row, state):
+        self.record('equilibrated', sync=True, row=row, state=state)
+
+    def close(self, finished=False):
+        # A finished set needs no resume, so its journal is removed
+        if self.file.closed:
+            return
+
+        self.file.close()
+        if finished:
+            os.remove(self.path)
+
+
+class JournalState(object):
+    # What a journal says about an interrupted measurement set
+    def __init__(self, path):
+        self.path = path
+        self.plan = None
+        self.rows = OrderedDict()
+        self.equilibrated = None
+
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may have been cut off by the crash
+                    break
+                self.apply(record)
+
+    def apply(self, record):
+        kind = record['type']
+        if kind == 'plan':
+            self.plan = record['plan']
+        elif kind == 'row_started':
+            self.rows[record['row']] = {'header': record['header'], 'points': [], 'finished': False}
+        elif kind == 'point':
+            self.rows[record['row']]['points'].append(record['values'])
+        elif kind == 'row_finished':
+            self.rows[record['row']]['finished'] = True
+        elif kind == 'equilibrated':
+            self.equilibrated = record['state']
+
+    def resumable(self):
+        return self.plan is not None
+
+    def finished_rows(self):
+        return [row for row, state in self.rows.items() if state['finished']]
+
+    def points(self, row):
+        return self.rows[row]['points'] if row in self.rows else []
+
+    def header(self, row):
+        return self.rows[row]['header']
+
+    def dataframe(self, row):
+        return pd.DataFrame(self.points(row), columns=self.plan['columns'], dtype=float)
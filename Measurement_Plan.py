@@ -0,0 +1,329 @@
+import os
+import re
+import csv
+from collections import OrderedDict
+import Agilent_E4980A_Constants as Const
+import Static_Functions as Static
+from Adaptive_Sampling import coarse_points
+
+# YAML plan files are optional, CSV is always available
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+PLAN_FIELDS = ['start', 'stop', 'osc', 'bias', 'delay', 'temp']
+
+# Column labels of the measurement table (and plan CSV files) by field
+PLAN_LABELS = {'start': 'Frequency Start [Hz]',
+               'stop': 'Frequency Stop [Hz]',
+               'osc': 'Oscillator [V]',
+               'bias': 'DC Bias [V]',
+               'delay': 'Equilibration Delay [s]',
+               'temp': 'Temperature Set Point [°C]'}
+
+# Largest settings the E4980A accepts (with the high power option), by signal/bias type
+OSC_LIMITS = {'Voltage': (0.0, 20.0), 'Current': (0.0, 0.1)}
+BIAS_LIMITS = {'Voltage': (-40.0, 40.0), 'Current': (-0.1, 0.1)}
+# Set point range of the Sun EC1x chamber [°C]
+TEMP_LIMITS = (-184.0, 315.0)
+
+# Run orders of a plan by the name shown in the thermal settings, see optimize_order
+PLAN_ORDERS = {'As Entered': None,
+               'Monotonic': 'monotonic',
+               'Serpentine': 'serpentine'}
+
+
+class PlanError(ValueError):
+    # Everything wrong with a plan, one problem per line
+    def __init__(self, errors):
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+def plan_value_text(value):
+    # A plan value the way it would be typed in the table, whole numbers without the trailing .0
+    if value is None:
+        return ''
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class PlanRow(object):
+    # One measurement of a set. freq_steps, num_points (the most points the row measures, more than freq_steps for an
+    #  adaptive sweep), first_point (the number of points measured before this row) and changes (the settings that
+    #  differ from the previous row) are filled in by MeasurementPlan.
+    def __init__(self, key, start, stop, osc, bias, delay, temp=None):
+        self.key = key
+        self.start = start
+        self.stop = stop
+        self.osc = osc
+        self.bias = bias
+        self.delay = delay
+        self.temp = temp
+        self.freq_steps = []
+        self.num_points = 0
+        self.first_point = 0
+        self.changes = []
+
+    def text(self, field):
+        return plan_value_text(getattr(self, field))
+
+
+def plan_errors(rows, num_pts, signal_type='Voltage', bias_type='Voltage', has_temp=False, spacing='log'):
+    # Every out of range value of a plan, values that could not be read (None) are skipped
+    errors = []
+    if not rows:
+        errors.append('The plan has no measurements')
+    if spacing == 'decade' and num_pts < 1:
+        errors.append('A sweep needs at least 1 point per decade')
+    elif spacing != 'decade' and num_pts < 2:
+        errors.append('A sweep needs at least 2 points')
+
+    osc_min, osc_max = OSC_LIMITS.get(signal_type, OSC_LIMITS['Voltage'])
+    bias_min, bias_max = BIAS_LIMITS.get(bias_type, BIAS_LIMITS['Voltage'])
+    checks = [('start', Const.MIN_FREQUENCY, Const.MAX_FREQUENCY),
+              ('stop', Const.MIN_FREQUENCY, Const.MAX_FREQUENCY),
+              ('osc', osc_min, osc_max),
+              ('bias', bias_min, bias_max),
+              ('delay', 0.0, float('inf'))]
+    if has_temp:
+        checks.append(('temp', TEMP_LIMITS[0], TEMP_LIMITS[1]))
+
+    for row in rows:
+        for field, low, high in checks:
+            value = getattr(row, field)
+            if value is not None and not low <= value <= high:
+                errors.append('{} {}: {} is outside {} to {}'.format(row.key, PLAN_LABELS[field],
+                                                                   plan_value_text(value), plan_value_text(low),
+                                                                   plan_value_text(high)))
+        if row.start is not None and row.start == row.stop:
+            errors.append('{}: start and stop frequency are the same'.format(row.key))
+
+    return errors
+
+
+class MeasurementPlan(object):
+    # Typed and checked version of the measurement table. Every value is parsed and range checked and every frequency
+    #  grid is generated when the plan is built, so a bad entry is reported before the run starts instead of after
+    #  hours of thermal dwell.
+    #  spacing is a value of Static_Functions.FREQ_SPACINGS, for 'decade' num_pts is the number of points per decade.
+    #  For 'adaptive' num_pts is the point budget and freq_steps only the coarse pass.
+    def __init__(self, rows, num_pts, signal_type='Voltage', bias_type='Voltage', has_temp=False, spacing='log'):
+        self.rows = rows
+        self.num_pts = num_pts
+        self.signal_type = signal_type
+        self.bias_type = bias_type
+        self.has_temp = has_temp
+        self.spacing = spacing
+
+        errors = plan_errors(rows, num_pts, signal_type, bias_type, has_temp, spacing)
+        if errors:
+            raise PlanError(errors)
+        self.compile()
+
+    @classmethod
+    def from_records(cls, records, num_pts, signal_type='Voltage', bias_type='Voltage', has_temp=False,
+                     spacing='log'):
+        # records are dicts of field: value, values may be numbers or text
+        fields = PLAN_FIELDS if has_temp else PLAN_FIELDS[:5]
+        errors = []
+        rows = []
+        for irow, record in enumerate(records):
+            key = 'M{}'.format(irow + 1)
+            values = {}
+            for field in fields:
+                value = record.get(field)
+                try:
+                    values[field] = float(value)
+                except (TypeError, ValueError):
+                    errors.append('{} {}: {!r} is not a number'.format(key, PLAN_LABELS[field],
+                                                                       '' if value is None else value))
+                    values[field] = None
+            rows.append(PlanRow(key, **values))
+
+        # Range errors of the values that could be read are reported together with the unreadable ones
+        errors += plan_errors(rows, num_pts, signal_type, bias_type, has_temp, spacing)
+        if errors:
+            raise PlanError(errors)
+
+        return cls(rows, num_pts, signal_type, bias_type, has_temp, spacing)
+
+    @classmethod
+    def from_table(cls, table, num_pts, signal_type='Voltage', bias_type='Voltage', has_temp=False, spacing='log'):
+        # table is a list of rows of cell text in measurement table column order
+        return cls.from_records([dict(zip(PLAN_FIELDS, row)) for row in table], num_pts, signal_type, bias_type,
+                                has_temp, spacing)
+
+    @classmethod
+    def load(cls, path, num_pts, signal_type='Voltage', bias_type='Voltage', has_temp=False, spacing='log'):
+        return cls.from_records(read_plan_file(path), num_pts, signal_type, bias_type, has_temp, spacing)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def fields(self):
+        return PLAN_FIELDS if self.has_temp else PLAN_FIELDS[:5]
+
+    def keys(self):
+        return [row.key for row in self.rows]
+
+    def num_points(self):
+        return sum(row.num_points for row in self.rows)
+
+    def row(self, key):
+        for row in self.rows:
+            if row.key == key:
+                return row
+
+        raise KeyError(key)
+
+    def position(self, key):
+        # One based place of a measurement in the run order
+        return self.rows.index(self.row(key)) + 1
+
+    def reorder(self, order, pinned=(), start_temp=None):
+        # Run the rows in the order optimize_order gives, order is a value of PLAN_ORDERS
+        if order is None:
+            return
+
+        unknown = [key for key in pinned if key not in self.keys()]
+        if unknown:
+            raise PlanError(['{} is not a measurement of this plan'.format(key) for key in unknown])
+
+        self.rows = optimize_order(self.rows, order, pinned, start_temp)
+        self.compile()
+
+    def compile(self):
+        previous = None
+        first_point = 0
+        for row in self.rows:
+            if self.spacing == 'adaptive':
+                row.freq_steps = Static.generate_freq_steps(row.start, row.stop, coarse_points(self.num_pts), 'log')
+                row.num_points = max(self.num_pts, len(row.freq_steps))
+            else:
+                row.freq_steps = Static.generate_freq_steps(row.start, row.stop, self.num_pts, self.spacing)
+                row.num_points = len(row.freq_steps)
+            row.first_point = first_point
+            first_point += row.num_points
+            row.changes = [field for field in ('osc', 'bias', 'temp')
+                           if previous is None or getattr(row, field) != getattr(previous, field)]
+            previous = row
+
+    def table(self):
+        # Cell text for the measurement table
+        return [[row.text(field) for field in self.fields()] for row in self.rows]
+
+    def save(self, path):
+        write_plan_file(path, [{field: getattr(row, field) for field in self.fields()} for row in self.rows],
+                        self.fields())
+
+
+def parse_pinned_keys(text):
+    # Measurement numbers from text like 'M1, M5 m7'
+    return [key.upper() for key in re.split(r'[\s,;]+', text) if key]
+
+
+def row_thermal_times(rows, ramp, dwell, start_temp=None, always_stab=False):
+    # Estimated seconds each row spends ramping and stabilising when rows are run in this order, the way the
+    #  Cap-Freq-Temp worker waits: a ramp at ramp [°C/min] from the previous set point (or start_temp) and a dwell
+    #  [min] at every new set point, at every row with always_stab. The first row is always stabilised.
+    times = []
+    temp = start_temp
+    for irow, row in enumerate(rows):
+        seconds = 0.0
+        if temp is not None and row.temp != temp and ramp > 0:
+            seconds += abs(row.temp - temp) / ramp * 60
+        if irow == 0 or row.temp != temp or always_stab:
+            seconds += dwell * 60
+        times.append(seconds)
+        temp = row.temp
+
+    return times
+
+
+def thermal_time(rows, ramp, dwell, start_temp=None, always_stab=False):
+    return sum(row_thermal_times(rows, ramp, dwell, start_temp, always_stab))
+
+
+def order_segment(rows, order, before=None, after=None):
+    # Rows grouped by set point, the groups in ascending or descending temperature, whichever ramps less from the
+    #  temperature before the segment to the one after it. Rows keep their table order within a group, or with
+    #  'serpentine' every other group is reversed so neighbouring groups meet at the same bias/oscillator settings.
+    groups = OrderedDict()
+    for row in rows:
+        groups.setdefault(row.temp, []).append(row)
+
+    def ramp_distance(temps):
+        path = [temp for temp in [before] + temps + [after] if temp is not None]
+        return sum(abs(second - first) for first, second in zip(path, path[1:]))
+
+    ascending = sorted(groups)
+    temps = min([ascending, ascending[::-1]], key=ramp_distance)
+
+    ordered = []
+    for igroup, temp in enumerate(temps):
+        group = groups[temp]
+        ordered += group[::-1] if order == 'serpentine' and igroup % 2 else group
+
+    return ordered
+
+
+def optimize_order(rows, order, pinned=(), start_temp=None):
+    # Reorder rows to need fewer and shorter temperature changes. Pinned rows (by key) keep their place and no row is
+    #  moved past them, the rows between two pinned rows are ordered on their own with order_segment.
+    ordered = []
+    segment = []
+    for row in rows:
+        if row.key not in pinned:
+            segment.append(row)
+            continue
+
+        before = ordered[-1].temp if ordered else start_temp
+        ordered += order_segment(segment, order, before, row.temp) + [row]
+        segment = []
+
+    before = ordered[-1].temp if ordered else start_temp
+    return ordered + order_segment(segment, order, before)
+
+
+def is_yaml_path(path):
+    return os.path.splitext(path)[1].lower() in ('.yaml', '.yml')
+
+
+def read_plan_file(path):
+    # Records of a plan file. CSV files have one measurement per line under a header of field names or table labels,
+    #  YAML files a list of mappings of field names.
+    if is_yaml_path(path):
+        if yaml is None:
+            raise PlanError(['YAML support is not installed'])
+        with open(path, 'r') as file:
+            records = yaml.safe_load(file)
+        if isinstance(records, dict):
+            records = records.get('measurements')
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise PlanError(['{} is not a list of measurements'.format(path)])
+        return records
+
+    field_by_label = {label: field for field, label in PLAN_LABELS.items()}
+    with open(path, 'r', newline='', encoding='utf-8') as file:
+        return [{field_by_label.get(name, name): value for name, value in record.items()}
+                for record in csv.DictReader(file)]
+
+
+def write_plan_file(path, records, fields):
+    if is_yaml_path(path):
+        if yaml is None:
+            raise PlanError(['YAML support is not installed'])
+        with open(path, 'w') as file:
+            yaml.safe_dump({'measurements': records}, file, sort_keys=False)
+        return
+
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow([PLAN_LABELS[field] for field in fields])
+        for record in records:
+            writer.writerow([plan_value_text(record[field]) for field in fields])
@@ -0,0 +1,315 @@
+import os
+import json
+import argparse
+import threading
+from math import ceil
+from time import perf_counter
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from collections import OrderedDict
+import numpy as np
+from Agilent_E4980A_Constants import APERTURE_BASE_TIME, APERTURE_CYCLES, MEASURE_TIME_DICT
+from Static_Functions import FREQ_SPACINGS
+from Measurement_Plan import MeasurementPlan, PlanError, row_thermal_times, read_plan_file
+
+# Calibration from earlier runs on this machine, next to the instrument cache and the catalog
+DEFAULT_HISTORY_PATH = os.path.join(os.path.expanduser('~'), '.probe_station', 'timing_history.json')
+
+# Parts of a measurement that are timed and predicted separately, in run order. thermal is the chamber ramp and
+#  stability check, settle the equilibration delay, sweep the LCR measuring and overhead the rest (instrument setup,
+#  headers, saving).
+STAGES = ['thermal', 'settle', 'sweep', 'overhead']
+# Weight of the newest run when a calibration factor is updated
+CALIBRATION_WEIGHT = 0.5
+# Finished runs kept in the history file
+HISTORY_RUNS = 50
+# Seconds of overhead per measurement before there is any history
+DEFAULT_OVERHEAD = 0.5
+
+
+def sweep_time(freqs, aperture, averaging, pre_meas_delay=0.0):
+    # Uncalibrated seconds for the LCR to measure a sweep: the settling delay at each point and, per reading, a fixed
+    #  part plus a number of signal periods. aperture is a value of MEASURE_TIME_DICT.
+    freqs = np.asarray(freqs, dtype=float)
+    return float(np.sum(pre_meas_delay + averaging * (APERTURE_BASE_TIME[aperture] + APERTURE_CYCLES[aperture]
+                                                      / freqs)))
+
+
+def settle_time(delay):
+    # The equilibration delay is counted down in whole seconds
+    return float(ceil(delay))
+
+
+def format_duration(seconds):
+    return str(timedelta(seconds=int(round(seconds))))
+
+
+class RunTimePredictor(object):
+    # Estimates how long a measurement set takes and keeps the estimate up to date while it runs. The plan is
+    #  predicted per measurement and stage from the instrument settings and then scaled by calibration factors
+    #  learned from the stage timings of earlier runs (kept in path, None to neither load nor save them). During a
+    #  run the stages still to come are scaled again by how the finished ones compared to their prediction.
+    #  The worker thread reports stages while the GUI thread asks for the ETA, so everything is behind one lock.
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = path
+        self.factors = {}
+        self.overhead = DEFAULT_OVERHEAD
+        self.runs = []
+        self.lock = threading.Lock()
+
+        # Per measurement key: the calibrated prediction, the uncalibrated model and the calibration key of each stage
+        self.predicted = OrderedDict()
+        self.models = {}
+        self.calibration_keys = {}
+        # Per measurement key: seconds each finished stage took in this run
+        self.actual = OrderedDict()
+        self.skipped = set()
+        self.completed = set()
+        self.current = None
+        self.row_started = {}
+        self.started = None
+        self.elapsed = None
+
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+
+        try:
+            with open(self.path, 'r') as file:
+                history = json.load(file)
+            self.factors = dict(history.get('factors', {}))
+            self.overhead = float(history.get('overhead', DEFAULT_OVERHEAD))
+            self.runs = list(history.get('runs', []))
+        except (OSError, ValueError, TypeError, AttributeError):
+            self.factors = {}
+            self.overhead = DEFAULT_OVERHEAD
+            self.runs = []
+
+    def save(self):
+        if self.path is None:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'w') as file:
+                json.dump({'factors': self.factors, 'overhead': self.overhead, 'runs': self.runs[-HISTORY_RUNS:]},
+                          file, indent=2)
+        except OSError as error:
+            print('Could not write timing history to {}: {}'.format(self.path, error))
+
+    def factor(self, calibration_key):
+        return self.factors.get(calibration_key, 1.0)
+
+    def predict(self, plan, aperture='MED', averaging=1, pre_meas_delay=0.0, list_sweep=True, ramp=None, dwell=None,
+                start_temp=None, always_stab=False, adaptive_aperture=False):
+        # Predicted seconds for running plan (a MeasurementPlan) in its order. ramp [°C/min] and dwell [min] are only
+        #  used for plans with temperatures. Sweeps with adaptive_aperture are modelled at aperture and calibrated on
+        #  their own. Returns the total, the per stage values are kept for the run.
+        if plan.has_temp and ramp is not None and dwell is not None:
+            thermal = row_thermal_times(plan.rows, ramp, dwell, start_temp, always_stab)
+        else:
+            thermal = [0.0] * len(plan.rows)
+        sweep_key = 'sweep {} {}'.format('adaptive' if adaptive_aperture else aperture,
+                                         'list' if list_sweep else 'point')
+
+        with self.lock:
+            self.predicted = OrderedDict()
+            self.models = {}
+            self.calibration_keys = {}
+            for row, thermal_seconds in zip(plan.rows, thermal):
+                models = {'thermal': thermal_seconds,
+                          'settle': settle_time(row.delay),
+                          # An adaptive sweep is taken as spending its whole budget like its coarse pass
+                          'sweep': (sweep_time(row.freq_steps, aperture, averaging, pre_meas_delay)
+                                    * row.num_points / len(row.freq_steps)),
+                          'overhead': 1.0}
+                keys = {'thermal': 'thermal', 'settle': 'settle', 'sweep': sweep_key, 'overhead': None}
+                self.models[row.key] = models
+                self.calibration_keys[row.key] = keys
+                self.predicted[row.key] = OrderedDict(
+                    (stage, models[stage] * (self.overhead if keys[stage] is None else self.factor(keys[stage])))
+                    for stage in STAGES)
+
+            return self.total()
+
+    def total(self):
+        # Predicted seconds for the measurements of the run, without the ones skipped on a resume
+        return sum(sum(stages.values()) for key, stages in self.predicted.items() if key not in self.skipped)
+
+    def begin(self):
+        with self.lock:
+            self.actual = OrderedDict((key, {}) for key in self.predicted)
+            self.skipped = set()
+            self.completed = set()
+            self.current = None
+            self.row_started = {}
+            self.started = perf_counter()
+            self.elapsed = None
+
+    def skip(self, key):
+        # Finished before a resume, not measured in this run
+        with self.lock:
+            self.skipped.add(key)
+
+    def start_row(self, key):
+        with self.lock:
+            self.row_started[key] = perf_counter()
+
+    def end_row(self, key, complete=True):
+        # Whatever part of the row was not in a stage is its overhead. A row that was stopped part way is left out of
+        #  the calibration.
+        with self.lock:
+            if key not in self.row_started or key not in self.actual:
+                return
+            row_time = perf_counter() - self.row_started[key]
+            stages = self.actual[key]
+            stages['overhead'] = max(row_time - sum(stages.values()), 0.0)
+            if complete:
+                self.completed.add(key)
+
+    @contextmanager
+    def stage(self, key, stage):
+        start = perf_counter()
+        with self.lock:
+            self.current = (key, stage, start)
+        try:
+            yield
+        finally:
+            with self.lock:
+                if key in self.actual:
+                    self.actual[key][stage] = perf_counter() - start
+                self.current = None
+
+    def live_ratios(self):
+        # How much longer than predicted each stage has taken so far in this run. Starts at 1 and is pulled towards
+        #  the measured ratio as more of the stage is done (one average stage worth of prediction counts as ratio 1).
+        ratios = {}
+        for stage in STAGES:
+            done = [(self.predicted[key][stage], seconds[stage]) for key, seconds in self.actual.items()
+                    if stage in seconds and key in self.predicted]
+            predicted = [value for value in (self.predicted[key][stage] for key in self.predicted) if value > 0]
+            if not done or not predicted:
+                ratios[stage] = 1.0
+                continue
+            prior = sum(predicted) / len(predicted)
+            ratios[stage] = (sum(actual for expected, actual in done) + prior) / (sum(expected for expected, actual
+                                                                                      in done) + prior)
+
+        return ratios
+
+    def eta(self):
+        # Seconds left in the run, None before it starts
+        with self.lock:
+            if self.started is None:
+                return None
+            if self.elapsed is not None:
+                return 0.0
+
+            now = perf_counter()
+            ratios = self.live_ratios()
+            remaining = 0.0
+            for key, stages in self.predicted.items():
+                if key in self.skipped:
+                    continue
+                for stage, seconds in stages.items():
+                    if stage in self.actual[key]:
+                        continue
+                    expected = seconds * ratios[stage]
+                    if self.current is not None and self.current[:2] == (key, stage):
+                        expected = max(expected - (now - self.current[2]), 0.0)
+                    remaining += expected
+
+            return remaining
+
+    def elapsed_time(self):
+        with self.lock:
+            if self.started is None:
+                return 0.0
+            return self.elapsed if self.elapsed is not None else perf_counter() - self.started
+
+    def predicted_elapsed(self, key, stage='settle'):
+        # Predicted seconds from the start of the run to the start of stage of measurement key
+        with self.lock:
+            elapsed = 0.0
+            for row_key, stages in self.predicted.items():
+                if row_key in self.skipped:
+                    continue
+                for row_stage, seconds in stages.items():
+                    if row_key == key and row_stage == stage:
+                        return elapsed
+                    elapsed += seconds
+
+            return elapsed
+
+    def finish(self, data_path=None):
+        # End of the run: update the calibration from the completed measurements and add the run to the history
+        with self.lock:
+            if self.started is None:
+                return
+            self.elapsed = perf_counter() - self.started
+            if not self.completed:
+                return
+
+            totals = {}
+            for key in self.completed:
+                for stage, seconds in self.actual[key].items():
+                    calibration_key = self.calibration_keys[key][stage]
+                    actual, model = totals.get(calibration_key, (0.0, 0.0))
+                    totals[calibration_key] = (actual + seconds, model + self.models[key][stage])
+
+            for calibration_key, (actual, model) in totals.items():
+                if calibration_key is None:
+                    self.overhead += CALIBRATION_WEIGHT * (actual / model - self.overhead)
+                elif model > 0 and actual > 0:
+                    factor = self.factor(calibration_key)
+                    self.factors[calibration_key] = factor + CALIBRATION_WEIGHT * (actual / model - factor)
+
+            run_keys = [key for key in self.predicted if key not in self.skipped]
+            self.runs.append({'date': datetime.now().isoformat(timespec='seconds'),
+                              'path': data_path,
+                              'measurements': len(run_keys),
+                              'completed': len(self.completed),
+                              'predicted_s': round(sum(sum(self.predicted[key].values()) for key in run_keys), 1),
+                              'actual_s': round(self.elapsed, 1)})
+
+        self.save()
+
+    def summary(self):
+        # Text for the end of a run
+        if self.elapsed is None:
+            return ''
+        return 'Took {} (predicted {})'.format(format_duration(self.elapsed), format_duration(self.total()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Predict how long a measurement plan (CSV or YAML) takes')
+    parser.add_argument('plan')
+    parser.add_argument('--num-pts', type=int, default=50)
+    parser.add_argument('--spacing', choices=list(FREQ_SPACINGS.values()), default='log')
+    parser.add_argument('--aperture', choices=list(MEASURE_TIME_DICT.keys()), default='Long')
+    parser.add_argument('--averaging', type=int, default=1)
+    parser.add_argument('--pre-meas-delay', type=float, default=0.0)
+    parser.add_argument('--point-sweep', action='store_true', help='Measure point by point instead of list sweeps')
+    parser.add_argument('--ramp', type=float, default=5.0, help='Chamber ramp rate [°C/min]')
+    parser.add_argument('--dwell', type=float, default=10.0, help='Dwell before each measurement [min]')
+    parser.add_argument('--start-temp', type=float, help='Chamber temperature at the start [°C]')
+    parser.add_argument('--always-stab', action='store_true')
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH)
+    args = parser.parse_args()
+
+    try:
+        records = read_plan_file(args.plan)
+        has_temp = any(record.get('temp') not in (None, '') for record in records)
+        plan = MeasurementPlan.from_records(records, args.num_pts, has_temp=has_temp, spacing=args.spacing)
+    except (OSError, PlanError) as error:
+        parser.exit(1, '{}\n'.format(error))
+
+    predictor = RunTimePredictor(args.history)
+    total = predictor.predict(plan, MEASURE_TIME_DICT[args.aperture], args.averaging, args.pre_meas_delay,
+                              not args.point_sweep, args.ramp, args.dwell, args.start_temp, args.always_stab)
+    print('\t'.join(['Measurement'] + STAGES))
+    for key, stages in predictor.predicted.items():
+        print('\t'.join([key] + [format_duration(seconds) for seconds in stages.values()]))
+    print('Total: {}'.format(format_duration(total)))
@@ -1,16 +1,96 @@
 import numpy as np
+from functools import lru_cache
 from math import trunc, floor, log10
+from Agilent_E4980A_Constants import FREQUENCY_RESOLUTION
+
+# Frequency point spacings of generate_freq_steps, by the name shown in the measurement setup
+#  ('adaptive' is a logarithmic coarse pass that the worker refines while measuring, see Adaptive_Sampling, it is
+#  marked experimental until it saves points over a logarithmic sweep)
+FREQ_SPACINGS = {'Logarithmic': 'log',
+                 'Linear': 'linear',
+                 'Points per Decade': 'decade',
+                 'Adaptive (experimental)': 'adaptive'}
+
+
+def snap_frequency(freqs):
+    # Round frequencies to the resolution of the E4980A, so they are the frequencies it will actually measure at
+    freqs = np.asarray(freqs, dtype=float)
+    limits = np.array([limit for limit, resolution in FREQUENCY_RESOLUTION])
+    resolutions = np.array([resolution for limit, resolution in FREQUENCY_RESOLUTION])
+    resolution = resolutions[np.searchsorted(limits, freqs, side='right').clip(max=len(limits) - 1)]
+    # The second round drops the binary noise of the multiplication, no resolution is finer than 0.01 Hz
+    return np.round(np.round(freqs / resolution) * resolution, 2)
+
+
+@lru_cache(maxsize=256)
+def frequency_grid(start, stop, num_steps, spacing='log', snap=True):
+    # Cached frequency points from start to stop as a tuple. num_steps is the number of points for 'log' and
+    #  'linear' spacing and the number of points per decade for 'decade' spacing.
+    if spacing == 'log':
+        freqs = np.logspace(np.log10(start), np.log10(stop), num_steps)
+    elif spacing == 'linear':
+        freqs = np.linspace(start, stop, num_steps)
+    elif spacing == 'decade':
+        decades = np.log10(stop) - np.log10(start)
+        exponents = np.log10(start) + np.sign(decades) * np.arange(0, abs(decades), 1 / num_steps)
+        freqs = np.append(10 ** exponents, stop)
+        # Leave out a point that would land almost on top of stop
+        if len(freqs) > 2 and abs(np.log10(freqs[-1] / freqs[-2])) < 0.01 / num_steps:
+            freqs = np.delete(freqs, -2)
+    else:
+        raise ValueError('Unknown frequency spacing {}'.format(spacing))
+
+    # Exact end points, rather than what came back through the logarithms
+    freqs[0] = start
+    freqs[-1] = stop
+    if snap:
+        freqs = snap_frequency(freqs)
+
+    return tuple(freqs.tolist())
+
+
+def generate_freq_steps(start, stop, num_steps, spacing='log', snap=True):
+    return list(frequency_grid(float(start), float(stop), int(num_steps), spacing, snap))
 
 
 def generate_log_steps(start, stop, num_steps):
-    step = 10 ** ((np.log10(stop)-np.log10(start)) / (num_steps-1))
-    freq_steps = [start * (step ** i) for i in range(0, num_steps-1)]
-    freq_steps.append(stop)
+    return generate_freq_steps(start, stop, num_steps, 'log')
+
+
+def ieee_block_size(raw: bytes):
+    # Total number of bytes (up to the end of the data) that a definite length IEEE 488.2 block says it has, or 0
+    #  if that can not be told yet (no header, indefinite length or header incomplete)
+    start = raw.find(b'#')
+    if start < 0 or start + 2 > len(raw) or raw[start + 1:start + 2] == b'0':
+        return 0
+
+    num_digits = int(raw[start + 1:start + 2])
+    if start + 2 + num_digits > len(raw):
+        return 0
 
-    # Truncate frequencies to 2 decimal places. Probably dont even have that resolution with the lcr...
-    freq_steps = [truncate_to(x, 2) for x in freq_steps]
+    return start + 2 + num_digits + int(raw[start + 2:start + 2 + num_digits])
+
+
+def parse_ieee_block(raw: bytes, dtype='>f8'):
+    # Decode a definite (#<n><length><data>) or indefinite (#0<data>) length IEEE 488.2 block into a numpy array.
+    #  Raises ValueError if there is no block header or the block is shorter than its header says.
+    start = raw.find(b'#')
+    if start < 0 or start + 2 > len(raw):
+        raise ValueError('No IEEE block header found in response')
+
+    num_digits = int(raw[start + 1:start + 2])
+    itemsize = np.dtype(dtype).itemsize
+    if num_digits == 0:
+        # Indefinite blocks run to the end of the message, drop the trailing terminator
+        data = raw[start + 2:]
+        data = data[:len(data) - len(data) % itemsize]
+    else:
+        length = int(raw[start + 2:start + 2 + num_digits])
+        data = raw[start + 2 + num_digits:start + 2 + num_digits + length]
+        if len(data) < length:
+            raise ValueError('IEEE block truncated ({} of {} bytes received)'.format(len(data), length))
 
-    return freq_steps
+    return np.frombuffer(data, dtype=dtype)
 
 
 def truncate_to(number, decimals=0):
@@ -1,16 +1,20 @@
 import visa
-from pyvisa.errors import VisaIOError
 from PyQt5.QtCore import QObject, pyqtSignal
 from time import sleep
+from Visa_IO_Policy import VisaIOPolicy, InstrumentIOError
+from Instrument_Discovery import get_discovery
 
 
 class SunEC1xChamber(QObject):
     # Place signals here or they won't work
 
-    def __init__(self, parent=None, gpib_addr=None):
+    def __init__(self, parent=None, gpib_addr=None, rm=None):
         super().__init__()
 
-        self.rm = visa.ResourceManager()
+        # rm can be any object with the ResourceManager interface, e.g. Instrument_Simulators.SimulatedResourceManager
+        self.rm = rm if rm is not None else visa.ResourceManager()
+        # The chamber is polled constantly, so give up quickly and let the next poll try again
+        self.io_policy = VisaIOPolicy('Sun chamber', max_retries=2)
         if gpib_addr is not None:
             self.sun_addr = gpib_addr
         else:
@@ -19,46 +23,47 @@ class SunEC1xChamber(QObject):
         self.sun = self.connect_sun()
 
     def connect_sun(self):
-        if self.sun_addr != '':
-            instruments = self.rm.list_resources()
+        if self.sun_addr == '':
+            # The chamber does not answer *IDN?, so take the first instrument on the bus that did not reply
+            self.sun_addr = get_discovery(self.rm).find(None)
+            if self.sun_addr is None:
+                print('No instrument without an ID response found, could not connect to the sun chamber')
+                return None
+            print('Instrument at {} did not accept ID query, assuming'
+                  ' this is the sun environmental chamber'.format(self.sun_addr))
 
-            for instr in instruments:
-                curr_instr = self.rm.open_resource(instr, open_timeout=0.5)
-                # if the first 29 characters of the returned string match the LCR ID return
-                try:
-                    curr_instr.query("*IDN?")
-                    try:
-                        curr_instr.close()
-                    except AttributeError:
-                        print('Error closing instrument that should be open')
-                except VisaIOError:
-                    print('Instrument at {} did not accept ID query, assuming'
-                          ' this is the sun environmental chamber'.format(
-                            instr))
-                    return curr_instr
+        sun = self.rm.open_resource(self.sun_addr)
+        # Raw socket instruments (e.g. the simulator server) need explicit message terminations
+        if self.sun_addr.upper().endswith('::SOCKET'):
+            sun.read_termination = '\n'
+            sun.write_termination = '\n'
+        return sun
+
+    def io_stats(self):
+        return self.io_policy.stats()
 
     def get_temp(self):
         try:
-            return float(self.sun.query('temp?'))
-        except VisaIOError as error:
-            print('Error on getting chamber temp: {}'.format(error.abbreviation))
+            return float(self.io_policy.query(self.sun, 'temp?'))
+        except (InstrumentIOError, ValueError) as error:
+            print('Error on getting chamber temp: {}'.format(error))
             return -9999.0
 
     def get_user_temp(self):
         try:
-            return float(self.sun.query('uchan?'))
-        except VisaIOError as error:
-            print('Error on getting user temp: {}'.format(error.abbreviation))
+            return float(self.io_policy.query(self.sun, 'uchan?'))
+        except (InstrumentIOError, ValueError) as error:
+            print('Error on getting user temp: {}'.format(error))
             return -9999.0
 
     def set_setpoint(self, stpt: float):
         try:
-            self.sun.write('set={}'.format(stpt))
-        except VisaIOError as error:
+            self.io_policy.write(self.sun, 'set={}'.format(stpt))
+        except InstrumentIOError as error:
             print('Error on writing setpoint: {}'.format(error.abbreviation))
 
     def set_ramprate(self, ramprate: float):
         try:
-            self.sun.write('RATE={}'.format(ramprate))
-        except VisaIOError as error:
+            self.io_policy.write(self.sun, 'RATE={}'.format(ramprate))
+        except InstrumentIOError as error:
             print('Error on writing ramprate: {}'.format(error.abbreviation))
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime
+from time import perf_counter, sleep
+
+# The benchmark runs the real widgets and workers without a display
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtWidgets import QApplication
+import Cap_Freq
+import Cap_Freq_Temp
+from Agilent_E4980A import AgilentE4980A
+from Sun_EC1X import SunEC1xChamber
+from Instrument_Simulators import SimulatedResourceManager, SimulatedE4980A, SimulatedSunEC1x
+from Run_Time_Predictor import RunTimePredictor
+
+# End-to-end throughput benchmark for CapFreqMeasureWorkerObject and CapFreqTempMeasureWorkerObject, run headless
+#  against the simulated LCR and chamber. Every run is appended as one JSON line to the output file, with the wall
+#  time split into stages so regressions can be traced to setup writes, waits, bus traffic, parsing, data handling,
+#  plotting or saving.
+#
+#  python Sweep_Benchmark.py --points 10 100 1000 --rows 1 10 100 --time-scale 1
+#
+#  --time-scale 0 (default) removes the simulated instrument time, so the numbers show the software overhead only;
+#  --time-scale 1 includes realistic E4980A measurement times.
+
+LCR_ADDR = 'GPIB0::18::INSTR'
+SUN_ADDR = 'GPIB0::6::INSTR'
+# Results are kept with the rest of the local probe station data rather than in the repository
+DEFAULT_OUTPUT_PATH = os.path.join(os.path.expanduser('~'), '.probe_station', 'sweep_benchmark_results.jsonl')
+
+
+class StageTimer(object):
+    # Accumulates the exclusive time of wrapped calls by stage: time spent in a nested wrapped call is only counted
+    #  for the inner stage
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.stack = []
+
+    def wrap(self, stage, func):
+        # stage is a stage name, or a function of the call arguments returning one
+        def timed(*args, **kwargs):
+            name = stage(*args, **kwargs) if callable(stage) else stage
+            start = perf_counter()
+            self.stack.append(0.0)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                nested = self.stack.pop()
+                self.totals[name] += elapsed - nested
+                self.counts[name] += 1
+                if self.stack:
+                    self.stack[-1] += elapsed
+
+        return timed
+
+
+def lcr_bus_stage(command=None, *args, **kwargs):
+    # Classify an LCR bus transaction, read_raw calls (no command) are always fetches
+    if command is None or 'FETC?' in command.upper():
+        return 'fetch'
+    elif '*TRG' in command.upper() or 'TRIG:IMM' in command.upper() or command.strip().upper() == ':INIT':
+        return 'trigger'
+    else:
+        return 'setup_writes'
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def instrument_widget(widget, timer, sleep_scale):
+    # Swap the instrument resources, worker sleeps and the widget/worker methods of interest for timed versions
+    requested_sleep = [0.0]
+
+    def scaled_sleep(seconds):
+        requested_sleep[0] += seconds
+        sleep(seconds * sleep_scale)
+
+    Cap_Freq.sleep = timer.wrap('settle_sleep', scaled_sleep)
+    Cap_Freq_Temp.sleep = timer.wrap('thermal_wait', scaled_sleep)
+
+    resource = widget.lcr.lcr
+    resource.write = timer.wrap(lcr_bus_stage, resource.write)
+    resource.query = timer.wrap(lcr_bus_stage, resource.query)
+    resource.read_raw = timer.wrap(lcr_bus_stage, resource.read_raw)
+    widget.lcr.query_values = timer.wrap('parse', widget.lcr.query_values)
+
+    if hasattr(widget, 'sun'):
+        widget.sun.sun.write = timer.wrap('chamber_io', widget.sun.sun.write)
+        widget.sun.sun.query = timer.wrap('chamber_io', widget.sun.sun.query)
+
+    worker = widget.measuring_worker
+    worker.read_new_data = timer.wrap('dataframe_append', worker.read_new_data)
+    widget.save_data = timer.wrap('save_data', widget.save_data)
+
+    # The live plot and readouts are slots of the LCR new_data signal, reconnect timed versions
+    widget.lcr.new_data.disconnect(widget.plot_new_points)
+    widget.lcr.new_data.disconnect(widget.update_live_readout)
+    widget.lcr.new_data.connect(timer.wrap('live_plot', widget.plot_new_points))
+    widget.lcr.new_data.connect(timer.wrap('live_readout', widget.update_live_readout))
+
+    return requested_sleep
+
+
+def configure_plan(widget, num_pts, num_rows, temps=None):
+    widget.ln_num_pts.setText(str(num_pts))
+    widget.change_num_pts()
+    widget.ln_num_meas.setText(str(num_rows))
+    widget.change_num_measurements()
+
+    for irow in range(0, num_rows):
+        widget.table_meas_setup.item(irow, 0).setText('20')
+        widget.table_meas_setup.item(irow, 1).setText('2000000')
+        widget.table_meas_setup.item(irow, 2).setText('0.05')
+        widget.table_meas_setup.item(irow, 3).setText('0')
+        widget.table_meas_setup.item(irow, 4).setText('0')
+        if temps is not None:
+            widget.table_meas_setup.item(irow, 5).setText(str(temps[irow % len(temps)]))
+
+
+def run_benchmark(worker_type, num_pts, num_rows, args):
+    lcr_sim = SimulatedE4980A(command_latency=args.command_latency, time_scale=args.time_scale)
+    sun_sim = SimulatedSunEC1x(command_latency=args.command_latency, time_scale=args.time_scale,
+                               speedup=args.thermal_speedup)
+    rm = SimulatedResourceManager({LCR_ADDR: lcr_sim, SUN_ADDR: sun_sim})
+    lcr = AgilentE4980A(gpib_addr=LCR_ADDR, rm=rm)
+
+    if worker_type == 'capfreqtemp':
+        sun = SunEC1xChamber(gpib_addr=SUN_ADDR, rm=rm)
+        widget = Cap_Freq_Temp.CapFreqTempWidget(lcr=lcr, sun=sun)
+        # Short dwell and loose tolerances, the benchmark is about where the time goes rather than stability
+        widget.ln_dwell.setText(str(args.dwell))
+        widget.change_dwell()
+        widget.ln_stab_int.setText('1')
+        widget.change_stab_int()
+        widget.ln_temp_tol.setText('100')
+        widget.ln_stdev_tol.setText('100')
+        configure_plan(widget, num_pts, num_rows, temps=[25, 30])
+    else:
+        widget = Cap_Freq.CapFreqWidget(lcr=lcr)
+        configure_plan(widget, num_pts, num_rows)
+
+    widget.live_readout_timer.stop()
+    widget.save_file_path = os.path.join(args.data_dir, '{}_{}pts_{}rows.dat'.format(worker_type, num_pts, num_rows))
+    widget.enable_live_vals = False
+    widget.enable_live_plots = args.live_plot
+    # Scaled simulator timings would spoil the calibration of the real instruments
+    widget.run_predictor = RunTimePredictor(path=None)
+    # The benchmark data files are temporary, they do not belong in the measurement catalog
+    widget.catalog_path = None
+
+    timer = StageTimer()
+    requested_sleep = instrument_widget(widget, timer, args.sleep_scale)
+
+    widget.generate_test_matrix()
+    start = perf_counter()
+    widget.measuring_worker.measure()
+    total = perf_counter() - start
+
+    stages = dict(timer.totals)
+    stages['other'] = total - sum(stages.values())
+    num_points = num_pts * num_rows
+
+    result = {'timestamp': datetime.now().isoformat(),
+              'version': git_version(),
+              'worker': worker_type,
+              'num_pts': num_pts,
+              'num_rows': num_rows,
+              'time_scale': args.time_scale,
+              'sleep_scale': args.sleep_scale,
+              'live_plot': args.live_plot,
+              'total_s': total,
+              'predicted_s': widget.run_predictor.total(),
+              'points_per_s': num_points / total if total > 0 else 0.0,
+              's_per_sweep': total / num_rows,
+              'requested_sleep_s': requested_sleep[0],
+              'stages_s': stages,
+              'stage_calls': dict(timer.counts),
+              'lcr_io': lcr.io_stats(),
+              'lcr_cache': lcr.cache_stats(),
+              'writer_io': widget.io_writer.stats()}
+
+    widget.deleteLater()
+    return result
+
+
+def print_result(result):
+    print('{worker} {num_pts} pts x {num_rows} rows: {total_s:.2f} s, {points_per_s:.1f} pts/s, '
+          '{s_per_sweep:.3f} s/sweep'.format(**result))
+    for stage, seconds in sorted(result['stages_s'].items(), key=lambda item: -item[1]):
+        print('\t{:<18}{:>10.4f} s{:>8.1f} %'.format(stage, seconds, 100 * seconds / result['total_s']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Headless Cap-Freq sweep throughput benchmark')
+    parser.add_argument('--worker', choices=['capfreq', 'capfreqtemp', 'both'], default='capfreq')
+    parser.add_argument('--points', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--time-scale', type=float, default=0.0,
+                        help='Scale on simulated instrument delays (1 = real E4980A timing)')
+    parser.add_argument('--command-latency', type=float, default=0.002, help='Simulated bus latency per message [s]')
+    parser.add_argument('--sleep-scale', type=float, default=0.0, help='Scale on the sleeps made by the workers')
+    parser.add_argument('--thermal-speedup', type=float, default=1000.0)
+    parser.add_argument('--dwell', type=float, default=0.05, help='Dwell for the temperature worker [min]')
+    parser.add_argument('--live-plot', action='store_true',
+                        help='Draw the live plot during the sweeps, which takes longer than the measurements')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT_PATH)
+    args = parser.parse_args()
+
+    # Relative to where the benchmark was started, not the repository root it runs from
+    args.output = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    # The widgets load their ui files relative to the repository root
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    args.data_dir = tempfile.mkdtemp(prefix='sweep_benchmark_')
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    workers = ['capfreq', 'capfreqtemp'] if args.worker == 'both' else [args.worker]
+    with open(args.output, 'a') as file:
+        for worker_type in workers:
+            for num_rows in args.rows:
+                for num_pts in args.points:
+                    result = run_benchmark(worker_type, num_pts, num_rows, args)
+                    print_result(result)
+                    file.write(json.dumps(result) + '\n')
+                    file.flush()
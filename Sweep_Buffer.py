@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+
+class SweepBuffer(object):
+    # Row buffer backed by a preallocated NumPy structured array. Appending a row is a single array write, the
+    #  array doubles in size when it fills, and the rows are only turned into a DataFrame when one is asked for.
+    def __init__(self, columns, capacity=64, dtypes=None):
+        # dtypes maps column names to NumPy dtypes for columns that are not float64 (e.g. 'M8[us]' for timestamps)
+        dtypes = {} if dtypes is None else dtypes
+        self.columns = list(columns)
+        self.dtype = np.dtype([(column, dtypes.get(column, 'f8')) for column in self.columns])
+        self.data = np.empty(max(1, int(capacity)), dtype=self.dtype)
+        self.length = 0
+        self.frame = None
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        self.length = 0
+        self.frame = None
+
+    def reserve(self, capacity):
+        if capacity > len(self.data):
+            data = np.empty(capacity, dtype=self.dtype)
+            data[:self.length] = self.data[:self.length]
+            self.data = data
+
+    def append(self, row):
+        # row is a sequence in column order or a dict keyed by column name
+        if self.length == len(self.data):
+            self.reserve(2 * len(self.data))
+
+        if isinstance(row, dict):
+            row = tuple(row[column] for column in self.columns)
+        else:
+            row = tuple(row)
+        self.data[self.length] = row
+        self.length += 1
+        self.frame = None
+
+    def column(self, name):
+        # View of one column, only valid until the next append
+        return self.data[name][:self.length]
+
+    def to_dataframe(self):
+        if self.frame is None:
+            self.frame = pd.DataFrame(self.data[:self.length].copy())
+
+        return self.frame
@@ -1,15 +1,18 @@
 import sys
 from Sun_EC1X import SunEC1xChamber
-import pandas as pd
+from Sweep_Buffer import SweepBuffer
 from time import sleep, time
 from datetime import timedelta, datetime
 from statistics import stdev, mean, StatisticsError
 
 
-def temp_step(step_temp: float, log_file: str, ramp=5.0, dwell=30, stab_int=10, temp_tol=0.5, stdev_tol=0.5):
+def temp_step(step_temp: float, log_file: str, ramp=5.0, dwell=30, stab_int=10, temp_tol=0.5, stdev_tol=0.5,
+              io_writer=None):
+    # With a Background_Writer.BackgroundWriter as io_writer the log file is written on its thread
     sun = SunEC1xChamber(parent=None, gpib_addr='GPIB0::6::INSTR')
 
-    df = pd.DataFrame(columns=['timestamp', 'user_t', 'chamber_t'])
+    log = SweepBuffer(['timestamp', 'user_t', 'chamber_t'], capacity=int(dwell * 60) // stab_int + 1,
+                      dtypes={'timestamp': 'M8[us]'})
     row = {}
 
     # Send the command to change the temperature
@@ -40,7 +43,7 @@ def temp_step(step_temp: float, log_file: str, ramp=5.0, dwell=30, stab_int=10,
             row['user_t'] = sun.get_user_temp()
             sleep(0.05)
             row['chamber_t'] = sun.get_temp()
-            df = df.append(row, ignore_index=True)
+            log.append(row)
         count += 1
         time_left = str(timedelta(seconds=int(dwell * 60) - i))
         print("Checking stability at {temp}. Time Remaining: {time}  ".format(temp=step_temp, time=time_left), end='\r')
@@ -52,10 +55,10 @@ def temp_step(step_temp: float, log_file: str, ramp=5.0, dwell=30, stab_int=10,
     print('Temperature stability check was scheduled for {} s, and took {} s.'.format(dwell * 60,
                                                                                       time() - start_time))
     try:
-        user_avg = mean(df.user_t)
-        user_stdev = stdev(df.user_t, user_avg)
-        chamber_avg = mean(df.chamber_t)
-        chamber_stdev = stdev(df.chamber_t, chamber_avg)
+        user_avg = mean(log.column('user_t'))
+        user_stdev = stdev(log.column('user_t'), user_avg)
+        chamber_avg = mean(log.column('chamber_t'))
+        chamber_stdev = stdev(log.column('chamber_t'), chamber_avg)
     except StatisticsError:
         print('Error on performing statistics calculations.')
         user_avg = 99999
@@ -71,7 +74,10 @@ def temp_step(step_temp: float, log_file: str, ramp=5.0, dwell=30, stab_int=10,
                                                                               stdev=chamber_stdev, stdevtol=stdev_tol))
         sleep(2)
         return temp_step(step_temp=step_temp, log_file=log_file, ramp=ramp, dwell=dwell, stab_int=stab_int,
-                         temp_tol=temp_tol, stdev_tol=stdev_tol)
+                         temp_tol=temp_tol, stdev_tol=stdev_tol, io_writer=io_writer)
 
     # if equilibrium is good, write temp data to a file
-    df.to_csv(log_file, sep=',',)
+    if io_writer is not None:
+        io_writer.submit(log.to_dataframe().to_csv, log_file, sep=',',)
+    else:
+        log.to_dataframe().to_csv(log_file, sep=',',)
@@ -0,0 +1,117 @@
+from pyvisa.errors import VisaIOError
+from time import sleep, monotonic, perf_counter
+from Instrument_Tracing import tracer, result_size
+
+
+# Default VISA timeouts [ms] for each class of command. Fetches include the measurement time on the instrument.
+DEFAULT_TIMEOUTS = {'write': 2000,
+                    'query': 2000,
+                    'fetch': 10000,
+                    'idn': 500}
+
+
+class InstrumentIOError(Exception):
+    # Raised when a command still fails after every retry, or is refused because the circuit breaker is open.
+    #  Carries an abbreviation like VisaIOError so existing error messages can print it the same way.
+    def __init__(self, message, abbreviation='VI_ERROR_IO'):
+        super().__init__(message)
+        self.abbreviation = abbreviation
+
+
+class VisaIOPolicy(object):
+    # Shared retry/timeout policy for instrument I/O. Every call gets the timeout of its command class, failed
+    #  attempts are retried a fixed number of times with capped exponential backoff, and after breaker_threshold
+    #  consecutive failed calls the breaker opens and calls fail immediately for breaker_cooldown seconds. After the
+    #  cooldown the breaker is half open: the next call is sent once, without retries, as a probe while any other
+    #  call is refused. The breaker closes if the probe succeeds and opens for another cooldown if it fails.
+    def __init__(self, name, timeouts=None, max_retries=3, backoff_base=0.1, backoff_cap=2.0,
+                 breaker_threshold=5, breaker_cooldown=30.0):
+        self.name = name
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self.consecutive_failures = 0
+        self.breaker_open_until = 0.0
+        self.probing = False
+        self.counters = {'calls': 0,
+                         'retries': 0,
+                         'timeouts': 0,
+                         'failures': 0,
+                         'breaker_trips': 0,
+                         'rejected': 0,
+                         'max_call_time': 0.0}
+
+    def breaker_open(self):
+        return self.probing or monotonic() < self.breaker_open_until
+
+    def trip_breaker(self):
+        self.counters['breaker_trips'] += 1
+        self.breaker_open_until = monotonic() + self.breaker_cooldown
+
+    def call(self, resource, func, command, command_class='write', timeout=None, retry_on=(VisaIOError,)):
+        # Run func(command) under the policy and return its result. resource is the VISA resource whose timeout is
+        #  set for the duration of the call.
+        if self.breaker_open():
+            self.counters['rejected'] += 1
+            raise InstrumentIOError('{}: circuit breaker open, "{}" not sent'.format(self.name, command),
+                                    'BREAKER_OPEN')
+
+        # The first call after a cooldown is the probe of the half open breaker
+        probe = self.consecutive_failures >= self.breaker_threshold
+        max_retries = 0 if probe else self.max_retries
+        self.probing = probe
+        self.counters['calls'] += 1
+        start = perf_counter()
+        prev_timeout = resource.timeout
+        resource.timeout = timeout if timeout is not None else self.timeouts[command_class]
+        last_error = None
+        result = None
+        attempts = 0
+        try:
+            for attempt in range(0, max_retries + 1):
+                attempts += 1
+                try:
+                    result = func(command)
+                except retry_on as error:
+                    last_error = error
+                    if getattr(error, 'abbreviation', None) == 'VI_ERROR_TMO':
+                        self.counters['timeouts'] += 1
+                    if attempt < max_retries:
+                        self.counters['retries'] += 1
+                        sleep(min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                else:
+                    self.consecutive_failures = 0
+                    return result
+        finally:
+            self.probing = False
+            resource.timeout = prev_timeout
+            duration = perf_counter() - start
+            self.counters['max_call_time'] = max(self.counters['max_call_time'], duration)
+            tracer.record('{} {}'.format(self.name, command_class), 'io', start, duration,
+                          command=str(command)[:200], retries=attempts - 1, result_size=result_size(result))
+
+        self.counters['failures'] += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.breaker_threshold:
+            self.trip_breaker()
+
+        raise InstrumentIOError('{}: "{}" failed after {} attempts ({})'.format(self.name, command, attempts,
+                                                                              last_error),
+                                getattr(last_error, 'abbreviation', type(last_error).__name__))
+
+    def write(self, resource, command, command_class='write', timeout=None):
+        return self.call(resource, resource.write, command, command_class, timeout)
+
+    def query(self, resource, command, command_class='query', timeout=None):
+        return self.call(resource, resource.query, command, command_class, timeout)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['breaker_open'] = self.breaker_open()
+        return stats
@@ -4,6 +4,7 @@ import random
 from PyQt5.QtCore import QObject
 from PyQt5.QtCore import pyqtSignal
 from time import sleep
+from contextlib import contextmanager
 
 
 class AgilentE4980A(QObject):
@@ -13,6 +14,7 @@ class AgilentE4980A(QObject):
         super().__init__()
 
         self.lcr_addr = ''
+        self.last_acquisition_latency = 0.0
 
         try:
             self.lcr = self.connect_lcr()
@@ -120,6 +122,58 @@ class AgilentE4980A(QObject):
         sleep(0.5)
         return data
 
+    @contextmanager
+    def batch(self, opc=False):
+        yield self
+
+    def invalidate_cache(self):
+        pass
+
+    def cache_stats(self):
+        return {'hits': 0, 'misses': 0}
+
+    def set_binary_transfer(self, enable: bool):
+        if enable:
+            print(':FORM:DATA REAL')
+        else:
+            print(':FORM:DATA ASC')
+
+    def setup_triggered_acquisition(self):
+        print(':TRIG:SOUR BUS')
+
+    def end_triggered_acquisition(self):
+        print(':TRIG:SOUR INT')
+
+    def get_triggered_data(self, freq=None, timeout=10000):
+        if freq is not None:
+            self.signal_frequency(freq)
+        data = self.get_data()
+        self.last_acquisition_latency = 0.5
+        return data
+
+    def setup_list_sweep(self, step_delay=0):
+        print(':DISP:PAGE LIST')
+        print(':LIST:MODE SEQ')
+        print(':TRIG:DEL {}'.format(step_delay))
+
+    def end_list_sweep(self):
+        print(':DISP:PAGE MEAS')
+
+    def get_list_sweep_data(self, freqs, timeout_per_point=2000):
+        print(':LIST:FREQ {}'.format(','.join(str(freq) for freq in freqs)))
+
+        data = []
+        for freq in freqs:
+            point = [freq, 1e5 * (random.random() + 0.001), -90 * (random.random() + 0.001), random.randint(0, 1)]
+            self.new_data.emit(point)
+            data.append(point)
+
+        sleep(0.05 * len(freqs))
+        return data
+
+    def iter_list_sweep_data(self, freqs, timeout_per_point=2000):
+        yield self.get_list_sweep_data(freqs, timeout_per_point)
+
     def get_function_parameters(self):
         func_params = PARAMETERS_BY_FUNC[self.lcr.query(':FUNC:IMP?').rstrip()]
 